@@ -0,0 +1,252 @@
+'''
+Microbenchmarks for parsing, compiling and evaluating rules, run by `manage.py benchmarkrules`.
+
+Rules are generated synthetically, so the benchmarks need nothing but a database (SQLite works). Every benchmark
+returns one JSON-serializable result:
+
+{
+    "name": "eval_first_true_rule",
+    "params": {"num_rules": 1000, "num_conditions": 3},
+    "iterations": 412,
+    "ops_per_second": 2023.4,
+    "p50_ms": 0.48,
+    "p99_ms": 0.71,
+    "queries_per_op": 0.0,
+    "peak_memory_bytes": 18432,
+}
+
+Timings are taken without tracemalloc; the peak memory comes from a separate, shorter pass with tracemalloc running.
+'''
+
+import platform
+import random
+import time
+import tracemalloc
+
+import django
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .logic import get_jsonlogic, is_valid_logic_string, logic_string_cache
+from .models import Rule, Condition, RuleActionPair, Property, Action, BoolOperator, bulk_create_rules, get_conditions_by_index
+from .rule_manager import RuleManager
+
+default_rule_counts = [10, 1000, 100000]
+default_condition_counts = [1, 2, 5, 10, 20, 50]
+
+def get_bench_value(value: int):
+    return value
+
+def increment_bench_hits(target: dict):
+    target["hits"] = target["hits"] + 1
+    return target
+
+def reset_bench_hits(target: dict):
+    target["hits"] = 0
+    return target
+
+_bench_property_functions = {
+    "bench_value": [get_bench_value],
+}
+_bench_boolops = {
+    "bench_value": ["==", ">", "<"],
+}
+_bench_action_functions = {
+    "bench_target": [increment_bench_hits, reset_bench_hits],
+}
+_bench_context_types = ["bench_value", "bench_target"]
+
+BenchmarkRuleManager = RuleManager(
+    property_function_dict=_bench_property_functions,
+    action_function_dict=_bench_action_functions,
+    boolOperator_string_dict=_bench_boolops,
+    context_types=_bench_context_types,
+    # revision queries would show up in the timings and in queries_per_op
+    revision_check_interval=None,
+)
+
+def run_benchmarks(rule_counts=None, condition_counts=None, eval_conditions=3, min_time=1.0, max_iterations=10000, seed=0):
+    # runs against the current database and leaves the generated rules in it
+    rule_counts = default_rule_counts if rule_counts is None else rule_counts
+    condition_counts = default_condition_counts if condition_counts is None else condition_counts
+    options = {"min_time": min_time, "max_iterations": max_iterations}
+    rand = random.Random(seed)
+
+    results = [bench_createrulemodels(**options)]
+    for num_conditions in condition_counts:
+        logic_strings = [get_logic_string(num_conditions, rand) for _ in range(100)]
+        results.append(bench_is_valid_logic_string(logic_strings, num_conditions, **options))
+        results.append(bench_get_jsonlogic(logic_strings, num_conditions, **options))
+        results.append(bench_set_jsonlogic_if_statement(num_conditions, rand, **options))
+    for num_rules in rule_counts:
+        results.extend(bench_eval(num_rules, eval_conditions, rand, **options))
+
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "results": results,
+    }
+
+def bench_createrulemodels(**options):
+    def setup():
+        Property.objects.filter(context_type__in=_bench_context_types).delete()
+        Action.objects.filter(context_type__in=_bench_context_types).delete()
+        BoolOperator.objects.filter(context_type__in=_bench_context_types).delete()
+
+    def create_rule_models(iteration):
+        with override_settings(RULES_MODELS_SETUP_MODULES=[__name__]):
+            call_command('createrulemodels')
+
+    result = measure("createrulemodels", {}, create_rule_models, setup=setup, **options)
+    BenchmarkRuleManager.build_models()
+    return result
+
+# the parse benchmarks clear the logic string cache before every call, so they time parsing rather than cache hits
+
+def bench_is_valid_logic_string(logic_strings, num_conditions, **options):
+    def is_valid(iteration):
+        if not is_valid_logic_string(logic_strings[iteration % len(logic_strings)], num_conditions):
+            raise ValueError('generated an invalid logic string')
+    return measure("is_valid_logic_string", {"num_conditions": num_conditions}, is_valid, setup=logic_string_cache.cache_clear, **options)
+
+def bench_get_jsonlogic(logic_strings, num_conditions, **options):
+    def parse(iteration):
+        get_jsonlogic(logic_strings[iteration % len(logic_strings)])
+    return measure("get_jsonlogic", {"num_conditions": num_conditions}, parse, setup=logic_string_cache.cache_clear, **options)
+
+def bench_set_jsonlogic_if_statement(num_conditions, rand, **options):
+    rule_action_pairs = create_synthetic_rules(10, num_conditions, rand, "set-if-" + str(num_conditions))
+    rule_action_pairs = list(RuleActionPair.objects.select_related('rule', 'action').filter(
+        pk__in=[rule_action_pair.pk for rule_action_pair in rule_action_pairs]))
+
+    def set_if_statement(iteration):
+        rule_action_pairs[iteration % len(rule_action_pairs)].set_jsonlogic_if_statement()
+    return measure("set_jsonlogic_if_statement", {"num_conditions": num_conditions}, set_if_statement, **options)
+
+def bench_eval(num_rules, num_conditions, rand, **options):
+    rule_action_pairs = create_synthetic_rules(num_rules, num_conditions, rand, "eval-" + str(num_rules))
+    rule_names = [rule_action_pair.rule.name for rule_action_pair in rule_action_pairs]
+    values = [rand.randint(0, 100) for _ in range(100)]
+    target = {"hits": 0}
+    # the rule set is loaded once; the eval benchmarks measure warm evaluation
+    BenchmarkRuleManager.get_rule_set(*rule_names)
+
+    params = {"num_rules": num_rules, "num_conditions": num_conditions}
+    results = []
+    for eval_method_name in ["eval_first_true_rule", "eval_all_rules"]:
+        eval_method = getattr(BenchmarkRuleManager, eval_method_name)
+
+        def evaluate(iteration):
+            eval_method(*rule_names, bench_value=values[iteration % len(values)], bench_target=target)
+        results.append(measure(eval_method_name, params, evaluate, **options))
+    return results
+
+def measure(name, params, function, setup=None, min_time=1.0, max_iterations=10000, min_iterations=5):
+    # calls function(iteration) until min_time seconds have passed (at least min_iterations times)
+    durations = []
+    num_queries = 0
+    started = time.perf_counter()
+    while len(durations) < max_iterations and (len(durations) < min_iterations or time.perf_counter() - started < min_time):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            function(len(durations))
+            durations.append(time.perf_counter() - start)
+        num_queries = num_queries + len(queries)
+
+    tracemalloc.start()
+    try:
+        for iteration in range(min(len(durations), min_iterations)):
+            if setup is not None:
+                setup()
+            tracemalloc.reset_peak()
+            function(iteration)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(durations),
+        "ops_per_second": len(durations) / sum(durations),
+        "p50_ms": _get_percentile(durations, 50) * 1e3,
+        "p99_ms": _get_percentile(durations, 99) * 1e3,
+        "queries_per_op": num_queries / len(durations),
+        "peak_memory_bytes": peak_memory,
+    }
+
+def _get_percentile(sorted_values, percentile):
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def get_logic_string(num_conditions, rand):
+    # conditions 1..num_conditions in groups of up to three OR'ed terms, AND'ed together; some terms are negated
+    if num_conditions == 1:
+        return "1"
+    groups = []
+    condition_number = 1
+    while condition_number <= num_conditions:
+        group_size = min(rand.randint(1, 3), num_conditions - condition_number + 1)
+        terms = []
+        for number in range(condition_number, condition_number + group_size):
+            terms.append(("NOT " if rand.random() < 0.2 else "") + str(number))
+        groups.append(terms[0] if group_size == 1 else "(" + " OR ".join(terms) + ")")
+        condition_number = condition_number + group_size
+    return " AND ".join(groups)
+
+def create_synthetic_rules(num_rules, num_conditions, rand, name_prefix):
+    # Rules with num_conditions random 'bench_value' conditions each and ready if-statements, created with bulk inserts.
+    # Needs the models of BenchmarkRuleManager (see bench_createrulemodels).
+    value_property = Property.objects.get(function_name="get_bench_value", context_type="bench_value")
+    freetext_property = Property.objects.get(function_name="freetext", context_type="bench_value")
+    operators = list(BoolOperator.objects.filter(context_type="bench_value"))
+    actions = list(Action.objects.filter(context_type="bench_target"))
+
+    rules = []
+    rule_conditions = []
+    for index in range(num_rules):
+        logic_string = get_logic_string(num_conditions, rand)
+        conditions = []
+        for rule_index in range(1, num_conditions + 1):
+            operator = rand.choice(operators)
+            freetext_object = str(rand.randint(0, 100))
+            conditions.append(Condition(
+                rule_index = rule_index,
+                operand_subject = value_property,
+                operand_object = freetext_property,
+                freetext_object = freetext_object,
+                operator = operator,
+                jsonlogic_condition = { operator.jsonlogic_operator: [{ "var": value_property.function_name }, freetext_object] },
+            ))
+        rule = Rule(
+            name = name_prefix + "-" + str(index),
+            logic_string = logic_string,
+            num_conditions = num_conditions,
+        )
+        rule.set_jsonlogic_only_boolean_symbols()
+        rule.jsonlogic_full_conditions = rule.replace_jsonlogic_symbols_recur(
+            rule.jsonlogic_only_boolean_symbols, get_conditions_by_index(conditions))
+        rules.append(rule)
+        rule_conditions.append(conditions)
+
+    bulk_create_rules(rules)
+    conditions = []
+    rule_action_pairs = []
+    for rule, conditions_of_rule in zip(rules, rule_conditions):
+        for condition in conditions_of_rule:
+            condition.rule = rule
+            conditions.append(condition)
+        action = rand.choice(actions)
+        rule_action_pairs.append(RuleActionPair(
+            rule = rule,
+            action = action,
+            jsonlogic_if_statement = { "if": [rule.jsonlogic_full_conditions, action.function_name, "do_nothing"] },
+        ))
+    Condition.objects.bulk_create(conditions)
+    RuleActionPair.objects.bulk_create(rule_action_pairs)
+    return rule_action_pairs
@@ -0,0 +1,73 @@
+'''
+Bounded, thread-safe cache with functools.lru_cache style statistics, shared by the memoized property functions
+(property_cache.py), the decision cache (decision_cache.py) and the logic string cache (logic.py).
+'''
+
+import collections
+import threading
+import time
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+eviction_policies = ("lru", "fifo")
+
+class BoundedCache():
+    '''
+    Keeps at most maxsize entries (None for no bound) and evicts the least recently used ('lru') or the oldest ('fifo')
+    entry first. With ttl, an entry expires ttl seconds of timer() after it was put. Unhashable keys are never cached.
+    '''
+
+    def __init__(self, maxsize=128, ttl=None, eviction="lru", timer=time.monotonic):
+        if eviction not in eviction_policies:
+            raise ValueError('invalid eviction policy ' + str(eviction))
+        if maxsize is not None and maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.eviction = eviction
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expiry time or None)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        # the value cached for key, or default; counts a hit or a miss
+        with self._lock:
+            try:
+                entry = self._entries.get(key)
+            except TypeError:
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or self.timer() < expires_at:
+                    self.hits = self.hits + 1
+                    if self.eviction == "lru":
+                        self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+            self.misses = self.misses + 1
+            return default
+
+    def put(self, key, value):
+        try:
+            hash(key)
+        except TypeError:
+            return
+        with self._lock:
+            expires_at = self.timer() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while self.maxsize is not None and len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
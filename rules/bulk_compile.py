@@ -0,0 +1,50 @@
+'''
+Recompiles the jsonlogic of many rules at once, e.g. after a property rename. Rule.set_jsonlogic_conditions and
+RuleActionPair.set_jsonlogic_if_statement save every object on its own; compile_rules instead reads the conditions
+(with their properties and operators) and rule action pairs of each batch of rules in two queries, computes the
+jsonlogic in memory and writes everything back with bulk_update inside one transaction.
+
+bulk_update sends no post_save signals, so the rule set revision is bumped explicitly.
+'''
+
+
+from django.db import transaction
+
+from .models import Rule, Condition, RuleActionPair, get_conditions_by_index
+from .revision import bump_revision
+
+def compile_rules(rules=None, batch_size=1000):
+    # rules is a Rule queryset or an iterable of Rules; all rules by default. Returns the number of compiled rules.
+    if rules is None:
+        rules = Rule.objects.all()
+    rules = list(rules)
+
+    with transaction.atomic():
+        for start in range(0, len(rules), batch_size):
+            _compile_batch(rules[start:start + batch_size])
+        bump_revision()
+    return len(rules)
+
+def _compile_batch(rules):
+    rule_ids = [rule.pk for rule in rules]
+    conditions_by_rule_id = {rule_id: [] for rule_id in rule_ids}
+    conditions = list(Condition.objects.select_related('operand_subject', 'operand_object', 'operator').filter(rule_id__in=rule_ids))
+    for condition in conditions:
+        condition.set_jsonlogic_condition()
+        conditions_by_rule_id[condition.rule_id].append(condition)
+
+    rules_by_id = {}
+    for rule in rules:
+        rule.set_jsonlogic_only_boolean_symbols()
+        rule.jsonlogic_full_conditions = rule.replace_jsonlogic_symbols_recur(
+            rule.jsonlogic_only_boolean_symbols, get_conditions_by_index(conditions_by_rule_id[rule.pk]))
+        rules_by_id[rule.pk] = rule
+
+    rule_action_pairs = list(RuleActionPair.objects.select_related('action').filter(rule_id__in=rule_ids))
+    for rule_action_pair in rule_action_pairs:
+        rule_action_pair.rule = rules_by_id[rule_action_pair.rule_id]
+        rule_action_pair.set_jsonlogic_if_statement_from_rule()
+
+    Condition.objects.bulk_update(conditions, ['jsonlogic_condition'])
+    Rule.objects.bulk_update(rules, ['jsonlogic_only_boolean_symbols', 'jsonlogic_full_conditions'])
+    RuleActionPair.objects.bulk_update(rule_action_pairs, ['jsonlogic_if_statement'])
@@ -0,0 +1,402 @@
+'''
+Compiles jsonlogic statements into nested Python closures so that a stored RuleActionPair.jsonlogic_if_statement
+only has to be walked once instead of on every evaluation.
+
+Conditions use the native operators of operators.py, which coerce exactly like json_logic, so a compiled statement
+returns exactly what jsonLogic(statement, data) would. A condition comparing a var with a literal is compiled into a
+single function that looks the var up and compares it with the literal converted at compile time. Operators the
+compiler does not know about fall back to json_logic's own functions, or to jsonLogic itself.
+
+Calling nested closures takes a Python stack frame per level, so statements nested deeper than max_closure_depth
+compile their if/and/or/!/!! skeleton to a flat program of jumps instead, run by a loop (see _compile_program).
+'''
+
+import functools
+import json
+import threading
+
+from json_logic import jsonLogic, operations as jsonlogic_operations
+
+from .operators import get_literal_comparison, native_operations
+
+_data_dependent_operators = ("?:", "filter", "map", "reduce", "all", "none", "some", "missing", "missing_some")
+_condition_operators = ('==', '!=', '>', '>=', '<', '<=', 'in')
+_control_operators = ("if", "and", "or", "!", "!!")
+max_closure_depth = 50
+
+class CompiledLogic():
+
+    def __init__(self, logic, function, var_names):
+        self.logic = logic
+        self.function = function
+        self.var_names = frozenset(var_names)
+
+    def __call__(self, data):
+        return self.function(data)
+
+def compile_jsonlogic(logic, shared_conditions=None):
+    # With a SharedConditionTable, conditions are evaluated through the table and the compiled statement
+    # must be called with data that has a condition_results list (see rule_manager.EvaluationContext).
+    var_names = set()
+    if get_jsonlogic_depth(logic) > max_closure_depth:
+        function = _compile_program(logic, var_names, shared_conditions)
+    else:
+        function = _compile_node(logic, var_names, shared_conditions)
+    return CompiledLogic(logic, function, var_names)
+
+def get_jsonlogic_depth(logic):
+    # number of nested operations, counted without recursion
+    depth = 0
+    stack = [(logic, 0)]
+    while stack:
+        logic, logic_depth = stack.pop()
+        if type(logic) in (list, tuple):
+            stack.extend((element, logic_depth) for element in logic)
+        elif _is_logic(logic):
+            depth = max(depth, logic_depth + 1)
+            stack.append((list(logic.values())[0], logic_depth + 1))
+    return depth
+
+def _is_logic(logic):
+    return type(logic) == dict and len(logic) == 1
+
+def _compile_node(logic, var_names, shared_conditions=None):
+
+    if type(logic) in (list, tuple):
+        element_functions = [_compile_node(element, var_names, shared_conditions) for element in logic]
+        return lambda data: [element_function(data) for element_function in element_functions]
+
+    if not _is_logic(logic):
+        return lambda data: logic
+
+    operator = list(logic.keys())[0]
+    values = logic[operator]
+    if type(values) not in (list, tuple):
+        values = [values]
+
+    if operator == "var":
+        return _compile_var(logic, var_names)
+
+    if operator in _data_dependent_operators or operator not in jsonlogic_operations:
+        # Not worth compiling; let jsonLogic interpret this subtree
+        var_names.update(_get_literal_var_names(logic))
+        return lambda data: jsonLogic(logic, data)
+
+    if operator in _condition_operators:
+        function = _compile_condition(operator, values, var_names, shared_conditions)
+        if shared_conditions is not None:
+            return shared_conditions.get_shared_function(logic, function)
+        return function
+
+    arg_functions = [_compile_node(value, var_names, shared_conditions) for value in values]
+
+    if operator == "if":
+        return _compile_if(arg_functions)
+    if operator == "and":
+        return _compile_and(arg_functions)
+    if operator == "or":
+        return _compile_or(arg_functions)
+    if operator == "!":
+        first = arg_functions[0]
+        return lambda data: not first(data)
+    if operator == "!!":
+        first = arg_functions[0]
+        return lambda data: bool(first(data))
+    return _compile_operation(jsonlogic_operations[operator], arg_functions)
+
+def _compile_operation(operation, arg_functions):
+    if len(arg_functions) == 2:
+        left, right = arg_functions
+        return lambda data: operation(left(data), right(data))
+    return lambda data: operation(*[arg_function(data) for arg_function in arg_functions])
+
+def _compile_condition(operator, values, var_names, shared_conditions):
+    # {operator: [var, literal]} or {operator: [literal, var]} becomes one function; anything else calls the native
+    # operator on its compiled arguments
+    if len(values) == 2:
+        for var_index in (0, 1):
+            var, literal = values[var_index], values[1 - var_index]
+            if _is_simple_var(var) and not _is_logic(literal) and type(literal) not in (list, tuple, dict):
+                return _compile_var_literal_condition(operator, var, literal, var_index == 0, var_names)
+
+    arg_functions = [_compile_node(value, var_names, shared_conditions) for value in values]
+    return _compile_operation(native_operations[operator], arg_functions)
+
+def _compile_var_literal_condition(operator, var, literal, literal_is_right, var_names):
+    var_name, default = _get_var_name_and_default(var)
+    var_names.add(var_name)
+    compare = get_literal_comparison(operator, literal, literal_is_right)
+
+    def condition(data):
+        try:
+            value = data[var_name]
+        except (KeyError, TypeError):
+            value = default
+        return compare(value)
+    return condition
+
+def _compile_var(logic, var_names):
+    if not _is_simple_var(logic):
+        # dotted paths, whole-data lookups and computed names keep the jsonLogic behaviour
+        var_names.update(_get_literal_var_names(logic))
+        return lambda data: jsonLogic(logic, data)
+
+    var_name, default = _get_var_name_and_default(logic)
+    var_names.add(var_name)
+
+    def get_var(data):
+        try:
+            return data[var_name]
+        except (KeyError, TypeError):
+            return default
+    return get_var
+
+def _is_simple_var(logic):
+    # a plain property name with an optional literal default, looked up with data[var_name]
+    if not _is_logic(logic) or "var" not in logic:
+        return False
+    var_name, default = _get_var_name_and_default(logic)
+    return type(var_name) == str and var_name != "" and "." not in var_name and not _is_logic(default) and type(default) != list
+
+def _get_var_name_and_default(logic):
+    values = logic["var"]
+    if type(values) not in (list, tuple):
+        values = [values]
+    var_name = values[0] if values else None
+    default = values[1] if len(values) > 1 else None
+    return var_name, default
+
+def _compile_if(arg_functions):
+    pairs = [(arg_functions[i], arg_functions[i + 1]) for i in range(0, len(arg_functions) - 1, 2)]
+    otherwise = arg_functions[-1] if len(arg_functions) % 2 else (lambda data: None)
+
+    if len(pairs) == 1:
+        condition, then = pairs[0]
+        return lambda data: then(data) if condition(data) else otherwise(data)
+
+    def if_function(data):
+        for condition, then in pairs:
+            if condition(data):
+                return then(data)
+        return otherwise(data)
+    return if_function
+
+def _compile_and(arg_functions):
+    if not arg_functions:
+        return lambda data: False
+
+    def and_function(data):
+        for arg_function in arg_functions:
+            current = arg_function(data)
+            if not current:
+                return current
+        return current
+    return and_function
+
+def _compile_or(arg_functions):
+    if not arg_functions:
+        return lambda data: False
+
+    def or_function(data):
+        for arg_function in arg_functions:
+            current = arg_function(data)
+            if current:
+                return current
+        return current
+    return or_function
+
+# program instructions: (opcode, argument)
+_LOAD = 0 # value = argument(data)
+_JUMP_IF_FALSE = 1 # if not value: jump to argument
+_JUMP_IF_TRUE = 2 # if value: jump to argument
+_JUMP = 3
+_NOT = 4 # value = not value
+_BOOL = 5 # value = bool(value)
+
+def _compile_program(logic, var_names, shared_conditions):
+    # Lays out the control operators in order, with jumps for their short-circuits: "and" is
+    # a JUMP_IF_FALSE end  b JUMP_IF_FALSE end  c  end:
+    # so the value that ends the "and" is left in place, as jsonLogic returns it. Anything else is compiled to
+    # closures by _compile_node and loaded.
+    program = []
+    work = [("node", logic)]
+    while work:
+        kind, item = work.pop()
+        if kind == "emit":
+            program.append(list(item))
+            continue
+        if kind == "jump":
+            # item is (opcode, the list of instructions to point at the end later)
+            item[1].append(len(program))
+            program.append([item[0], None])
+            continue
+        if kind == "label":
+            for index in item:
+                program[index][1] = len(program)
+            continue
+
+        if not _is_logic(item) or list(item.keys())[0] not in _control_operators:
+            program.append([_LOAD, _compile_node(item, var_names, shared_conditions)])
+            continue
+        operator = list(item.keys())[0]
+        values = item[operator]
+        if type(values) not in (list, tuple):
+            values = [values]
+
+        if operator == "!" or operator == "!!":
+            work.append(("emit", (_NOT if operator == "!" else _BOOL, None)))
+            work.append(("node", values[0] if values else None))
+        elif operator == "if":
+            work.extend(reversed(_get_if_layout(values)))
+        elif not values:
+            program.append([_LOAD, lambda data: False])
+        else:
+            jump_opcode = _JUMP_IF_FALSE if operator == "and" else _JUMP_IF_TRUE
+            end_jumps = []
+            work.append(("label", end_jumps))
+            for index in range(len(values) - 1, -1, -1):
+                work.append(("node", values[index]))
+                if index > 0:
+                    work.append(("jump", (jump_opcode, end_jumps)))
+
+    program = tuple((opcode, argument) for opcode, argument in program)
+    return functools.partial(_run_program, program)
+
+def _get_if_layout(values):
+    # condition JUMP_IF_FALSE next  then JUMP end  next: ...  otherwise  end:
+    layout = []
+    end_jumps = []
+    for index in range(0, len(values) - 1, 2):
+        next_jumps = []
+        layout.append(("node", values[index]))
+        layout.append(("jump", (_JUMP_IF_FALSE, next_jumps)))
+        layout.append(("node", values[index + 1]))
+        layout.append(("jump", (_JUMP, end_jumps)))
+        layout.append(("label", next_jumps))
+    layout.append(("node", values[-1] if len(values) % 2 else None))
+    layout.append(("label", end_jumps))
+    return layout
+
+def _run_program(program, data):
+    value = None
+    position = 0
+    end = len(program)
+    while position < end:
+        opcode, argument = program[position]
+        position = position + 1
+        if opcode == _LOAD:
+            value = argument(data)
+        elif opcode == _JUMP_IF_FALSE:
+            if not value:
+                position = argument
+        elif opcode == _JUMP_IF_TRUE:
+            if value:
+                position = argument
+        elif opcode == _JUMP:
+            position = argument
+        elif opcode == _NOT:
+            value = not value
+        else:
+            value = bool(value)
+    return value
+
+def _get_literal_var_names(logic):
+    # var names inside subtrees handed to jsonLogic; only the top level of a dotted path is a property name
+    var_names = set()
+    if type(logic) in (list, tuple):
+        for element in logic:
+            var_names.update(_get_literal_var_names(element))
+    elif _is_logic(logic):
+        operator = list(logic.keys())[0]
+        values = logic[operator]
+        if type(values) not in (list, tuple):
+            values = [values]
+        if operator == "var" and values and type(values[0]) == str and values[0]:
+            var_names.add(values[0].split('.')[0])
+        for value in values:
+            var_names.update(_get_literal_var_names(value))
+    return var_names
+
+_unevaluated = object()
+
+class SharedConditionTable():
+    '''
+    Deduplicates identical conditions across the if-statements of a rule set. Every distinct condition gets a slot
+    in the evaluation's condition_results list, so it is evaluated at most once per evaluation call.
+    '''
+
+    def __init__(self, conditions=(), reference_slots=None):
+        self.slots = {}
+        self.conditions = list(conditions)
+        # the slot of every reference, in compile order; a table restored with its reference slots (see snapshot.py)
+        # hands them out in that order instead of keying each condition
+        self.restored = reference_slots is not None
+        self.reference_slots = list(reference_slots) if self.restored else []
+        self.num_references = 0
+
+    def get_shared_function(self, logic, function):
+        if self.restored:
+            slot = self.reference_slots[self.num_references]
+        else:
+            key = json.dumps(logic, sort_keys=True)
+            if key not in self.slots:
+                self.slots[key] = len(self.conditions)
+                self.conditions.append(logic)
+            slot = self.slots[key]
+            self.reference_slots.append(slot)
+        self.num_references = self.num_references + 1
+
+        def shared_function(data):
+            result = data.condition_results[slot]
+            if result is _unevaluated:
+                result = function(data)
+                data.condition_results[slot] = result
+                data.condition_evaluations = data.condition_evaluations + 1
+            else:
+                data.saved_condition_evaluations = data.saved_condition_evaluations + 1
+            return result
+        return shared_function
+
+    def get_empty_results(self):
+        return [_unevaluated] * len(self.conditions)
+
+    def __len__(self):
+        return len(self.conditions)
+
+class CompiledIfStatementCache():
+    '''
+    In-process cache of compiled RuleActionPair if-statements, keyed by (pair id, revision).
+    The revision is bumped whenever a rule model is saved or deleted (see signals.py) or another process changed the
+    rules (see revision.RevisionMonitor), which drops every compiled entry.
+    '''
+
+    def __init__(self):
+        self.revision = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, rule_action_pair):
+        if rule_action_pair.pk is None:
+            return compile_jsonlogic(rule_action_pair.jsonlogic_if_statement)
+
+        key = (rule_action_pair.pk, self.revision)
+        compiled = self._entries.get(key)
+        if compiled is None:
+            compiled = compile_jsonlogic(rule_action_pair.jsonlogic_if_statement)
+            with self._lock:
+                if key[1] == self.revision:
+                    self._entries[key] = compiled
+        return compiled
+
+    def invalidate(self):
+        with self._lock:
+            self.revision = self.revision + 1
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+compiled_if_statement_cache = CompiledIfStatementCache()
+
+def get_compiled_if_statement(rule_action_pair):
+    return compiled_if_statement_cache.get(rule_action_pair)
@@ -0,0 +1,44 @@
+'''
+Caches the decisions of a rule set for a combination of property values. Given fixed property values the rules that
+fire, and the actions they return, are always the same, so a decision can be reused by every later eval call that
+sees the same values. Only the decisions are cached; the actions still run on every call.
+
+Building the key reads every property the rule set references, so lazy property evaluation is given up for the calls
+that go through the cache.
+'''
+
+from .bounded_cache import BoundedCache
+
+class DecisionCache(BoundedCache):
+
+    def __init__(self, maxsize=1024):
+        super().__init__(maxsize)
+
+    def get_key(self, rule_set, first_true_only, property_data):
+        # None if a property value is not hashable; such calls are decided without the cache
+        values = []
+        for var_name in rule_set.sorted_var_names:
+            try:
+                value = property_data[var_name]
+            except KeyError:
+                value = None
+            # 1, 1.0 and True hash alike but compare differently against string literals
+            values.append((type(value), value))
+        key = (rule_set.rule_names, rule_set.revision, first_true_only, tuple(values))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        # the decisions stored for key, or None
+        if key is None:
+            return None
+        return super().get(key)
+
+    def put(self, key, decisions):
+        # decisions is a tuple of (rule set position, action function name) for the rules that fired, in rule order
+        if key is None:
+            return
+        super().put(key, decisions)
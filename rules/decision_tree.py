@@ -0,0 +1,198 @@
+'''
+Compiles the if-statements of an ordered list of rules into one decision DAG for first-true evaluation.
+
+Every condition is a boolean combination (and/or/!) of atomic tests such as {"==": [{"var": "color"}, "red"]}. The
+DAG branches on one atomic test per node. Each branch fixes that test's truth value in the conditions of the rules
+that are still undecided, so no test is evaluated twice on any path. A path ends at the first rule whose condition
+became true, or at -1 when no rule can fire any more. The branching test is taken from the first undecided rule,
+since that rule has to be decided first. Among its tests, the one shared by the most undecided rules is preferred.
+Identical subproblems and identical nodes are built only once, so common subtrees are shared.
+
+Rule sets whose DAG would grow past max_nodes or max_depth, whose conditions are nested too deeply to walk, or whose
+if-statements are not of the form {"if": [condition, action, "do_nothing"]}, get no DAG (root is None) and are
+evaluated rule by rule.
+'''
+
+import json
+
+from .compiler import _is_logic, compile_jsonlogic
+from .indexes import get_if_statement_condition
+
+_boolean_operators = ("and", "or", "!", "!!")
+
+class DecisionTree():
+
+    def __init__(self, if_statements, max_nodes=10000, max_depth=400):
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.tests = []
+        self.test_functions = []
+        # action function name per rule position
+        self.actions = {}
+        self.num_nodes = 0
+        self._test_ids = {}
+        self._nodes = {}
+        self._subproblems = {}
+
+        self.root = None
+        rules = []
+        for position, if_statement in enumerate(if_statements):
+            condition = get_if_statement_condition(if_statement)
+            if condition is None or not _is_action(if_statement["if"][1]) or if_statement["if"][2] != "do_nothing":
+                return
+            self.actions[position] = if_statement["if"][1]
+            try:
+                rules.append((position, self._get_formula(condition)))
+            except RecursionError:
+                return
+
+        try:
+            self.root = self._build(tuple(rules), 0)
+        except _DecisionTreeTooLarge:
+            self.root = None
+        # only needed while building
+        self._nodes = {}
+        self._subproblems = {}
+
+    def get_first_true_position(self, data):
+        # position of the first rule whose condition holds, -1 if none does, None if data cannot be decided here
+        node = self.root
+        if node is None:
+            return None
+        try:
+            while type(node) is tuple:
+                node = node[1] if node[0](data) else node[2]
+        except (ValueError, TypeError):
+            # a test raised; rule-by-rule evaluation decides whether it would have been reached
+            return None
+        return node
+
+    def _get_formula(self, logic):
+        # True/False, ("test", test id), ("not", formula) or ("and"/"or", formulas), matching the compiled truthiness
+        if type(logic) in (list, tuple):
+            return len(logic) > 0
+        if not _is_logic(logic):
+            return bool(logic)
+
+        operator = list(logic.keys())[0]
+        if operator not in _boolean_operators:
+            return ("test", self._get_test_id(logic))
+
+        values = logic[operator]
+        if type(values) not in (list, tuple):
+            values = [values]
+        if operator == "!!":
+            return _simplify(self._get_formula(values[0]), None, None)
+        if operator == "!":
+            return _simplify(("not", self._get_formula(values[0])), None, None)
+        if not values:
+            return False
+        return _simplify((operator, tuple(self._get_formula(value) for value in values)), None, None)
+
+    def _get_test_id(self, logic):
+        key = json.dumps(logic, sort_keys=True)
+        if key not in self._test_ids:
+            self._test_ids[key] = len(self.tests)
+            self.tests.append(logic)
+            self.test_functions.append(compile_jsonlogic(logic))
+        return self._test_ids[key]
+
+    def _build(self, rules, depth):
+        pending = []
+        for position, formula in rules:
+            if formula is False:
+                continue
+            pending.append((position, formula))
+            if formula is True:
+                break
+        if not pending:
+            return -1
+        if pending[0][1] is True:
+            return pending[0][0]
+
+        pending = tuple(pending)
+        node = self._subproblems.get(pending)
+        if node is not None:
+            return node
+        if depth >= self.max_depth:
+            raise _DecisionTreeTooLarge()
+
+        test_id = self._choose_test(pending)
+        true_node = self._build(tuple((position, _simplify(formula, test_id, True)) for position, formula in pending), depth + 1)
+        false_node = self._build(tuple((position, _simplify(formula, test_id, False)) for position, formula in pending), depth + 1)
+
+        if true_node is false_node or (type(true_node) is int and true_node == false_node):
+            node = true_node
+        else:
+            key = (test_id, _get_node_key(true_node), _get_node_key(false_node))
+            node = self._nodes.get(key)
+            if node is None:
+                if len(self._nodes) >= self.max_nodes:
+                    raise _DecisionTreeTooLarge()
+                node = (self.test_functions[test_id], true_node, false_node)
+                self._nodes[key] = node
+                self.num_nodes = len(self._nodes)
+        self._subproblems[pending] = node
+        return node
+
+    def _choose_test(self, pending):
+        counts = {}
+        for _, formula in pending:
+            for test_id in set(_get_test_ids(formula)):
+                counts[test_id] = counts.get(test_id, 0) + 1
+        candidates = _get_test_ids(pending[0][1])
+        return max(candidates, key=lambda test_id: (counts[test_id], -candidates.index(test_id)))
+
+class _DecisionTreeTooLarge(Exception):
+    pass
+
+def _is_action(logic):
+    return type(logic) == str and logic != "do_nothing"
+
+def _get_node_key(node):
+    return ("leaf", node) if type(node) is int else id(node)
+
+def _get_test_ids(formula):
+    # test ids in the order they appear
+    if type(formula) is bool:
+        return []
+    if formula[0] == "test":
+        return [formula[1]]
+    if formula[0] == "not":
+        return _get_test_ids(formula[1])
+    test_ids = []
+    for operand in formula[1]:
+        for test_id in _get_test_ids(operand):
+            if test_id not in test_ids:
+                test_ids.append(test_id)
+    return test_ids
+
+def _simplify(formula, test_id, value):
+    # formula with test test_id replaced by value and constants folded away
+    if type(formula) is bool:
+        return formula
+    kind = formula[0]
+    if kind == "test":
+        return value if formula[1] == test_id else formula
+    if kind == "not":
+        operand = _simplify(formula[1], test_id, value)
+        if type(operand) is bool:
+            return not operand
+        if operand[0] == "not":
+            return operand[1]
+        return ("not", operand)
+
+    is_and = kind == "and"
+    operands = []
+    for operand in formula[1]:
+        operand = _simplify(operand, test_id, value)
+        if type(operand) is bool:
+            if operand != is_and:
+                return operand
+            continue
+        operands.append(operand)
+    if not operands:
+        return is_and
+    if len(operands) == 1:
+        return operands[0]
+    return (kind, tuple(operands))
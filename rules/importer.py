@@ -0,0 +1,213 @@
+'''
+Streaming import of rules authored outside Django, in JSON Lines or CSV.
+
+JSON Lines: one rule per line. Conditions are numbered by their position in the list, starting at 1.
+
+{"name": "turn-yellow", "logic_string": "1 AND 2", "action": "set_color_to_yellow",
+ "conditions": [
+    {"context_type": "trafficlight_color", "subject": "get_trafficlight_color", "operator": "==", "freetext_object": "green"},
+    {"context_type": "trafficlight_counter", "subject": "get_trafficlight_counter", "operator": ">", "freetext_object": "4"}
+ ]}
+
+CSV: one row per condition, with the rule columns repeated on every row of a rule; the rows of a rule must be
+consecutive. Columns: name, logic_string, action, action_context_type, context_type, subject, operator, object,
+freetext_subject, freetext_object.
+
+"subject" and "object" name Property function names within the condition's context type and default to "freetext".
+"action_context_type" is only needed when several context types have an action of the same name.
+
+Rules are read lazily and inserted in chunks with bulk_create, one transaction per chunk, so memory stays bounded by
+the chunk size. On databases that do not return primary keys from a bulk insert the rules of a chunk are saved one
+by one (see models.bulk_create_rules). Property, BoolOperator and Action references are resolved from maps loaded
+once. An invalid rule raises RuleImportError; the chunks before it stay imported.
+'''
+
+import csv
+import itertools
+import json
+
+from django.db import transaction
+
+from .logic import LogicStringError, is_valid_logic_string, parse_logic_string
+from .models import Rule, Condition, RuleActionPair, Property, Action, BoolOperator, bulk_create_rules, get_conditions_by_index
+from .revision import bump_revision
+
+csv_columns = ["name", "logic_string", "action", "action_context_type", "context_type", "subject", "operator", "object",
+               "freetext_subject", "freetext_object"]
+
+class RuleImportError(ValueError):
+
+    def __init__(self, message, record_number=None):
+        if record_number is not None:
+            message = 'rule ' + str(record_number) + ': ' + message
+        super().__init__(message)
+        self.record_number = record_number
+
+def import_rules_file(path, file_format=None, chunk_size=1000):
+    # file_format is 'jsonl' or 'csv', taken from the file extension by default. Returns the number of imported rules.
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    with open(path, newline='') as rules_file:
+        if file_format == 'csv':
+            return import_rules(read_rules_csv(rules_file), chunk_size)
+        if file_format == 'jsonl':
+            return import_rules(read_rules_jsonl(rules_file), chunk_size)
+    raise ValueError('unknown rule file format ' + str(file_format))
+
+def read_rules_jsonl(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def read_rules_csv(lines):
+    rows = csv.DictReader(lines)
+    missing_columns = set(["name", "logic_string", "action", "context_type", "subject", "operator"]) - set(rows.fieldnames or [])
+    if missing_columns:
+        raise RuleImportError('missing CSV columns: ' + ', '.join(sorted(missing_columns)))
+    for name, rule_rows in itertools.groupby(rows, key=lambda row: row["name"]):
+        rule_rows = list(rule_rows)
+        first_row = rule_rows[0]
+        yield {
+            "name": name,
+            "logic_string": first_row["logic_string"],
+            "action": first_row["action"],
+            "action_context_type": first_row.get("action_context_type") or None,
+            "conditions": [
+                {column: row.get(column) or "" for column in ["context_type", "subject", "operator", "object", "freetext_subject", "freetext_object"]}
+                for row in rule_rows
+            ],
+        }
+
+def import_rules(records, chunk_size=1000):
+    # records is an iterable of rule dicts as described above. Returns the number of imported rules.
+    references = _References()
+    num_rules = 0
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, num_rules, references)
+        num_rules = num_rules + len(chunk)
+    return num_rules
+
+def _import_chunk(records, first_record_number, references):
+    rules = []
+    rule_conditions = []
+    rule_action_pairs = []
+    names = set()
+    for offset, record in enumerate(records):
+        record_number = first_record_number + offset + 1
+        try:
+            rule, conditions, rule_action_pair = _build_rule(record, references)
+        except (KeyError, TypeError, ValueError) as error:
+            if isinstance(error, RuleImportError):
+                raise RuleImportError(str(error), record_number)
+            raise RuleImportError('invalid rule record: ' + repr(error), record_number)
+        if rule.name in names:
+            raise RuleImportError('duplicate rule name ' + rule.name, record_number)
+        names.add(rule.name)
+        rules.append(rule)
+        rule_conditions.append(conditions)
+        rule_action_pairs.append(rule_action_pair)
+
+    existing_names = list(Rule.objects.filter(name__in=names).values_list('name', flat=True)[:1])
+    if existing_names:
+        raise RuleImportError('rule ' + existing_names[0] + ' already exists')
+
+    with transaction.atomic():
+        bulk_create_rules(rules)
+        conditions = []
+        for rule, conditions_of_rule, rule_action_pair in zip(rules, rule_conditions, rule_action_pairs):
+            for condition in conditions_of_rule:
+                condition.rule = rule
+                conditions.append(condition)
+            rule_action_pair.rule = rule
+        Condition.objects.bulk_create(conditions)
+        RuleActionPair.objects.bulk_create(rule_action_pairs)
+        # bulk_create sends no post_save signals
+        bump_revision()
+
+def _build_rule(record, references):
+    name = record["name"]
+    logic_string = record["logic_string"]
+    if not name or type(name) != str:
+        raise RuleImportError('missing rule name')
+    conditions = []
+    for rule_index, condition_record in enumerate(record["conditions"], start=1):
+        conditions.append(_build_condition(rule_index, condition_record, references))
+    if not conditions:
+        raise RuleImportError('rule ' + name + ' has no conditions')
+    if type(logic_string) != str:
+        raise RuleImportError('invalid logic string ' + repr(logic_string))
+    if not is_valid_logic_string(logic_string, len(conditions)):
+        try:
+            parse_logic_string(logic_string, len(conditions))
+        except LogicStringError as error:
+            raise RuleImportError('invalid logic string ' + repr(logic_string) + ' for ' + str(len(conditions)) + ' conditions: ' + str(error))
+
+    rule = Rule(
+        name = name,
+        logic_string = logic_string,
+        num_conditions = len(conditions),
+    )
+    try:
+        rule.set_jsonlogic_only_boolean_symbols()
+    except LogicStringError as error:
+        raise RuleImportError('invalid logic string for rule ' + name + ': ' + str(error))
+    rule.jsonlogic_full_conditions = rule.replace_jsonlogic_symbols_recur(
+        rule.jsonlogic_only_boolean_symbols, get_conditions_by_index(conditions))
+
+    rule_action_pair = RuleActionPair(
+        rule = rule,
+        action = references.get_action(record["action"], record.get("action_context_type")),
+    )
+    rule_action_pair.set_jsonlogic_if_statement_from_rule()
+    return rule, conditions, rule_action_pair
+
+def _build_condition(rule_index, condition_record, references):
+    context_type = condition_record["context_type"]
+    condition = Condition(
+        rule_index = rule_index,
+        operand_subject = references.get_property(context_type, condition_record.get("subject") or "freetext"),
+        freetext_subject = _get_freetext(condition_record.get("freetext_subject")),
+        operand_object = references.get_property(context_type, condition_record.get("object") or "freetext"),
+        freetext_object = _get_freetext(condition_record.get("freetext_object")),
+        operator = references.get_operator(context_type, condition_record["operator"]),
+    )
+    condition.set_jsonlogic_condition()
+    return condition
+
+def _get_freetext(value):
+    # freetext is stored as a string, like the test helpers' freetext_object = 4
+    return "" if value is None else str(value)
+
+class _References():
+    # Property, BoolOperator and Action objects by name, loaded once per import
+
+    def __init__(self):
+        self.properties = {(prop.context_type, prop.function_name): prop for prop in Property.objects.all()}
+        self.operators = {(operator.context_type, operator.jsonlogic_operator): operator for operator in BoolOperator.objects.all()}
+        self.actions = {}
+        for action in Action.objects.all():
+            self.actions.setdefault(action.function_name, []).append(action)
+
+    def get_property(self, context_type, function_name):
+        try:
+            return self.properties[(context_type, function_name)]
+        except KeyError:
+            raise RuleImportError('unknown property ' + str(function_name) + ' for context type ' + str(context_type))
+
+    def get_operator(self, context_type, jsonlogic_operator):
+        try:
+            return self.operators[(context_type, jsonlogic_operator)]
+        except KeyError:
+            raise RuleImportError('unknown operator ' + str(jsonlogic_operator) + ' for context type ' + str(context_type))
+
+    def get_action(self, function_name, context_type=None):
+        actions = [action for action in self.actions.get(function_name, []) if context_type is None or action.context_type == context_type]
+        if not actions:
+            raise RuleImportError('unknown action ' + str(function_name))
+        if len(actions) > 1:
+            raise RuleImportError('action ' + str(function_name) + ' exists for several context types; set action_context_type')
+        return actions[0]
@@ -0,0 +1,207 @@
+'''
+Candidate selection for rule sets. Most rules are gated on a `{"var": property} == "literal"` test or on a numeric
+threshold test like `{"var": property} > "4"` in their top-level conjunction. A rule can only fire if its gate holds,
+so indexing rules by (property, literal) and by sorted thresholds per property lets an evaluation skip every rule whose
+gate cannot hold for the current property values. Candidates are still evaluated in rule order with their full
+conditions, so the first-true winner is the same as with a full ordered scan.
+
+Selecting candidates reads the gate properties, so those are computed before any rule is decided; the other
+properties are still computed only once a condition reads them.
+'''
+
+import bisect
+import heapq
+import math
+
+from .compiler import _is_logic
+
+class RuleIndex():
+
+    def __init__(self, conditions):
+        # conditions holds one jsonlogic condition per rule in rule order, or None for rules that cannot be indexed
+        self.num_rules = len(conditions)
+        self.ungated_positions = []
+        self.equality_gates = {}
+        self.range_gates = {}
+
+        range_gates = {}
+        for position, condition in enumerate(conditions):
+            gate = _get_equality_gate(condition)
+            if gate is not None:
+                var_name, literal = gate
+                self.equality_gates.setdefault(var_name, {}).setdefault(literal, []).append(position)
+                continue
+            gate = _get_range_gate(condition)
+            if gate is not None:
+                operator, var_name, threshold = gate
+                range_gates.setdefault(var_name, {}).setdefault(operator, []).append((threshold, position))
+                continue
+            self.ungated_positions.append(position)
+
+        for var_name, operator_gates in range_gates.items():
+            self.range_gates[var_name] = {
+                operator: RangeGates(sorted(gates)) for operator, gates in operator_gates.items()
+            }
+
+    def get_gates(self):
+        # the gates as JSON-serializable data, restored with from_gates (see snapshot.py)
+        return {
+            "num_rules": self.num_rules,
+            "ungated_positions": self.ungated_positions,
+            "equality_gates": self.equality_gates,
+            "range_gates": {
+                var_name: {
+                    operator: list(zip(range_gates.thresholds, range_gates.positions))
+                    for operator, range_gates in operator_gates.items()
+                }
+                for var_name, operator_gates in self.range_gates.items()
+            },
+        }
+
+    @classmethod
+    def from_gates(cls, gates):
+        index = cls([])
+        index.num_rules = gates["num_rules"]
+        index.ungated_positions = gates["ungated_positions"]
+        index.equality_gates = gates["equality_gates"]
+        index.range_gates = {
+            var_name: {
+                operator: RangeGates([tuple(gate) for gate in gates_of_operator])
+                for operator, gates_of_operator in operator_gates.items()
+            }
+            for var_name, operator_gates in gates["range_gates"].items()
+        }
+        return index
+
+    def get_candidate_positions(self, data):
+        # positions of the rules that could fire given the property values in data, in rule order
+        if not self.equality_gates and not self.range_gates:
+            return range(self.num_rules)
+
+        position_lists = [self.ungated_positions]
+        for var_name, literal_positions in self.equality_gates.items():
+            # a string literal makes json_logic's '==' compare string forms, so str(value) is an exact lookup key
+            positions = literal_positions.get(str(_get_value(data, var_name)))
+            if positions:
+                position_lists.append(positions)
+
+        range_positions = []
+        for var_name, operator_gates in self.range_gates.items():
+            value = _get_value(data, var_name)
+            for operator, range_gates in operator_gates.items():
+                range_positions.extend(range_gates.get_candidate_positions(operator, value))
+        if range_positions:
+            range_positions.sort()
+            position_lists.append(range_positions)
+
+        # every rule sits in exactly one list, and each list is in rule order
+        return heapq.merge(*position_lists)
+
+class RangeGates():
+    '''
+    Rules gated on `{"var": property} <operator> threshold` for one property and operator, sorted by threshold so the
+    gates that can hold for a value are one slice found by bisection.
+    '''
+
+    def __init__(self, gates):
+        self.thresholds = [threshold for threshold, _ in gates]
+        self.positions = [position for _, position in gates]
+
+    def get_candidate_positions(self, operator, value):
+        if type(value) not in (int, float) or math.isnan(value):
+            # json_logic compares anything but numbers differently (strings as strings, None never); keep them all
+            return self.positions
+        if operator == '>':
+            return self.positions[:bisect.bisect_left(self.thresholds, value)]
+        if operator == '>=':
+            return self.positions[:bisect.bisect_right(self.thresholds, value)]
+        if operator == '<':
+            return self.positions[bisect.bisect_right(self.thresholds, value):]
+        return self.positions[bisect.bisect_left(self.thresholds, value):]
+
+def get_if_statement_condition(if_statement):
+    # the condition of an {"if": [condition, action, "do_nothing"]} statement, or None for any other shape
+    if _is_logic(if_statement) and "if" in if_statement and type(if_statement["if"]) == list and len(if_statement["if"]) == 3:
+        return if_statement["if"][0]
+    return None
+
+def get_conjuncts(condition):
+    # the operands of the top-level (possibly nested) 'and', or the condition itself
+    conjuncts = []
+    stack = [condition]
+    while stack:
+        condition = stack.pop()
+        if _is_logic(condition) and "and" in condition and type(condition["and"]) == list and condition["and"]:
+            stack.extend(reversed(condition["and"]))
+        else:
+            conjuncts.append(condition)
+    return conjuncts
+
+def get_var_literal_comparison(conjunct):
+    # (operator, var name, literal, var is the left operand) for a comparison between a plain var and a literal
+    if not _is_logic(conjunct):
+        return None
+    operator = list(conjunct.keys())[0]
+    operands = conjunct[operator]
+    if type(operands) != list or len(operands) != 2:
+        return None
+
+    left, right = operands
+    if _is_plain_var(left) and not _is_logic(right) and type(right) not in (list, dict):
+        return operator, left["var"], right, True
+    if _is_plain_var(right) and not _is_logic(left) and type(left) not in (list, dict):
+        return operator, right["var"], left, False
+    return None
+
+def _get_equality_gate(condition):
+    if condition is None:
+        return None
+    for conjunct in get_conjuncts(condition):
+        comparison = get_var_literal_comparison(conjunct)
+        if comparison is not None and comparison[0] == '==' and type(comparison[2]) == str:
+            return comparison[1], comparison[2]
+    return None
+
+_flipped_range_operators = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+
+def _get_range_gate(condition):
+    # (operator, var name, numeric threshold) with the var as the left operand
+    if condition is None:
+        return None
+    for conjunct in get_conjuncts(condition):
+        comparison = get_var_literal_comparison(conjunct)
+        if comparison is None or comparison[0] not in _flipped_range_operators:
+            continue
+        operator, var_name, literal, var_is_left = comparison
+        threshold = _get_numeric_threshold(literal)
+        if threshold is None:
+            continue
+        if not var_is_left:
+            operator = _flipped_range_operators[operator]
+        return operator, var_name, threshold
+    return None
+
+def _get_numeric_threshold(literal):
+    # json_logic coerces the literal the same way when the property value is a number
+    if type(literal) not in (int, float, str):
+        return None
+    try:
+        if type(literal) == str and '.' in literal:
+            literal = float(literal)
+        threshold = literal if type(literal) == float else int(literal)
+    except ValueError:
+        return None
+    if math.isnan(threshold):
+        return None
+    return threshold
+
+def _is_plain_var(logic):
+    return _is_logic(logic) and "var" in logic and type(logic["var"]) == str and logic["var"] != "" and "." not in logic["var"]
+
+def _get_value(data, var_name):
+    # a name missing from the property data is no property and reads as None, as a compiled {"var": var_name};
+    # any other error from the lookup, such as a failing property function, is raised
+    try:
+        return data[var_name]
+    except KeyError:
+        return None
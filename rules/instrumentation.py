@@ -0,0 +1,171 @@
+'''
+Instrumentation for RuleManager evaluations: RuleManager(..., instrumentation=InMemoryInstrumentation()).
+
+Every rule decision, property function call and action function call is reported as a MetricEvent:
+
+MetricEvent(kind="rule" | "property" | "action", name=rule or function name, duration=seconds,
+            fired=whether a rule fired (None for functions), num_queries=queries on the default database or None)
+
+A rule's duration covers its condition evaluation, including the property functions it calls for the first time.
+Rules decided through a decision cache or decision tree lookup are not evaluated one by one and report no rule events.
+
+The default NullInstrumentation is disabled, and RuleManager then calls the plain functions, so an uninstrumented
+evaluation costs one attribute check per rule.
+'''
+
+import collections
+import functools
+import inspect
+import random
+import threading
+import time
+
+from django.db import connection
+
+MetricEvent = collections.namedtuple("MetricEvent", ["kind", "name", "duration", "fired", "num_queries"])
+
+class Instrumentation():
+
+    enabled = True
+
+    def __init__(self, count_queries=False):
+        self.count_queries = count_queries
+
+    def record(self, event):
+        raise NotImplementedError
+
+    def call(self, kind, name, function, argument):
+        num_queries = None
+        start = time.perf_counter()
+        if self.count_queries:
+            query_counter = _QueryCounter()
+            with connection.execute_wrapper(query_counter):
+                result = function(argument)
+            num_queries = query_counter.num_queries
+        else:
+            result = function(argument)
+        duration = time.perf_counter() - start
+        self.record(MetricEvent(kind, name, duration, result != 'do_nothing' if kind == "rule" else None, num_queries))
+        return result
+
+    def wrap(self, kind, function):
+        # an instrumented version of a property or action function
+        name = function.__name__
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def instrumented_coroutine_function(argument):
+                start = time.perf_counter()
+                result = await function(argument)
+                self.record(MetricEvent(kind, name, time.perf_counter() - start, None, None))
+                return result
+            return instrumented_coroutine_function
+
+        @functools.wraps(function)
+        def instrumented_function(argument):
+            return self.call(kind, name, function, argument)
+        return instrumented_function
+
+class NullInstrumentation(Instrumentation):
+
+    enabled = False
+
+    def record(self, event):
+        pass
+
+null_instrumentation = NullInstrumentation()
+
+class CallbackInstrumentation(Instrumentation):
+    '''
+    Hands every MetricEvent to callback, e.g. to feed an external metrics pipeline. The callback runs on the
+    evaluating thread and should return quickly.
+    '''
+
+    def __init__(self, callback, count_queries=False):
+        super().__init__(count_queries)
+        self.callback = callback
+
+    def record(self, event):
+        self.callback(event)
+
+class InMemoryInstrumentation(Instrumentation):
+    '''
+    Aggregates events per (kind, name). Latency percentiles are computed from a uniform sample of at most
+    max_samples durations per name.
+    '''
+
+    def __init__(self, count_queries=False, max_samples=1000):
+        super().__init__(count_queries)
+        self.max_samples = max_samples
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def record(self, event):
+        with self._lock:
+            key = (event.kind, event.name)
+            metrics = self.metrics.get(key)
+            if metrics is None:
+                metrics = FunctionMetrics()
+                self.metrics[key] = metrics
+            metrics.add(event, self.max_samples, self._random)
+
+    def get_summary(self):
+        # {kind: {name: {"calls", "fires", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "queries"}}}
+        with self._lock:
+            summary = {}
+            for (kind, name), metrics in self.metrics.items():
+                summary.setdefault(kind, {})[name] = metrics.get_summary()
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self.metrics = {}
+
+class FunctionMetrics():
+
+    def __init__(self):
+        self.calls = 0
+        self.fires = 0
+        self.total_duration = 0.0
+        self.num_queries = 0
+        self.samples = []
+
+    def add(self, event, max_samples, rand):
+        self.calls = self.calls + 1
+        if event.fired:
+            self.fires = self.fires + 1
+        self.total_duration = self.total_duration + event.duration
+        if event.num_queries:
+            self.num_queries = self.num_queries + event.num_queries
+        # reservoir sampling keeps every duration equally likely to be in the sample
+        if len(self.samples) < max_samples:
+            self.samples.append(event.duration)
+        else:
+            index = rand.randrange(self.calls)
+            if index < max_samples:
+                self.samples[index] = event.duration
+
+    def get_percentile(self, percentile):
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))]
+
+    def get_summary(self):
+        return {
+            "calls": self.calls,
+            "fires": self.fires,
+            "total_ms": self.total_duration * 1e3,
+            "mean_ms": self.total_duration / self.calls * 1e3,
+            "p50_ms": self.get_percentile(50) * 1e3,
+            "p95_ms": self.get_percentile(95) * 1e3,
+            "p99_ms": self.get_percentile(99) * 1e3,
+            "queries": self.num_queries,
+        }
+
+class _QueryCounter():
+
+    def __init__(self):
+        self.num_queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.num_queries = self.num_queries + 1
+        return execute(sql, params, many, context)
@@ -1,95 +1,275 @@
 import regex as re
 
-def tokenize(logic_string:str ):
-    return re.findall(r"(AND|OR|NOT|\d+|\(|\))", logic_string)
-
-def is_value(token: str):
-    return re.search(r"^\d+$", token)
-
-def is_operator(string: str):
-    if string == "AND" or string == "OR" or string == "NOT":
-        return True
-    return False
-
-def get_operand_target(operator: str):
-    targets = {
-        "AND": 2,
-        "OR": 2,
-        "NOT": 1,
-    }
-    return targets[operator]
-
-def peek(stack):
-    return stack[-1] if stack else None
-
-def get_shunting_yard_stack(logic_string:str):
-    tokens = tokenize(logic_string)
-    values = []
-    operators = []
-    for token in tokens:
-        if is_value(token):
-            values.append(token)
-        elif token == "(":
-            operators.append(token)
-        elif token == ")":
-            top = peek(operators)
-            while top is not None and top != "(":
-                values.append(operators.pop())
-                top = peek(operators)
-            if top is None:
-                raise ValueError("imbalanced parentheses")
-            operators.pop() # Discard '('
+from .bounded_cache import BoundedCache
+
+class LogicStringError(ValueError):
+    # position is the index of the offending character in the logic string, or None for the string as a whole
+
+    def __init__(self, message, position=None):
+        if position is not None:
+            message = message + ' at position ' + str(position)
+        super().__init__(message)
+        self.position = position
+
+# optional spaces, then one token: an operator, a condition number or a parenthesis
+_token_pattern = re.compile(r" *(?:(AND|OR|NOT)|(\d+)|(\()|(\)))")
+
+def parse_logic_string(logic_string: str, num_args: int = None):
+    # Validates the logic string and builds its jsonlogic in one pass over the tokens. AND and OR have the same
+    # precedence and group from the left, NOT binds to the condition or parenthesis after it, and the operands of
+    # AND and OR are listed right to left: "1 AND 2" is {"AND": ["@2", "@1"]}. With num_args, the condition numbers
+    # must be 1..num_args, each used at least once. Raises LogicStringError.
+    return _parse(logic_string, num_args)[0]
+
+def _parse(logic_string, num_args):
+    # returns the jsonlogic and the set of condition numbers used
+    operands = []
+    operators = [] # "AND", "OR", "NOT" and the positions of open parentheses
+    numbers = set()
+    expect_operand = True
+    position = 0
+    length = len(logic_string)
+    while True:
+        match = _token_pattern.match(logic_string, position)
+        if match is None:
+            position = _skip_spaces(logic_string, position)
+            if position == length:
+                break
+            raise LogicStringError('invalid character ' + repr(logic_string[position]), position)
+        operator, number, left_paren, right_paren = match.groups()
+        token_position = match.end() - len(match.group(0).lstrip(' '))
+        position = match.end()
+
+        if expect_operand:
+            if number is not None:
+                _check_number(number, num_args, token_position)
+                numbers.add(int(number))
+                operands.append('@' + number)
+                _reduce_not(operands, operators)
+                expect_operand = False
+            elif left_paren is not None:
+                operators.append(token_position)
+            elif operator == "NOT" and (not operators or operators[-1] != "NOT"):
+                operators.append(operator)
+            else:
+                raise LogicStringError('expected a condition number, NOT or \'(\' but found ' + repr(match.group(0).strip()), token_position)
         else:
-            # Operator
-           
-            if token == "NOT":  #  NOT takes precedence over AND and OR
-                operators.append(token)
-            else: # juggle AND and OR
-                top = peek(operators)
-                while top is not None and top != "(":
-                    values.append(operators.pop())
-                    top = peek(operators)
-                operators.append(token)
-    while peek(operators) is not None and peek(operators) != "(":
-        values.append(operators.pop())
-    if peek(operators) == "(":
-        raise ValueError("imbalanced parentheses")
-
-    return values
-
-def pop_stack_iter(stack, logic_list, operand_target, operand_counter):
-
-    if peek(stack) is not None:
-        if operand_counter < operand_target:
-            element = stack.pop()
-            if is_operator(element):
-                logic_list.append({element: []})
-                # fill up slots for new operator
-                logic_list[-1][element] = pop_stack_iter(stack, logic_list[-1][element], get_operand_target(element), 0)
+            if operator == "AND" or operator == "OR":
+                _reduce_and_or(operands, operators)
+                operators.append(operator)
+                expect_operand = True
+            elif right_paren is not None:
+                _reduce_and_or(operands, operators)
+                if not operators:
+                    raise LogicStringError('imbalanced parentheses: unmatched \')\'', token_position)
+                operators.pop() # Discard '('
+                _reduce_not(operands, operators)
             else:
-                element = str('@' + element) #Denote substitution slot
-                logic_list.append(element)
-            
-            logic_list = pop_stack_iter(stack, logic_list, operand_target, operand_counter+1)
-
-    return logic_list
+                raise LogicStringError('expected AND, OR or \')\' but found ' + repr(match.group(0).strip()), token_position)
+
+    if expect_operand:
+        if not operands and not operators:
+            raise LogicStringError('empty logic string')
+        raise LogicStringError('logic string ends without a condition', length)
+    _reduce_and_or(operands, operators)
+    if operators:
+        raise LogicStringError('imbalanced parentheses: unclosed \'(\'', operators[-1])
+    if num_args is not None and len(numbers) != num_args:
+        missing_numbers = sorted(set(range(1, num_args + 1)) - numbers)
+        raise LogicStringError('conditions ' + ', '.join(str(number) for number in missing_numbers) + ' are not used')
+    return operands[0], numbers
+
+def _skip_spaces(logic_string, position):
+    while position < len(logic_string) and logic_string[position] == ' ':
+        position = position + 1
+    return position
+
+def _check_number(number, num_args, position):
+    if num_args is not None and not 1 <= int(number) <= num_args:
+        raise LogicStringError('condition ' + number + ' is not between 1 and ' + str(num_args), position)
+
+def _reduce_not(operands, operators):
+    if operators and operators[-1] == "NOT":
+        operators.pop()
+        operands.append({"NOT": [operands.pop()]})
+
+def _reduce_and_or(operands, operators):
+    # at most one AND/OR is pending per parenthesis level, since they group from the left
+    if operators and (operators[-1] == "AND" or operators[-1] == "OR"):
+        operator = operators.pop()
+        right = operands.pop()
+        left = operands.pop()
+        operands.append({operator: [right, left]})
+
+def copy_jsonlogic(jsonlogic):
+    # copy.deepcopy for the dicts, lists and strings of jsonlogic, without recursion
+    copied = [None]
+    stack = [(copied, 0, jsonlogic)]
+    while stack:
+        target, key, value = stack.pop()
+        if type(value) == dict:
+            target[key] = dict.fromkeys(value)
+            stack.extend((target[key], item_key, item) for item_key, item in value.items())
+        elif type(value) == list:
+            target[key] = [None] * len(value)
+            stack.extend((target[key], index, item) for index, item in enumerate(value))
+        else:
+            target[key] = value
+    return copied[0]
+
+_not_cached = object()
+
+class LogicStringCache(BoundedCache):
+    '''
+    Bounded LRU cache of parsed logic strings, keyed on the logic string with runs of spaces collapsed. Rules tend to
+    share a few logic string shapes, so most parses are answered from here. An entry holds the jsonlogic and the
+    condition numbers used, which answers is_valid for any num_args; get_jsonlogic returns a copy, so callers may
+    change the result. Invalid strings are cached too and parsed again only to raise their error, whose position
+    then refers to the string as given.
+    '''
+
+    def __init__(self, maxsize=4096):
+        super().__init__(maxsize)
+
+    def get_jsonlogic(self, logic_string):
+        entry = self._get_entry(logic_string)
+        if entry is None:
+            parse_logic_string(logic_string)
+        return copy_jsonlogic(entry[0])
+
+    def is_valid(self, logic_string, num_args):
+        entry = self._get_entry(logic_string)
+        if entry is None:
+            return False
+        numbers = entry[1]
+        return len(numbers) == num_args and min(numbers) >= 1 and max(numbers) <= num_args
+
+    def _get_entry(self, logic_string):
+        # (jsonlogic, frozenset of condition numbers), or None for an invalid logic string
+        key = normalize_logic_string(logic_string)
+        entry = self.get(key, _not_cached)
+        if entry is not _not_cached:
+            return entry
+
+        try:
+            jsonlogic, numbers = _parse(key, None)
+            entry = (jsonlogic, frozenset(numbers))
+        except LogicStringError:
+            entry = None
+        self.put(key, entry)
+        return entry
+
+logic_string_cache = LogicStringCache()
+
+def normalize_logic_string(logic_string):
+    # "( 1  AND 2 )" -> "( 1 AND 2 )"; only spaces are collapsed, so "1 2" and "12" stay apart
+    return ' '.join(part for part in logic_string.split(' ') if part)
 
 def get_jsonlogic(logic_string:str):
 
     if is_only_one_condition_in_logic_string(logic_string):
         return get_single_condition_placeholder_string()
-    
-    logic_list = []
-    stack = get_shunting_yard_stack(logic_string)
-    if peek(stack) is not None:
-        # assume the first element will be an operator
-        operator = stack.pop()
-        logic_list.append({operator: []})
-        logic_list[-1][operator] = pop_stack_iter(stack, logic_list[-1][operator], get_operand_target(operator), 0)
-    if logic_list:
-        return logic_list[0]
-
-    return {} # Fallback empty value
+
+    return logic_string_cache.get_jsonlogic(logic_string)
+
+def optimize_jsonlogic(jsonlogic):
+    # Simplifies parsed jsonlogic without changing its truth table: nested AND/OR of the same kind become one n-ary
+    # node, NOT NOT x becomes x, NOT is pushed into an AND/OR by De Morgan when that leaves fewer NOTs, repeated
+    # operands are dropped and a node left with one operand is replaced by it. Operand order, and with it the
+    # short-circuit order, is kept. Works bottom-up without recursion; the input is not changed.
+    table = _NodeTable()
+    node_ids = []
+    stack = [(jsonlogic, False)]
+    while stack:
+        node, operands_done = stack.pop()
+        if not operands_done and type(node) != dict:
+            node_ids.append(table.get_id(None, node))
+            continue
+        if not operands_done:
+            operator, operands = next(iter(node.items()))
+            if operator != "NOT":
+                # a chain like A AND B AND C is flattened here in one go, not level by level
+                operands = _get_flat_operands(operator, operands)
+            stack.append(((operator, len(operands)), True))
+            stack.extend((operand, False) for operand in reversed(operands))
+            continue
+        operator, num_operands = node
+        operand_ids = node_ids[len(node_ids) - num_operands:]
+        del node_ids[len(node_ids) - num_operands:]
+        if operator == "NOT":
+            node_ids.append(table.negate(operand_ids[0]))
+        else:
+            node_ids.append(table.and_or(operator, operand_ids))
+    return table.get_jsonlogic(node_ids[0])
+
+def _get_flat_operands(operator, operands):
+    flat_operands = []
+    stack = list(reversed(operands))
+    while stack:
+        operand = stack.pop()
+        if type(operand) == dict and operator in operand:
+            stack.extend(reversed(operand[operator]))
+        else:
+            flat_operands.append(operand)
+    return flat_operands
+
+class _NodeTable():
+    # Hash-consed nodes: equal subtrees share one id, which makes duplicate operands cheap to find.
+    # A node is (None, "@n") for a condition or ("AND"/"OR"/"NOT", tuple of operand ids).
+
+    def __init__(self):
+        self.ids = {}
+        self.nodes = []
+
+    def get_id(self, operator, operands):
+        node = (operator, operands)
+        node_id = self.ids.get(node)
+        if node_id is None:
+            node_id = self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return node_id
+
+    def negate(self, node_id):
+        operator, operands = self.nodes[node_id]
+        if operator == "AND" or operator == "OR":
+            num_negated = sum(1 for operand_id in operands if self.nodes[operand_id][0] == "NOT")
+            if len(operands) - num_negated < num_negated + 1:
+                # De Morgan: NOT (NOT a AND NOT b AND c) is (a OR b OR NOT c)
+                return self.and_or("OR" if operator == "AND" else "AND", [self._negate_once(operand_id) for operand_id in operands])
+        return self._negate_once(node_id)
+
+    def _negate_once(self, node_id):
+        operator, operands = self.nodes[node_id]
+        if operator == "NOT":
+            return operands[0]
+        return self.get_id("NOT", (node_id,))
+
+    def and_or(self, operator, operand_ids):
+        # operands were optimized before, so an operand of the same kind has no operand of that kind itself
+        flat_ids = []
+        seen_ids = set()
+        for operand_id in operand_ids:
+            operand_operator, operand_operands = self.nodes[operand_id]
+            for flat_id in (operand_operands if operand_operator == operator else (operand_id,)):
+                if flat_id not in seen_ids:
+                    seen_ids.add(flat_id)
+                    flat_ids.append(flat_id)
+        if len(flat_ids) == 1:
+            return flat_ids[0]
+        return self.get_id(operator, tuple(flat_ids))
+
+    def get_jsonlogic(self, node_id):
+        jsonlogic = [None]
+        stack = [(jsonlogic, 0, node_id)]
+        while stack:
+            target, index, node_id = stack.pop()
+            operator, operands = self.nodes[node_id]
+            if operator is None:
+                target[index] = operands
+            else:
+                target[index] = {operator: [None] * len(operands)}
+                stack.extend((target[index][operator], operand_index, operand_id) for operand_index, operand_id in enumerate(operands))
+        return jsonlogic[0]
 
 def is_only_one_condition_in_logic_string(logic_string):
     return logic_string == "1"
@@ -189,27 +369,11 @@ def has_valid_number_args(logic_string: str, num_args: int):
     return True
 
 def is_valid_logic_string(logic_string: str, num_args: int):
-    
-    if not has_valid_tokens(logic_string):
-        return False
-    if not has_valid_left_parens(logic_string):
-        return False
-    if not has_valid_right_parens(logic_string):
-        return False
-    if not has_valid_and_or(logic_string):
-        return False
-    if not has_valid_not(logic_string):
-        return False
-    if not has_valid_number_args(logic_string, num_args):
-        return False
-    if not has_balanced_parens(logic_string):
-        return False
-    
-    return True
+    # the has_valid_* checks above test single aspects of a logic string; parse_logic_string checks all of them at once
+    return logic_string_cache.is_valid(logic_string, num_args)
 
 def main():
     logic_string = "((1 AND NOT 2) OR (3 AND (4 OR 5)))"
-    print(get_shunting_yard_stack(logic_string))
     logic_list = get_jsonlogic(logic_string)
     print(logic_list)
 if __name__=="__main__":
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...benchmarks import default_condition_counts, default_rule_counts, run_benchmarks
+
+class Command(BaseCommand):
+
+    help = 'Runs the rule parsing, compilation and evaluation benchmarks on a throwaway test database and writes JSON results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rule-counts', nargs='+', type=int, default=default_rule_counts)
+        parser.add_argument('--condition-counts', nargs='+', type=int, default=default_condition_counts)
+        parser.add_argument('--eval-conditions', type=int, default=3, help='conditions per rule in the eval benchmarks')
+        parser.add_argument('--min-time', type=float, default=1.0, help='seconds to spend on each benchmark')
+        parser.add_argument('--max-iterations', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+
+    def handle(self, *args, **options):
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = run_benchmarks(
+                rule_counts=options['rule_counts'],
+                condition_counts=options['condition_counts'],
+                eval_conditions=options['eval_conditions'],
+                min_time=options['min_time'],
+                max_iterations=options['max_iterations'],
+                seed=options['seed'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ...bulk_compile import compile_rules
+from ...models import Rule
+
+class Command(BaseCommand):
+
+    help = 'Recomputes the jsonlogic of the named rules (all rules by default) with bulk queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rule_names', nargs='*')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rules = Rule.objects.all()
+        if options['rule_names']:
+            rules = rules.filter(name__in=options['rule_names'])
+        num_rules = compile_rules(rules, batch_size=options['batch_size'])
+        self.stdout.write('Compiled ' + str(num_rules) + ' rules')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importer import RuleImportError, import_rules_file
+
+class Command(BaseCommand):
+
+    help = 'Imports rules from a JSON Lines or CSV file (see rules/importer.py for the format).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='default: taken from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            num_rules = import_rules_file(options['path'], file_format=options['format'], chunk_size=options['chunk_size'])
+        except RuleImportError as error:
+            raise CommandError(str(error))
+        self.stdout.write('Imported ' + str(num_rules) + ' rules')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...snapshot import export_snapshot
+
+class Command(BaseCommand):
+
+    help = 'Writes the named rules, in order, to a compiled rule set snapshot file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('rule_names', nargs='+')
+
+    def handle(self, *args, **options):
+        rule_set = export_snapshot(options['path'], *options['rule_names'])
+        self.stdout.write('Wrote ' + str(len(rule_set)) + ' rules to ' + options['path'])
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+def create_revision_row(apps, schema_editor):
+    apps.get_model('rules', 'RuleSetRevision').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rules', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleSetRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_revision_row, migrations.RunPython.noop),
+    ]
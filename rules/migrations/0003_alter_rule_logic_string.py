@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rules', '0002_rulesetrevision'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rule',
+            name='logic_string',
+            field=models.TextField(),
+        ),
+    ]
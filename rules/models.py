@@ -1,13 +1,21 @@
-import copy, re
+import re
 
-from django.db import models
+from django.db import connections, models, router
 
-from .logic import get_jsonlogic, jsonlogic_has_single_condition
+from .compiler import get_jsonlogic_depth
+from .logic import LogicStringError, get_jsonlogic, jsonlogic_has_single_condition, optimize_jsonlogic
+
+# Python's json module takes two stack frames per level of nesting, so storing jsonlogic fails with a RecursionError
+# at about 500 levels. Logic strings may nest max_logic_depth levels of alternating AND/OR once optimized, which leaves
+# room for the levels of the conditions and the if-statement around them.
+max_logic_depth = 300
 
 class Rule(models.Model):
 
     name = models.CharField(max_length = 200)
-    logic_string = models.CharField(max_length = 200)
+    logic_string = models.TextField()
+    # at most max_logic_depth levels of alternating AND/OR; chains of one operator are flattened (see
+    # logic.optimize_jsonlogic) and do not add levels
     jsonlogic_only_boolean_symbols = models.JSONField(blank=True)
     jsonlogic_full_conditions = models.JSONField(blank=True)
     num_conditions = models.PositiveIntegerField()
@@ -16,45 +24,52 @@ class Rule(models.Model):
 
         self.set_jsonlogic_only_boolean_symbols()
 
-        for condition in self.condition_set.all():
+        conditions = list(self.condition_set.select_related('operand_subject', 'operand_object', 'operator'))
+        for condition in conditions:
             condition.set_jsonlogic_condition_and_save()
         
-        self.jsonlogic_full_conditions = self.replace_jsonlogic_symbols_recur( copy.deepcopy(self.jsonlogic_only_boolean_symbols) )
+        self.jsonlogic_full_conditions = self.replace_jsonlogic_symbols_recur(
+            self.jsonlogic_only_boolean_symbols, get_conditions_by_index(conditions))
 
     def set_jsonlogic_only_boolean_symbols(self):
-        self.jsonlogic_only_boolean_symbols = get_jsonlogic(self.logic_string)
-
-    def replace_jsonlogic_symbols_recur(self, jsonlogic):
-
-        if type(jsonlogic) == dict:
-            # There should only be 1 key per logic string dictionary (one of 'AND', 'OR', 'NOT').
-            key = list(jsonlogic.keys())[0]
-            value = list(jsonlogic.values())[0]
-
-            if key == 'NOT':
-                key = '!'
+        jsonlogic = optimize_jsonlogic(get_jsonlogic(self.logic_string))
+        depth = get_jsonlogic_depth(jsonlogic)
+        if depth > max_logic_depth:
+            raise LogicStringError('logic string nested ' + str(depth) + ' levels deep, more than the ' +
+                                   str(max_logic_depth) + ' levels that can be stored')
+        self.jsonlogic_only_boolean_symbols = jsonlogic
+
+    def replace_jsonlogic_symbols_recur(self, jsonlogic, conditions_by_index=None):
+        # conditions_by_index maps rule_index -> jsonlogic condition; it is read from the database when not given.
+        # Returns a new structure and leaves jsonlogic as it is. The tree is walked with a stack, so rules of any
+        # size and nesting depth are handled in linear time.
+
+        if conditions_by_index is None:
+            conditions_by_index = get_conditions_by_index(self.condition_set.all())
+
+        if jsonlogic_has_single_condition(jsonlogic):
+            return get_condition_jsonlogic(conditions_by_index, 1)
+        if type(jsonlogic) != dict:
+            return jsonlogic
+
+        replaced = [None]
+        stack = [(replaced, 0, jsonlogic)]
+        while stack:
+            target, index, symbol = stack.pop()
+            if type(symbol) == dict:
+                # There should only be 1 key per logic string dictionary (one of 'AND', 'OR', 'NOT').
+                key, value = next(iter(symbol.items()))
+                key = '!' if key == 'NOT' else key.lower()
+                target[index] = { key : [None] * len(value) }
+                stack.extend((target[index][key], value_index, element) for value_index, element in enumerate(value))
             else:
-                key = key.lower()
-            
-            # replace/iterate
-            jsonlogic = { key : self.replace_jsonlogic_symbols_recur(value) }
-
-        elif type(jsonlogic) == list:
-            for index, symbol in enumerate(jsonlogic):
-                if type(symbol) == str:
-                    condition_number_match = re.match(r"^@(\d)+$", symbol)
-                    if not condition_number_match:
-                        raise ValueError(symbol,' in ',jsonlogic,': improper condition argument')
-                    # match.group(1) has the first sub-group, in this case the digit extraction
-                    num = condition_number_match.group(1)
-                    jsonlogic[index] = self.condition_set.get(rule_index=num).jsonlogic_condition
-                else: # dict
-                    jsonlogic[index] = self.replace_jsonlogic_symbols_recur(symbol)
-        
-        elif jsonlogic_has_single_condition(jsonlogic):
-            jsonlogic = self.condition_set.get(rule_index=1).jsonlogic_condition
+                condition_number_match = re.match(r"^@(\d+)$", symbol) if type(symbol) == str else None
+                if not condition_number_match:
+                    raise ValueError(symbol,' in ',jsonlogic,': improper condition argument')
+                # match.group(1) has the first sub-group, in this case the digit extraction
+                target[index] = get_condition_jsonlogic(conditions_by_index, int(condition_number_match.group(1)))
 
-        return jsonlogic
+        return replaced[0]
 
 class Action(models.Model):
     function_name = models.CharField(max_length = 200)
@@ -68,7 +83,10 @@ class RuleActionPair(models.Model):
 
     def set_jsonlogic_if_statement(self):
         self.rule.set_jsonlogic_conditions()
-        
+        self.set_jsonlogic_if_statement_from_rule()
+
+    def set_jsonlogic_if_statement_from_rule(self):
+        # uses the rule's current jsonlogic_full_conditions without recomputing them
         self.jsonlogic_if_statement = { 
             "if" : [
                 self.rule.jsonlogic_full_conditions,
@@ -114,13 +132,18 @@ class Condition(models.Model):
     jsonlogic_condition = models.JSONField()
 
     def set_jsonlogic_condition_and_save(self):
+        error = self.set_jsonlogic_condition()
+        if error is not None:
+            return error
+        self.save()
+
+    def set_jsonlogic_condition(self):
         if not self.operand_object or not self.operand_object or not self.operator:
             return ValueError('missing condition components')
 
         self.jsonlogic_condition = (
             { self.operator.jsonlogic_operator : [self.get_subject_json(), self.get_object_json()] }
         )
-        self.save()
 
     def get_subject_json(self):
         return self.get_freetext_or_property_json(self.freetext_subject, self.operand_subject.function_name)
@@ -131,4 +154,28 @@ class Condition(models.Model):
     def get_freetext_or_property_json(self, freetext_attr, func_name_attr):
         if freetext_attr:
             return freetext_attr
-        return { "var" : func_name_attr}
\ No newline at end of file
+        return { "var" : func_name_attr}
+
+def get_conditions_by_index(conditions):
+    return {condition.rule_index: condition.jsonlogic_condition for condition in conditions}
+
+def bulk_create_rules(rules):
+    # Conditions and rule action pairs are bulk created against the rules' primary keys, which bulk_create only sets
+    # where the database returns rows from a bulk insert (e.g. SQLite, PostgreSQL, not MySQL/MariaDB); elsewhere the
+    # rules are saved one by one.
+    if connections[router.db_for_write(Rule)].features.can_return_rows_from_bulk_insert:
+        Rule.objects.bulk_create(rules)
+    else:
+        for rule in rules:
+            rule.save()
+    return rules
+
+def get_condition_jsonlogic(conditions_by_index, rule_index):
+    try:
+        return conditions_by_index[rule_index]
+    except KeyError:
+        raise Condition.DoesNotExist('no condition with rule_index ' + str(rule_index))
+
+class RuleSetRevision(models.Model):
+    # Single row counting rule edits across processes; bumped by signals.py and compared against rule set snapshots.
+    revision = models.PositiveBigIntegerField(default=0)
@@ -0,0 +1,126 @@
+'''
+Native implementations of the comparison operators in BoolOperator.jsonlogic_op_list, so that compiled conditions
+do not call into json_logic on every evaluation.
+
+The functions reproduce the JavaScript-style coercions of json_logic exactly, quirks included: "==" against a string
+compares string forms, ordering against a number converts both sides with _to_numeric (raising ValueError for a
+non-numeric string), None is never less than anything and "<=" is "<" or "==" (so 4.0 <= "4" is False).
+
+get_literal_comparison specializes a comparison between a value and a literal known at compile time: the literal is
+converted once, and the common cases (a number against a number, a string against a string) skip the coercions.
+'''
+
+_no_argument = object()
+_numeric_types = (int, float)
+
+def _is_numeric(value):
+    # bools are not numeric here, as in json_logic
+    return type(value) in _numeric_types
+
+def _to_numeric(value):
+    if isinstance(value, str) and '.' in value:
+        value = float(value)
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    return int(value)
+
+def equal_to(a, b):
+    if isinstance(a, str) or isinstance(b, str):
+        return str(a) == str(b)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return bool(a) is bool(b)
+    return a == b
+
+def not_equal_to(a, b):
+    return not equal_to(a, b)
+
+def less_than(a, b, c=_no_argument):
+    if a is None or b is None:
+        return False
+    if _is_numeric(a) or _is_numeric(b):
+        try:
+            a, b = _to_numeric(a), _to_numeric(b)
+        except TypeError:
+            return False
+    return a < b and (c is _no_argument or less_than(b, c))
+
+def less_than_or_equal_to(a, b, c=_no_argument):
+    return (less_than(a, b) or equal_to(a, b)) and (c is _no_argument or less_than_or_equal_to(b, c))
+
+def greater_than(a, b):
+    return less_than(b, a)
+
+def greater_than_or_equal_to(a, b):
+    return less_than_or_equal_to(b, a)
+
+def in_(a, b):
+    if hasattr(b, '__contains__'):
+        return a in b
+    return False
+
+native_operations = {
+    '==': equal_to,
+    '!=': not_equal_to,
+    '>': greater_than,
+    '>=': greater_than_or_equal_to,
+    '<': less_than,
+    '<=': less_than_or_equal_to,
+    'in': in_,
+}
+
+def get_literal_comparison(operator, literal, literal_is_right=True):
+    # function of one value that returns native_operations[operator](value, literal), or (literal, value) when the
+    # literal is on the left
+    operation = native_operations[operator]
+    if operator in ('==', '!='):
+        equals = _get_equal_to_literal(literal)
+        if operator == '==':
+            return equals
+        return lambda value: not equals(value)
+
+    if operator in ('>', '>=', '<', '<='):
+        # a > b is b < a: reduce to "value before literal" or "literal before value"
+        value_first = (operator in ('<', '<=')) == literal_is_right
+        or_equal = operator in ('<=', '>=')
+        comparison = _get_ordering_with_literal(literal, value_first, or_equal)
+        if comparison is not None:
+            return comparison
+
+    if literal_is_right:
+        return lambda value: operation(value, literal)
+    return lambda value: operation(literal, value)
+
+def _get_equal_to_literal(literal):
+    if type(literal) is str:
+        return lambda value: (value if type(value) is str else str(value)) == literal
+    if _is_numeric(literal):
+        def equals_number(value):
+            if type(value) is int or type(value) is float:
+                return value == literal
+            return equal_to(value, literal)
+        return equals_number
+    return lambda value: equal_to(value, literal)
+
+def _get_ordering_with_literal(literal, value_first, or_equal):
+    # numbers are compared directly against the literal converted once; anything else takes the general path
+    if literal is None:
+        return None
+    try:
+        number = _to_numeric(literal)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    equals = _get_equal_to_literal(literal)
+    operation = less_than_or_equal_to if or_equal else less_than
+
+    if value_first:
+        def value_before_literal(value):
+            if type(value) is int or type(value) is float:
+                return value < number or (or_equal and equals(value))
+            return operation(value, literal)
+        return value_before_literal
+
+    def literal_before_value(value):
+        if type(value) is int or type(value) is float:
+            return number < value or (or_equal and equals(value))
+        return operation(literal, value)
+    return literal_before_value
@@ -0,0 +1,51 @@
+'''
+Opt-in memoization for property functions that are pure given their context var:
+
+    @memoize(maxsize=1024, ttl=60)
+    def get_trafficlight_color(color: str):
+        ...
+
+The decorated function keeps its __name__, so it is registered in property_function_dict like any other property
+function. Results are kept in a bounded cache keyed on the context var, or on key(context_var) when the context var
+itself is not hashable or carries more than the property depends on.
+'''
+
+import functools
+import inspect
+import time
+
+from .bounded_cache import BoundedCache
+
+_not_cached = object()
+
+def memoize(maxsize=128, ttl=None, eviction="lru", key=None, timer=time.monotonic):
+    # maxsize bounds the number of cached results, ttl (seconds) bounds their age; eviction is 'lru' or 'fifo'
+    def decorator(function):
+        return MemoizedPropertyFunction(function, maxsize, ttl, eviction, key, timer)
+    return decorator
+
+class MemoizedPropertyFunction():
+
+    def __init__(self, function, maxsize=128, ttl=None, eviction="lru", key=None, timer=time.monotonic):
+        if inspect.iscoroutinefunction(function):
+            raise TypeError('memoize does not support async property functions')
+
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.key = key
+        self.cache = BoundedCache(maxsize, ttl, eviction, timer)
+
+    def __call__(self, context_var):
+        # a context var that is not hashable is a miss, computed without caching
+        cache_key = self.key(context_var) if self.key is not None else context_var
+        value = self.cache.get(cache_key, _not_cached)
+        if value is _not_cached:
+            value = self.function(context_var)
+            self.cache.put(cache_key, value)
+        return value
+
+    def cache_info(self):
+        return self.cache.cache_info()
+
+    def cache_clear(self):
+        self.cache.cache_clear()
@@ -0,0 +1,96 @@
+'''
+Revision counters for rule sets. The compiled if-statement cache (compiler.py) holds a process-local revision;
+RuleSetRevision holds one in the database, bumped once per transaction that changes the rule models (see signals.py),
+after it commits, so that other processes notice the change through a RevisionMonitor and snapshots can be checked
+for staleness.
+'''
+
+import threading
+import time
+
+from django.db import router, transaction
+from django.db.models import F
+
+from .compiler import compiled_if_statement_cache
+from .models import RuleSetRevision
+
+def get_database_revision():
+    revision = RuleSetRevision.objects.filter(pk=1).values_list('revision', flat=True).first()
+    return revision or 0
+
+async def aget_database_revision():
+    revision = await RuleSetRevision.objects.filter(pk=1).values_list('revision', flat=True).afirst()
+    return revision or 0
+
+# pending _RevisionBump per database alias; connections, and so transactions, are per thread
+_pending_bumps = threading.local()
+
+def bump_revision(using=None):
+    # Called whenever rules change in the database using (the one RuleSetRevision is routed to by default). The
+    # compiled if-statements are dropped right away, so this thread sees its own changes, and again once the
+    # transaction commits, so nothing another thread compiled from the rows of before the commit survives it. The
+    # database revision is bumped once per transaction, after the commit: a single UPDATE that neither locks the
+    # revision row for the rest of the transaction nor costs a query per saved model.
+    compiled_if_statement_cache.invalidate()
+    if using is None:
+        using = router.db_for_write(RuleSetRevision)
+    bump = getattr(_pending_bumps, using, None)
+    if bump is None or bump.done:
+        bump = _RevisionBump(using)
+        setattr(_pending_bumps, using, bump)
+    # Every change registers the pending bump, which runs once when the first of its callbacks does. A rolled back
+    # savepoint or transaction discards only its own callbacks; the bump stays pending for the next change.
+    transaction.on_commit(bump, using=using)
+
+class _RevisionBump():
+
+    def __init__(self, using):
+        self.using = using
+        self.done = False
+
+    def __call__(self):
+        if self.done:
+            return
+        self.done = True
+        revisions = RuleSetRevision.objects.using(self.using)
+        # a single UPDATE, so concurrent bumps are never lost
+        if not revisions.filter(pk=1).update(revision=F('revision') + 1):
+            _, created = revisions.get_or_create(pk=1, defaults={"revision": 1})
+            if not created:
+                revisions.filter(pk=1).update(revision=F('revision') + 1)
+        compiled_if_statement_cache.invalidate()
+
+class RevisionMonitor():
+    '''
+    Reads the database revision at most once per check_interval seconds (never with None). When it differs from the
+    revision seen last, the compiled if-statement cache is invalidated, so every rule set loaded before is reloaded
+    on its next use. Rule sets already handed out stay usable; only new evaluations see the reloaded rules.
+    RuleManager checks before loading a rule set, so the first revision seen is never older than the loaded rules.
+    '''
+
+    def __init__(self, check_interval=1.0, timer=time.monotonic):
+        self.check_interval = check_interval
+        self.timer = timer
+        self.revision = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def is_check_due(self):
+        if self.check_interval is None:
+            return False
+        return self.checked_at is None or self.timer() - self.checked_at >= self.check_interval
+
+    def check(self):
+        if self.is_check_due():
+            self.update(get_database_revision())
+
+    async def acheck(self):
+        if self.is_check_due():
+            self.update(await aget_database_revision())
+
+    def update(self, revision):
+        with self._lock:
+            self.checked_at = self.timer()
+            if self.revision is not None and revision != self.revision:
+                compiled_if_statement_cache.invalidate()
+            self.revision = revision
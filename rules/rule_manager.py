@@ -31,27 +31,66 @@ context_dict = {
     ...
 }
 
+The batch eval methods take an iterable of such context dictionaries and return one results dictionary per context.
+A property function may declare a vectorized variant with @vectorized(column_function); column_function is then
+called once per batch with the list of context vars and must return one property value per context var.
+
+RuleManager(..., decision_cache_size=N) caches the actions decided for up to N combinations of property values, see
+decision_cache.py. RuleManager(..., use_decision_trees=True) evaluates first-true rule lists, sync and async, through a
+decision DAG, see decision_tree.py. The two answer the same question in different ways, so they cannot be combined.
+RuleManager(..., instrumentation=...) reports per-rule and per-function metrics, see instrumentation.py.
+export_snapshot/load_snapshot move compiled rule sets between processes, see snapshot.py.
+Rule changes made by other processes are picked up within revision_check_interval seconds (1 by default, None to
+never check), see revision.py.
+
 TODO:
 Create function/script to create new Property/BoolOperator objects and tie a command into the available Django manage.py commands.
 Build the GUI
 '''
 
-from json_logic import jsonLogic
+import asyncio
+import inspect
+import threading
+
+from asgiref.sync import sync_to_async
 
-from .models import Property, Action, BoolOperator, Rule, RuleActionPair
+from .decision_cache import DecisionCache
+from .instrumentation import null_instrumentation
+from .models import Property, Action, BoolOperator
+from .revision import RevisionMonitor, get_database_revision
+from .ruleset import RuleSet
+from .snapshot import export_snapshot, read_snapshot
 
 class RuleManager():
 
-    def __init__(self, property_function_dict, action_function_dict, boolOperator_string_dict, context_types):
+    def __init__(self, property_function_dict, action_function_dict, boolOperator_string_dict, context_types,
+                 decision_cache_size=None, use_decision_trees=False, instrumentation=None, revision_check_interval=1.0):
         self.property_function_dict = property_function_dict
         self.action_function_dict = action_function_dict
         self.boolOperator_string_dict = boolOperator_string_dict
         self.context_types = context_types
         self.function_translations = {}
-        self.jsonlogic_property_data = {}
+        self.property_functions = {}
+        self.action_functions = {}
+        self.instrumentation = instrumentation or null_instrumentation
+        if decision_cache_size and use_decision_trees:
+            raise ValueError('decision_cache_size and use_decision_trees cannot be combined')
+        self.rule_sets = {}
+        self._rule_sets_lock = threading.Lock()
+        # rules changed by other processes are noticed within revision_check_interval seconds
+        self.revision_monitor = RevisionMonitor(revision_check_interval)
+        # conditions evaluated vs. reused from an earlier rule in the same eval call
+        self.condition_stats = {"evaluated": 0, "saved": 0}
+        self._condition_stats_lock = threading.Lock()
+        # opt-in cache of the actions decided for each combination of property values
+        self.decision_cache = DecisionCache(decision_cache_size) if decision_cache_size else None
+        # first-true evaluation walks the rule set's DecisionTree instead of the rules one by one
+        self.use_decision_trees = use_decision_trees
 
         self._validate_input_dictionaries()
         self._create_function_translations()
+        self._create_property_functions()
+        self._create_action_functions()
         
     def build_models(self):
         self._create_properties()
@@ -84,6 +123,29 @@ class RuleManager():
             for function in function_list:
                 self.function_translations[function.__name__] = function
 
+    def _create_property_functions(self):
+        # function name -> (property function, context type), so property data can be computed without the ORM
+        self.property_functions = {}
+        for context_type in self.property_function_dict:
+            for function in self.property_function_dict[context_type]:
+                self.property_functions[function.__name__] = (self._instrument("property", function), context_type)
+
+    def _create_action_functions(self):
+        self.action_functions = {}
+        for context_type in self.action_function_dict:
+            for function in self.action_function_dict[context_type]:
+                self.action_functions[function.__name__] = self._instrument("action", function)
+
+    def _instrument(self, kind, function):
+        if not self.instrumentation.enabled:
+            return function
+        return self.instrumentation.wrap(kind, function)
+
+    def set_instrumentation(self, instrumentation):
+        self.instrumentation = instrumentation or null_instrumentation
+        self._create_property_functions()
+        self._create_action_functions()
+
     def _create_properties(self):
         self._create_models(self.property_function_dict, Property)
 
@@ -108,55 +170,401 @@ class RuleManager():
             except KeyError:
                 continue
 
-    def eval_first_true_rule(self, *rule_names, **context_type_vars):
+    def get_rule_set(self, *rule_names):
+        # RuleSet snapshots are cached per list of rule names and reloaded once a rule model changes
+        self.revision_monitor.check()
+        rule_set = self.rule_sets.get(rule_names)
+        if rule_set is None or not rule_set.is_current():
+            # one thread reloads while the others keep evaluating; replacing the dict entry swaps the rule set
+            # atomically, evaluations already running finish on the old one
+            with self._rule_sets_lock:
+                rule_set = self.rule_sets.get(rule_names)
+                if rule_set is None or not rule_set.is_current():
+                    rule_set = RuleSet.load(*rule_names)
+                    self.rule_sets[rule_names] = rule_set
+        return rule_set
+
+    def export_snapshot(self, path, *rule_names):
+        # writes the named rules, compiled, to a snapshot file (see snapshot.py)
+        return export_snapshot(path, *rule_names)
 
-        self._eval_jsonlogic_property_data(**context_type_vars)
+    def load_snapshot(self, path, check_revision=True):
+        # Serves the snapshot's rules from memory. With check_revision, one query compares the snapshot with the
+        # database revision and a stale snapshot is replaced by the current rules from the database. Without, the
+        # snapshot is trusted until the next revision check.
+        rule_set, database_revision = read_snapshot(path)
+        if check_revision:
+            self.revision_monitor.update(get_database_revision())
+        elif self.revision_monitor.revision is None:
+            self.revision_monitor.update(database_revision)
+        if database_revision != self.revision_monitor.revision or not rule_set.is_current():
+            rule_set = RuleSet.load(*rule_set.rule_names)
+        self.rule_sets[rule_set.rule_names] = rule_set
+        return rule_set
 
-        results_dict = {}
-        for rule_name in rule_names:
-            if self._eval_rule(results_dict, rule_name, **context_type_vars):
-                return results_dict
-        return results_dict
+    def start_session(self, *rule_names):
+        return RuleEvaluationSession(self, *rule_names)
+
+    def eval_first_true_rule(self, *rule_names, **context_type_vars):
+
+        rule_set = self._get_rule_set(rule_names)
+        evaluation_context = self._get_evaluation_context(rule_set, context_type_vars)
+        return self._eval_rule_set(rule_set, True, evaluation_context)
 
     def eval_all_rules(self, *rule_names, **context_type_vars):
 
-        self._eval_jsonlogic_property_data(**context_type_vars)
+        rule_set = self._get_rule_set(rule_names)
+        evaluation_context = self._get_evaluation_context(rule_set, context_type_vars)
+        return self._eval_rule_set(rule_set, False, evaluation_context)
 
-        results_dict = {}
-        for rule_name in rule_names:
-            self._eval_rule(results_dict, rule_name, **context_type_vars)
-        return results_dict
+    async def aget_rule_set(self, *rule_names):
+        await self.revision_monitor.acheck()
+        rule_set = self.rule_sets.get(rule_names)
+        if rule_set is None or not rule_set.is_current():
+            rule_set = await RuleSet.aload(*rule_names)
+            self.rule_sets[rule_names] = rule_set
+        return rule_set
 
-    def _eval_jsonlogic_property_data(self, **context_type_vars):
-        for property_function_str in self.function_translations:
-            try:
-                prop = Property.objects.get(function_name=property_function_str)
-            except Property.DoesNotExist:
-                continue
-            
-            property_function = self.function_translations[property_function_str]
-            context_var = context_type_vars[prop.context_type]
-            self.jsonlogic_property_data[property_function_str] = property_function(context_var)
+    async def aeval_first_true_rule(self, *rule_names, **context_type_vars):
+
+        rule_set = await self._aget_rule_set(rule_names)
+        evaluation_context = await self._aget_evaluation_context(rule_set, context_type_vars)
+        return await self._aeval_rule_set(rule_set, True, evaluation_context)
+
+    async def aeval_all_rules(self, *rule_names, **context_type_vars):
+
+        rule_set = await self._aget_rule_set(rule_names)
+        evaluation_context = await self._aget_evaluation_context(rule_set, context_type_vars)
+        return await self._aeval_rule_set(rule_set, False, evaluation_context)
+
+    def eval_first_true_rule_batch(self, contexts, *rule_names):
+        return self._eval_batch(contexts, rule_names, True)
+
+    def eval_all_rules_batch(self, contexts, *rule_names):
+        return self._eval_batch(contexts, rule_names, False)
+
+    def _eval_batch(self, contexts, rule_names, first_true_only):
+        # contexts is an iterable of {context_type: context_var} mappings; one results dict is returned per context
+        contexts = list(contexts)
+        rule_set = self._get_rule_set(rule_names)
+        property_columns = self._eval_property_columns(rule_set, contexts)
+
+        results_dicts = []
+        for row, context_type_vars in enumerate(contexts):
+            evaluation_context = EvaluationContext({}, context_type_vars, rule_set.shared_conditions, property_data={
+                function_name: column[row] for function_name, column in property_columns.items()
+            })
+            results_dicts.append(self._eval_rule_set(rule_set, first_true_only, evaluation_context))
+        return results_dicts
+
+    def eval_rule_masks(self, context_columns, *rule_names):
+        # context_columns maps each context type to a sequence of context vars (e.g. a NumPy array).
+        # Returns a (rules x contexts) boolean NumPy array of the rules whose conditions hold; actions are not run.
+        rule_set = self._get_rule_set(rule_names)
+        return rule_set.get_vectorized().eval_masks(self._eval_property_columns_from_context_columns(rule_set, context_columns))
+
+    def eval_first_true_rule_indices(self, context_columns, *rule_names):
+        # Index into rule_names of the first rule that fires for each context, -1 where no rule fires.
+        rule_set = self._get_rule_set(rule_names)
+        return rule_set.get_vectorized().eval_first_true_indices(self._eval_property_columns_from_context_columns(rule_set, context_columns))
+
+    def _eval_property_columns(self, rule_set, contexts):
+        context_columns = {}
+        for function_name, (function, context_type) in self._get_referenced_property_functions(rule_set).items():
+            if context_type not in context_columns:
+                context_columns[context_type] = [context_type_vars[context_type] for context_type_vars in contexts]
+        property_columns = self._eval_property_columns_from_context_columns(rule_set, context_columns)
+        return {function_name: list(column) for function_name, column in property_columns.items()}
+
+    def _eval_property_columns_from_context_columns(self, rule_set, context_columns):
+        property_columns = {}
+        for function_name, (function, context_type) in self._get_referenced_property_functions(rule_set).items():
+            context_column = context_columns[context_type]
+            if hasattr(function, 'vectorized'):
+                column = function.vectorized(context_column)
+                if len(column) != len(context_column):
+                    raise ValueError('vectorized property function ' + function_name + ' returned the wrong number of values')
+            else:
+                column = [function(context_var) for context_var in context_column]
+            property_columns[function_name] = column
+        return property_columns
+
+    def _eval_rule_set(self, rule_set, first_true_only, evaluation_context):
+        if first_true_only and self.use_decision_trees:
+            position, result_action_str = self._get_decision_tree_decision(rule_set, evaluation_context)
+            if position is not None:
+                if position >= 0:
+                    self._apply_action(evaluation_context, rule_set.entries[position], result_action_str)
+                return evaluation_context.results_dict
+
+        if self.decision_cache is not None:
+            for position, result_action_str in self._get_decisions(rule_set, first_true_only, evaluation_context):
+                self._apply_action(evaluation_context, rule_set.entries[position], result_action_str)
+            self._record_condition_stats(evaluation_context)
+            return evaluation_context.results_dict
+
+        for rule_set_entry in rule_set.get_candidate_entries(evaluation_context):
+            if self._eval_rule(evaluation_context, rule_set_entry, first_true_only) and first_true_only:
+                break
+        self._record_condition_stats(evaluation_context)
+        return evaluation_context.results_dict
+
+    def _get_decision_tree_decision(self, rule_set, evaluation_context):
+        # (position of the first rule that fires or -1, its action); position is None if the tree cannot decide
+        decision_tree = rule_set.get_decision_tree()
+        position = decision_tree.get_first_true_position(evaluation_context)
+        return position, decision_tree.actions.get(position)
+
+    def _get_decisions(self, rule_set, first_true_only, evaluation_context):
+        key = self.decision_cache.get_key(rule_set, first_true_only, evaluation_context)
+        decisions = self.decision_cache.get(key)
+        if decisions is None:
+            decisions = []
+            for position in rule_set.index.get_candidate_positions(evaluation_context):
+                result_action_str = self._decide_rule(evaluation_context, rule_set.entries[position])
+                if result_action_str != 'do_nothing':
+                    decisions.append((position, result_action_str))
+                    if first_true_only:
+                        break
+            decisions = tuple(decisions)
+            self.decision_cache.put(key, decisions)
+        return decisions
+
+    def _record_condition_stats(self, evaluation_context):
+        with self._condition_stats_lock:
+            self.condition_stats["evaluated"] = self.condition_stats["evaluated"] + evaluation_context.condition_evaluations
+            self.condition_stats["saved"] = self.condition_stats["saved"] + evaluation_context.saved_condition_evaluations
+
+    def _get_rule_set(self, rule_names):
+        # The eval methods take either rule names or a single, already loaded RuleSet
+        if len(rule_names) == 1 and isinstance(rule_names[0], RuleSet):
+            return rule_names[0]
+        return self.get_rule_set(*rule_names)
+
+    async def _aget_rule_set(self, rule_names):
+        if len(rule_names) == 1 and isinstance(rule_names[0], RuleSet):
+            return rule_names[0]
+        return await self.aget_rule_set(*rule_names)
+
+    def _get_referenced_property_functions(self, rule_set):
+        referenced_property_functions = {}
+        for var_name in rule_set.var_names:
+            if var_name in self.property_functions:
+                referenced_property_functions[var_name] = self.property_functions[var_name]
+        return referenced_property_functions
 
-    def _eval_rule(self, results_dict, rule_name, **context_type_vars):
-        rule = Rule.objects.get(name=rule_name)
-        rule_action_pair = RuleActionPair.objects.get(rule=rule)
+    def _get_evaluation_context(self, rule_set, context_type_vars):
+        # Only the properties the requested rules reference are computed, and only once a condition reads them.
+        return EvaluationContext(self._get_referenced_property_functions(rule_set), context_type_vars, rule_set.shared_conditions)
 
-        result_action_str = jsonLogic(
-            rule_action_pair.jsonlogic_if_statement,
-            self.jsonlogic_property_data)
+    def _eval_rule(self, evaluation_context, rule_set_entry, first_true_only):
+        result_action_str = self._decide_rule(evaluation_context, rule_set_entry)
+        if result_action_str != 'do_nothing' and not first_true_only:
+            # later rules must see the properties from before the action
+            evaluation_context.compute_properties()
+        return self._apply_action(evaluation_context, rule_set_entry, result_action_str)
 
+    def _decide_rule(self, evaluation_context, rule_set_entry):
+        if self.instrumentation.enabled:
+            return self.instrumentation.call("rule", rule_set_entry.rule_name, rule_set_entry.shared_if_statement, evaluation_context)
+        return rule_set_entry.shared_if_statement(evaluation_context)
+
+    def _apply_action(self, evaluation_context, rule_set_entry, result_action_str):
         if result_action_str == 'do_nothing':
             return False
-            
-        action_model = Action.objects.get(function_name = result_action_str)
-        context_type_str = action_model.context_type
-        context_var = context_type_vars[context_type_str]
-        action_function = self.function_translations[result_action_str]
+
+        context_type_str = rule_set_entry.action_context_type
+        context_var = evaluation_context.context_type_vars[context_type_str]
+        action_function = self.action_functions[result_action_str]
         result = action_function(context_var)
-        results_dict[context_type_str] = result
+        evaluation_context.results_dict[context_type_str] = result
+        return True
+
+    async def _aget_evaluation_context(self, rule_set, context_type_vars):
+        # A condition cannot await a property, so every referenced property is computed up front, concurrently.
+        referenced_property_functions = self._get_referenced_property_functions(rule_set)
+        property_values = await asyncio.gather(*[
+            _acall_property_function(function_name, function, context_type, context_type_vars)
+            for function_name, (function, context_type) in referenced_property_functions.items()
+        ])
+        return EvaluationContext({}, context_type_vars, rule_set.shared_conditions,
+                                 property_data=dict(zip(referenced_property_functions, property_values)))
+
+    async def _aeval_rule_set(self, rule_set, first_true_only, evaluation_context):
+        if first_true_only and self.use_decision_trees:
+            position, result_action_str = self._get_decision_tree_decision(rule_set, evaluation_context)
+            if position is not None:
+                if position >= 0:
+                    await self._aapply_action(evaluation_context, rule_set.entries[position], result_action_str)
+                return evaluation_context.results_dict
+
+        if self.decision_cache is not None:
+            for position, result_action_str in self._get_decisions(rule_set, first_true_only, evaluation_context):
+                await self._aapply_action(evaluation_context, rule_set.entries[position], result_action_str)
+            self._record_condition_stats(evaluation_context)
+            return evaluation_context.results_dict
+
+        for rule_set_entry in rule_set.get_candidate_entries(evaluation_context):
+            if await self._aeval_rule(evaluation_context, rule_set_entry) and first_true_only:
+                break
+        self._record_condition_stats(evaluation_context)
+        return evaluation_context.results_dict
+
+    async def _aeval_rule(self, evaluation_context, rule_set_entry):
+        result_action_str = self._decide_rule(evaluation_context, rule_set_entry)
+        return await self._aapply_action(evaluation_context, rule_set_entry, result_action_str)
+
+    async def _aapply_action(self, evaluation_context, rule_set_entry, result_action_str):
+        if result_action_str == 'do_nothing':
+            return False
+
+        context_type_str = rule_set_entry.action_context_type
+        context_var = evaluation_context.context_type_vars[context_type_str]
+        action_function = self.action_functions[result_action_str]
+        result = await _acall(action_function, context_var)
+        evaluation_context.results_dict[context_type_str] = result
+        return True
+
+class RuleEvaluationSession():
+    '''
+    Stateful evaluation of one list of rules for control loops that re-evaluate every tick while only some context vars
+    change. The first eval call needs every context var; later calls take just the context vars that changed. Only
+    properties of the changed context types are recomputed and only the rules that read them are re-decided; the other
+    rules reuse their last decision. Actions still run on every call, so results match a full evaluation as long as
+    property functions depend only on their context var.
+    '''
+
+    def __init__(self, rule_manager, *rule_names):
+        self.rule_manager = rule_manager
+        self.rule_names = rule_names
+        self.rule_set = None
+        self.context_type_vars = {}
+        self.property_data = {}
+        self.decisions = []
+        self.num_redecided_rules = 0
+
+    def eval_first_true_rule(self, **changed_context_type_vars):
+        return self._eval(True, changed_context_type_vars)
+
+    def eval_all_rules(self, **changed_context_type_vars):
+        return self._eval(False, changed_context_type_vars)
+
+    def _eval(self, first_true_only, changed_context_type_vars):
+        rule_set = self.rule_manager._get_rule_set(self.rule_names)
+        if rule_set is not self.rule_set:
+            # first call or the rules changed: everything has to be decided again
+            self.rule_set = rule_set
+            self.property_data = {}
+            self.decisions = [None] * len(rule_set)
+        self.context_type_vars.update(changed_context_type_vars)
+
+        property_functions = self.rule_manager._get_referenced_property_functions(rule_set)
+        changed_properties = set()
+        for function_name, (function, context_type) in property_functions.items():
+            if context_type in changed_context_type_vars:
+                changed_properties.add(function_name)
+                self.property_data.pop(function_name, None)
+
+        evaluation_context = EvaluationContext(property_functions, dict(self.context_type_vars), rule_set.shared_conditions,
+                                               property_data=self.property_data)
+        for position, rule_set_entry in enumerate(rule_set):
+            if not rule_set_entry.compiled_if_statement.var_names.isdisjoint(changed_properties):
+                self.decisions[position] = None
+
+        self.num_redecided_rules = 0
+        for position, rule_set_entry in enumerate(rule_set):
+            result_action_str = self.decisions[position]
+            if result_action_str is None:
+                result_action_str = self.rule_manager._decide_rule(evaluation_context, rule_set_entry)
+                self.decisions[position] = result_action_str
+                self.num_redecided_rules = self.num_redecided_rules + 1
+            if result_action_str != 'do_nothing' and not first_true_only:
+                evaluation_context.compute_properties()
+            if self.rule_manager._apply_action(evaluation_context, rule_set_entry, result_action_str) and first_true_only:
+                break
+
+        self.property_data = dict(evaluation_context)
+        self.rule_manager._record_condition_stats(evaluation_context)
+        return evaluation_context.results_dict
+
+class EvaluationContext(dict):
+    '''
+    State of a single eval call, so one RuleManager can serve many threads at once. It doubles as the property data
+    handed to the compiled if-statements: a property function is called the first time its value is read and the
+    result is kept for the rest of the call. Results of the rule set's shared conditions are kept the same way.
+
+    When more rules are decided after an action runs (eval_all_rules), the properties not read yet are computed before
+    the action, so an action that changes a context var never changes what a later rule sees.
+    '''
+
+    def __init__(self, property_functions, context_type_vars, shared_conditions, property_data=None):
+        super().__init__(property_data or {})
+        self.property_functions = property_functions
+        self.context_type_vars = context_type_vars
+        self.results_dict = {}
+        self.condition_results = shared_conditions.get_empty_results()
+        self.condition_evaluations = 0
+        self.saved_condition_evaluations = 0
+
+    def __missing__(self, function_name):
+        # a KeyError reads as a missing var; errors of the property function itself are raised as PropertyFunctionError
+        function, context_type = self.property_functions[function_name]
+        value = _call_property_function(function_name, function, context_type, self.context_type_vars)
+        self[function_name] = value
+        return value
+
+    def compute_properties(self):
+        for function_name in self.property_functions:
+            if function_name not in self:
+                self.__missing__(function_name)
+
+    def __bool__(self):
+        # jsonLogic swaps falsy data for {}, which would bypass the lazy lookups
         return True
 
+class PropertyFunctionError(ValueError):
+    '''
+    A property function raised, or its context var was not passed to the eval call. Compiled conditions turn a
+    KeyError or TypeError from a var lookup into the var's default, so the original error is re-raised as this one,
+    a ValueError, which they do not catch.
+    '''
+    pass
+
+def _get_context_var(function_name, context_type, context_type_vars):
+    try:
+        return context_type_vars[context_type]
+    except KeyError as error:
+        raise PropertyFunctionError('no context var for context type ' + str(context_type) +
+                                    ' of property function ' + function_name) from error
+
+def _call_property_function(function_name, function, context_type, context_type_vars):
+    context_var = _get_context_var(function_name, context_type, context_type_vars)
+    try:
+        return function(context_var)
+    except Exception as error:
+        raise PropertyFunctionError('property function ' + function_name + ' raised ' + repr(error)) from error
+
+async def _acall_property_function(function_name, function, context_type, context_type_vars):
+    context_var = _get_context_var(function_name, context_type, context_type_vars)
+    try:
+        return await _acall(function, context_var)
+    except Exception as error:
+        raise PropertyFunctionError('property function ' + function_name + ' raised ' + repr(error)) from error
+
+def vectorized(column_function):
+    # Declares a variant of a property function that receives the whole column of context vars of a batch
+    # and returns one property value per context var.
+    def decorator(property_function):
+        property_function.vectorized = column_function
+        return property_function
+    return decorator
+
+async def _acall(function, argument):
+    # async property and action functions are awaited, sync ones are offloaded to a thread
+    if inspect.iscoroutinefunction(function):
+        return await function(argument)
+    return await sync_to_async(function)(argument)
+
 def _isstr(input_obj):
         return type(input_obj) == str
 
@@ -0,0 +1,108 @@
+from .compiler import SharedConditionTable, compile_jsonlogic, compiled_if_statement_cache, get_compiled_if_statement
+from .decision_tree import DecisionTree
+from .indexes import RuleIndex, get_if_statement_condition
+from .models import RuleActionPair
+from .vectorized import VectorizedRuleSet
+
+class RuleSetEntry():
+
+    def __init__(self, rule_name, rule_action_pair_id, action_function_name, action_context_type, compiled_if_statement,
+                 shared_if_statement):
+        self.rule_name = rule_name
+        self.rule_action_pair_id = rule_action_pair_id
+        self.action_function_name = action_function_name
+        self.action_context_type = action_context_type
+        # compiled_if_statement takes any mapping of property data; shared_if_statement evaluates its conditions
+        # through the rule set's SharedConditionTable and needs an EvaluationContext
+        self.compiled_if_statement = compiled_if_statement
+        self.shared_if_statement = shared_if_statement
+
+class RuleSet():
+    '''
+    In-memory snapshot of a list of named rules with their rule action pairs, actions and compiled if-statements,
+    loaded with a single query. Evaluating against a snapshot does not touch the database.
+    '''
+
+    def __init__(self, rule_names, entries, revision, shared_conditions, index=None, var_names=None):
+        # index and var_names are passed in when they were precomputed, as in a snapshot file
+        self.rule_names = tuple(rule_names)
+        self.entries = entries
+        self.revision = revision
+        self.shared_conditions = shared_conditions
+        if index is None:
+            index = RuleIndex([get_if_statement_condition(entry.compiled_if_statement.logic) for entry in entries])
+        self.index = index
+        if var_names is None:
+            var_names = frozenset().union(*[entry.compiled_if_statement.var_names for entry in entries])
+        self.var_names = frozenset(var_names)
+        self.sorted_var_names = tuple(sorted(self.var_names))
+        self.vectorized = None
+        self.decision_tree = None
+
+    @classmethod
+    def load(cls, *rule_names):
+        # read the revision first so an edit made while loading leaves the snapshot stale rather than wrong
+        revision = compiled_if_statement_cache.revision
+        rule_action_pairs = list(_get_rule_action_pair_query(rule_names))
+        return cls._from_rule_action_pairs(rule_names, rule_action_pairs, revision)
+
+    @classmethod
+    async def aload(cls, *rule_names):
+        revision = compiled_if_statement_cache.revision
+        rule_action_pairs = [rule_action_pair async for rule_action_pair in _get_rule_action_pair_query(rule_names)]
+        return cls._from_rule_action_pairs(rule_names, rule_action_pairs, revision)
+
+    @classmethod
+    def _from_rule_action_pairs(cls, rule_names, rule_action_pairs, revision):
+        rule_action_pairs_by_name = {}
+        for rule_action_pair in rule_action_pairs:
+            if rule_action_pair.rule.name in rule_action_pairs_by_name:
+                raise RuleActionPair.MultipleObjectsReturned(
+                    'more than one rule action pair for rule ' + rule_action_pair.rule.name)
+            rule_action_pairs_by_name[rule_action_pair.rule.name] = rule_action_pair
+
+        shared_conditions = SharedConditionTable()
+        entries = []
+        for rule_name in rule_names:
+            try:
+                rule_action_pair = rule_action_pairs_by_name[rule_name]
+            except KeyError:
+                raise RuleActionPair.DoesNotExist('no rule action pair for rule ' + rule_name)
+            entries.append(RuleSetEntry(
+                rule_name = rule_name,
+                rule_action_pair_id = rule_action_pair.pk,
+                action_function_name = rule_action_pair.action.function_name,
+                action_context_type = rule_action_pair.action.context_type,
+                compiled_if_statement = get_compiled_if_statement(rule_action_pair),
+                shared_if_statement = compile_jsonlogic(rule_action_pair.jsonlogic_if_statement, shared_conditions),
+            ))
+
+        return cls(rule_names, entries, revision, shared_conditions)
+
+    def get_candidate_entries(self, data):
+        # entries whose rules could fire for the property values in data, in rule order
+        entries = self.entries
+        return (entries[position] for position in self.index.get_candidate_positions(data))
+
+    def get_vectorized(self):
+        if self.vectorized is None:
+            self.vectorized = VectorizedRuleSet(self)
+        return self.vectorized
+
+    def get_decision_tree(self):
+        # built on first use; a changed rule loads a new RuleSet and with it a new tree
+        if self.decision_tree is None:
+            self.decision_tree = DecisionTree([entry.compiled_if_statement.logic for entry in self.entries])
+        return self.decision_tree
+
+    def is_current(self):
+        return self.revision == compiled_if_statement_cache.revision
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+def _get_rule_action_pair_query(rule_names):
+    return RuleActionPair.objects.select_related('rule', 'action').filter(rule__name__in=set(rule_names))
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Rule, Condition, RuleActionPair, Action, Property, BoolOperator
+from .revision import bump_revision
+
+@receiver(post_save, sender=Rule)
+@receiver(post_save, sender=Condition)
+@receiver(post_save, sender=RuleActionPair)
+@receiver(post_save, sender=Action)
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=BoolOperator)
+@receiver(post_delete, sender=Rule)
+@receiver(post_delete, sender=Condition)
+@receiver(post_delete, sender=RuleActionPair)
+@receiver(post_delete, sender=Action)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=BoolOperator)
+def invalidate_compiled_rules(sender, using=None, **kwargs):
+    bump_revision(using)
@@ -0,0 +1,115 @@
+'''
+Snapshot files of compiled rule sets, so worker processes can start evaluating without querying the rules.
+
+A snapshot holds everything a RuleSet needs (rule order, rule action pair ids, action names and context types and
+if-statements) plus the database rule set revision it was exported at. Layout:
+
+    header   struct '<8sHHIQQ': magic b'RULESNAP', format version, flags (0), CRC-32 of the payload,
+             database revision, payload length
+    payload  UTF-8 JSON
+
+The payload also has a precomputed section with the rule set's var names, its shared-condition table with the slot
+of every condition reference, and its index gates, so loading neither walks the conditions for gates nor keys each
+condition for the table. Compiled if-statements are Python closures and cannot be stored, so every process still
+compiles each if-statement once for direct and once for shared evaluation.
+
+The file is replaced atomically on export, so readers never see a partly written file.
+'''
+
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+from .compiler import SharedConditionTable, compile_jsonlogic, compiled_if_statement_cache
+from .indexes import RuleIndex
+from .revision import get_database_revision
+from .ruleset import RuleSet, RuleSetEntry
+
+snapshot_magic = b'RULESNAP'
+snapshot_format_version = 2
+_header = struct.Struct('<8sHHIQQ')
+
+class SnapshotError(ValueError):
+    pass
+
+def export_snapshot(path, *rule_names):
+    # read the revision first so an edit made while exporting leaves the snapshot stale rather than wrong
+    database_revision = get_database_revision()
+    rule_set = RuleSet.load(*rule_names)
+    write_snapshot(path, rule_set, database_revision)
+    return rule_set
+
+def write_snapshot(path, rule_set, database_revision):
+    payload = json.dumps({
+        "rule_names": list(rule_set.rule_names),
+        "entries": [
+            {
+                "rule_name": entry.rule_name,
+                "rule_action_pair_id": entry.rule_action_pair_id,
+                "action_function_name": entry.action_function_name,
+                "action_context_type": entry.action_context_type,
+                "if_statement": entry.compiled_if_statement.logic,
+            }
+            for entry in rule_set
+        ],
+        "precomputed": {
+            "var_names": list(rule_set.sorted_var_names),
+            "shared_conditions": rule_set.shared_conditions.conditions,
+            "reference_slots": rule_set.shared_conditions.reference_slots,
+            "index_gates": rule_set.index.get_gates(),
+        },
+    }, separators=(',', ':')).encode('utf-8')
+    header = _header.pack(snapshot_magic, snapshot_format_version, 0, zlib.crc32(payload), database_revision, len(payload))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.rulesnapshot-')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as snapshot_file:
+            snapshot_file.write(header)
+            snapshot_file.write(payload)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+def read_snapshot(path):
+    # returns (RuleSet, database revision of the snapshot); does not touch the database
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    if len(data) < _header.size:
+        raise SnapshotError('truncated rule set snapshot ' + str(path))
+    magic, format_version, flags, checksum, database_revision, payload_length = _header.unpack_from(data)
+    if magic != snapshot_magic:
+        raise SnapshotError(str(path) + ' is not a rule set snapshot')
+    if format_version != snapshot_format_version:
+        raise SnapshotError('unsupported rule set snapshot version ' + str(format_version))
+    payload = data[_header.size:_header.size + payload_length]
+    if len(payload) != payload_length or zlib.crc32(payload) != checksum:
+        raise SnapshotError('corrupt rule set snapshot ' + str(path))
+    return _get_rule_set(json.loads(payload)), database_revision
+
+def _get_rule_set(snapshot):
+    revision = compiled_if_statement_cache.revision
+    precomputed = snapshot["precomputed"]
+    shared_conditions = SharedConditionTable(precomputed["shared_conditions"], precomputed["reference_slots"])
+    entries = []
+    try:
+        for entry in snapshot["entries"]:
+            entries.append(RuleSetEntry(
+                rule_name = entry["rule_name"],
+                rule_action_pair_id = entry["rule_action_pair_id"],
+                action_function_name = entry["action_function_name"],
+                action_context_type = entry["action_context_type"],
+                compiled_if_statement = compile_jsonlogic(entry["if_statement"]),
+                shared_if_statement = compile_jsonlogic(entry["if_statement"], shared_conditions),
+            ))
+    except IndexError:
+        raise SnapshotError('rule set snapshot has fewer condition references than its if-statements')
+    if shared_conditions.num_references != len(shared_conditions.reference_slots):
+        raise SnapshotError('rule set snapshot has more condition references than its if-statements')
+    index = RuleIndex.from_gates(precomputed["index_gates"])
+    if index.num_rules != len(entries):
+        raise SnapshotError('rule set snapshot index does not match its rules')
+    return RuleSet(snapshot["rule_names"], entries, revision, shared_conditions, index, precomputed["var_names"])
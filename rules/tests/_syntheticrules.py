@@ -0,0 +1,100 @@
+from ..models import Rule, Condition, RuleActionPair, Property, Action, BoolOperator, bulk_create_rules, get_conditions_by_index
+from ..rule_manager import RuleManager
+
+# Many or large rules for the tests that need them: every condition compares one numeric property with a random
+# literal, and an action counts or resets hits on a dict.
+
+def get_synthetic_value(value: int):
+    return value
+
+def increment_synthetic_hits(target: dict):
+    target["hits"] = target["hits"] + 1
+    return target
+
+def reset_synthetic_hits(target: dict):
+    target["hits"] = 0
+    return target
+
+_synthetic_property_functions = {
+    "synthetic_value": [get_synthetic_value],
+}
+_synthetic_boolops = {
+    "synthetic_value": ["==", ">", "<"],
+}
+_synthetic_action_functions = {
+    "synthetic_target": [increment_synthetic_hits, reset_synthetic_hits],
+}
+_synthetic_context_types = ["synthetic_value", "synthetic_target"]
+
+SyntheticRuleManager = RuleManager(
+    property_function_dict=_synthetic_property_functions,
+    action_function_dict=_synthetic_action_functions,
+    boolOperator_string_dict=_synthetic_boolops,
+    context_types=_synthetic_context_types,
+    revision_check_interval=None,
+)
+
+def get_synthetic_logic_string(num_conditions, rand):
+    # conditions 1..num_conditions in groups of up to three OR'ed terms, AND'ed together; some terms are negated
+    if num_conditions == 1:
+        return "1"
+    groups = []
+    condition_number = 1
+    while condition_number <= num_conditions:
+        group_size = min(rand.randint(1, 3), num_conditions - condition_number + 1)
+        terms = []
+        for number in range(condition_number, condition_number + group_size):
+            terms.append(("NOT " if rand.random() < 0.2 else "") + str(number))
+        groups.append(terms[0] if group_size == 1 else "(" + " OR ".join(terms) + ")")
+        condition_number = condition_number + group_size
+    return " AND ".join(groups)
+
+def create_synthetic_rules(num_rules, num_conditions, rand, name_prefix):
+    # Rules with ready if-statements, created with bulk inserts. Needs SyntheticRuleManager.build_models().
+    value_property = Property.objects.get(function_name="get_synthetic_value", context_type="synthetic_value")
+    freetext_property = Property.objects.get(function_name="freetext", context_type="synthetic_value")
+    operators = list(BoolOperator.objects.filter(context_type="synthetic_value"))
+    actions = list(Action.objects.filter(context_type="synthetic_target"))
+
+    rules = []
+    rule_conditions = []
+    for index in range(num_rules):
+        conditions = []
+        for rule_index in range(1, num_conditions + 1):
+            operator = rand.choice(operators)
+            freetext_object = str(rand.randint(0, 100))
+            conditions.append(Condition(
+                rule_index = rule_index,
+                operand_subject = value_property,
+                operand_object = freetext_property,
+                freetext_object = freetext_object,
+                operator = operator,
+                jsonlogic_condition = { operator.jsonlogic_operator: [{ "var": value_property.function_name }, freetext_object] },
+            ))
+        rule = Rule(
+            name = name_prefix + "-" + str(index),
+            logic_string = get_synthetic_logic_string(num_conditions, rand),
+            num_conditions = num_conditions,
+        )
+        rule.set_jsonlogic_only_boolean_symbols()
+        rule.jsonlogic_full_conditions = rule.replace_jsonlogic_symbols_recur(
+            rule.jsonlogic_only_boolean_symbols, get_conditions_by_index(conditions))
+        rules.append(rule)
+        rule_conditions.append(conditions)
+
+    bulk_create_rules(rules)
+    conditions = []
+    rule_action_pairs = []
+    for rule, conditions_of_rule in zip(rules, rule_conditions):
+        for condition in conditions_of_rule:
+            condition.rule = rule
+            conditions.append(condition)
+        action = rand.choice(actions)
+        rule_action_pairs.append(RuleActionPair(
+            rule = rule,
+            action = action,
+            jsonlogic_if_statement = { "if": [rule.jsonlogic_full_conditions, action.function_name, "do_nothing"] },
+        ))
+    Condition.objects.bulk_create(conditions)
+    RuleActionPair.objects.bulk_create(rule_action_pairs)
+    return rule_action_pairs
@@ -45,9 +45,17 @@ _tl_action_functions = {
 }
 _tl_context_types = ["trafficlight_color", "trafficlight_counter", "trafficlight"]
 
-TrafficLightRuleManager = RuleManager(
-    property_function_dict=_tl_property_functions,
-    action_function_dict=_tl_action_functions,
-    boolOperator_string_dict=_tl_boolops,
-    context_types = _tl_context_types
-)
\ No newline at end of file
+def make_trafficlight_rule_manager(**options):
+    # a RuleManager over the functions above; options replace any of its arguments
+    arguments = {
+        "property_function_dict": _tl_property_functions,
+        "action_function_dict": _tl_action_functions,
+        "boolOperator_string_dict": _tl_boolops,
+        "context_types": _tl_context_types,
+        # tests count queries; a revision check depends on the clock, so these managers never check unless asked to
+        "revision_check_interval": None,
+    }
+    arguments.update(options)
+    return RuleManager(**arguments)
+
+TrafficLightRuleManager = make_trafficlight_rule_manager()
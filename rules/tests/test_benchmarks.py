@@ -0,0 +1,58 @@
+import json
+import random
+
+from django.test import TestCase
+
+from ..benchmarks import BenchmarkRuleManager, bench_get_jsonlogic, bench_is_valid_logic_string, create_synthetic_rules, get_logic_string, run_benchmarks
+from ..logic import is_valid_logic_string, logic_string_cache
+from ..models import Rule, RuleActionPair
+
+class TestBenchmarks(TestCase):
+
+    def test_generated_logic_strings_are_valid(self):
+        rand = random.Random(1)
+        for num_conditions in [1, 2, 5, 50]:
+            for _ in range(20):
+                self.assertTrue(is_valid_logic_string(get_logic_string(num_conditions, rand), num_conditions))
+
+    def test_synthetic_rules_match_the_model_methods(self):
+        BenchmarkRuleManager.build_models()
+        rule_action_pairs = create_synthetic_rules(5, 4, random.Random(2), "synthetic")
+        # condition numbers with more than one digit
+        rule_action_pairs.extend(create_synthetic_rules(2, 12, random.Random(3), "synthetic-long"))
+        for rule_action_pair in rule_action_pairs:
+            bulk_if_statement = rule_action_pair.jsonlogic_if_statement
+            rule_action_pair = RuleActionPair.objects.get(pk=rule_action_pair.pk)
+            rule_action_pair.set_jsonlogic_if_statement()
+            self.assertEqual(rule_action_pair.jsonlogic_if_statement, bulk_if_statement)
+        self.assertEqual(Rule.objects.filter(name__startswith="synthetic-").count(), 7)
+
+    def test_parse_benchmarks_do_not_time_cache_hits(self):
+        for bench in [bench_is_valid_logic_string, bench_get_jsonlogic]:
+            bench(["1 AND 2"], 2, min_time=0, max_iterations=5)
+            # cleared before every call, so the one logic string is parsed every time
+            self.assertEqual(logic_string_cache.cache_info()[:2], (0, 1))
+
+    def test_run_benchmarks(self):
+        report = run_benchmarks(rule_counts=[10], condition_counts=[1, 3], min_time=0, max_iterations=5)
+        json.dumps(report)
+        names = [(result["name"], result["params"]) for result in report["results"]]
+        self.assertEqual(names, [
+            ("createrulemodels", {}),
+            ("is_valid_logic_string", {"num_conditions": 1}),
+            ("get_jsonlogic", {"num_conditions": 1}),
+            ("set_jsonlogic_if_statement", {"num_conditions": 1}),
+            ("is_valid_logic_string", {"num_conditions": 3}),
+            ("get_jsonlogic", {"num_conditions": 3}),
+            ("set_jsonlogic_if_statement", {"num_conditions": 3}),
+            ("eval_first_true_rule", {"num_rules": 10, "num_conditions": 3}),
+            ("eval_all_rules", {"num_rules": 10, "num_conditions": 3}),
+        ])
+        for result in report["results"]:
+            self.assertEqual(result["iterations"], 5)
+            self.assertGreater(result["ops_per_second"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["peak_memory_bytes"], 0)
+        eval_result = report["results"][-1]
+        # warm evaluation does not touch the database
+        self.assertEqual(eval_result["queries_per_op"], 0)
@@ -0,0 +1,67 @@
+import io
+import random
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..bulk_compile import compile_rules
+from ..compiler import compiled_if_statement_cache
+from ..models import Rule, Condition, RuleActionPair, Property
+from ._syntheticrules import SyntheticRuleManager, create_synthetic_rules
+from .test_eval_rules import build_turn_yellow_on_counter, build_reset_counter_rule, build_turn_green_rule
+
+class TestCompileRules(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        # the test's transaction never commits, so the revision bumps scheduled for the commit are run here
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('createrulemodels')
+            build_turn_yellow_on_counter()
+            build_reset_counter_rule()
+            build_turn_green_rule()
+            SyntheticRuleManager.build_models()
+            create_synthetic_rules(20, 12, random.Random(17), "bulk")
+            for rule_action_pair in RuleActionPair.objects.all():
+                rule_action_pair.set_jsonlogic_if_statement()
+                rule_action_pair.rule.save()
+                rule_action_pair.save()
+        self.expected = self.get_compiled_jsonlogic()
+        Rule.objects.update(jsonlogic_only_boolean_symbols={}, jsonlogic_full_conditions={})
+        Condition.objects.update(jsonlogic_condition={})
+        RuleActionPair.objects.update(jsonlogic_if_statement={})
+
+    def get_compiled_jsonlogic(self):
+        return (
+            {rule.name: (rule.jsonlogic_only_boolean_symbols, rule.jsonlogic_full_conditions) for rule in Rule.objects.all()},
+            {condition.pk: condition.jsonlogic_condition for condition in Condition.objects.all()},
+            {rap.pk: rap.jsonlogic_if_statement for rap in RuleActionPair.objects.all()},
+        )
+
+    def test_matches_per_rule_compilation(self):
+        self.assertEqual(compile_rules(), 23)
+        self.assertEqual(self.get_compiled_jsonlogic(), self.expected)
+
+    def test_query_count_does_not_grow_with_the_number_of_rules(self):
+        rules = list(Rule.objects.all())
+        # per batch: conditions, rule action pairs and one bulk update per model; plus the savepoint and, after the
+        # commit, the revision bump
+        with self.assertNumQueries(2 * 5 + 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                compile_rules(rules, batch_size=12)
+        self.assertEqual(self.get_compiled_jsonlogic(), self.expected)
+
+    def test_compiled_if_statement_cache_is_invalidated(self):
+        revision = compiled_if_statement_cache.revision
+        compile_rules(Rule.objects.filter(name="turn-green"))
+        self.assertGreater(compiled_if_statement_cache.revision, revision)
+        self.assertEqual(RuleActionPair.objects.get(rule__name="turn-green").jsonlogic_if_statement,
+                         self.expected[2][RuleActionPair.objects.get(rule__name="turn-green").pk])
+
+    def test_property_rename(self):
+        Property.objects.filter(function_name="get_trafficlight_counter").update(function_name="get_counter")
+        output = io.StringIO()
+        call_command('compilerules', 'reset_counter_rule', stdout=output)
+        self.assertEqual(output.getvalue(), 'Compiled 1 rules\n')
+        self.assertEqual(Rule.objects.get(name="reset_counter_rule").jsonlogic_full_conditions, { ">": [{"var": "get_counter"}, "4"] })
+        self.assertEqual(Rule.objects.get(name="count-turn-yellow").jsonlogic_full_conditions, {})
@@ -0,0 +1,140 @@
+import sys
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from json_logic import jsonLogic
+
+from ..compiler import SharedConditionTable, compile_jsonlogic, compiled_if_statement_cache, get_compiled_if_statement
+from ..models import Rule, RuleActionPair, Condition
+from .test_eval_rules import build_turn_yellow_rule, build_turn_yellow_on_counter
+
+class TestCompileJSONLogic(TestCase):
+
+    statements = [
+        { "if": [ { "==": [{"var": "color"}, "green"] }, "set_color_to_yellow", "do_nothing" ] },
+        { "if": [ { "and": [ { "==": [{"var": "color"}, "red"] }, { ">": [{"var": "counter"}, "4"] } ] }, "go", "do_nothing" ] },
+        { "!": [ { "or": [ { "<": [{"var": "counter"}, "5"] }, { "!=": [{"var": "color"}, "red"] } ] } ] },
+        { "and": [ { ">=": [{"var": "counter"}, 2] }, { "<=": [{"var": "counter"}, "4.5"] }, {"var": "color"} ] },
+        { "or": [ { "in": [{"var": "color"}, "green yellow"] }, { "in": [{"var": "counter"}, [1, 2, {"var": "counter"}]] } ] },
+        { "if": [ {"var": "missing_property"}, "a", { "==": [{"var": "counter"}, None] }, "b", "c" ] },
+        { "==": [{"var": ["missing_property", "fallback"]}, "fallback"] },
+        { "some": [ [1, 2, 3], { ">": [{"var": ""}, 2] } ] },
+        { "+": [{"var": "counter"}, 1] },
+        "do_nothing",
+    ]
+    datasets = [
+        {"color": "green", "counter": 0},
+        {"color": "red", "counter": 5},
+        {"color": "red", "counter": 4},
+        {"color": "yellow", "counter": 2},
+        {"color": "", "counter": 3},
+    ]
+
+    def test_compiled_matches_jsonlogic(self):
+        for statement in self.statements:
+            compiled = compile_jsonlogic(statement)
+            for data in self.datasets:
+                self.assertEqual(compiled(data), jsonLogic(statement, data), (statement, data))
+
+    def test_var_names(self):
+        self.assertEqual(
+            compile_jsonlogic(self.statements[1]).var_names,
+            frozenset(["color", "counter"])
+        )
+        self.assertEqual(
+            compile_jsonlogic(self.statements[9]).var_names,
+            frozenset()
+        )
+
+class TestSharedConditionTable(TestCase):
+
+    class Data(dict):
+        pass
+
+    def test_identical_conditions_evaluated_once(self):
+        statements = [
+            { "if": [ { "==": [{"var": "color"}, "green"] }, "a", "do_nothing" ] },
+            { "if": [ { "and": [ { "==": [{"var": "color"}, "green"] }, { ">": [{"var": "counter"}, "4"] } ] }, "b", "do_nothing" ] },
+            { "if": [ { "or": [ { ">": [{"var": "counter"}, "4"] }, { "==": [{"var": "color"}, "green"] } ] }, "c", "do_nothing" ] },
+        ]
+        shared_conditions = SharedConditionTable()
+        compiled_statements = [compile_jsonlogic(statement, shared_conditions) for statement in statements]
+        self.assertEqual(len(shared_conditions), 2)
+        self.assertEqual(shared_conditions.num_references, 5)
+
+        data = self.Data(color="green", counter=5)
+        data.condition_results = shared_conditions.get_empty_results()
+        data.condition_evaluations = 0
+        data.saved_condition_evaluations = 0
+        self.assertEqual([compiled(data) for compiled in compiled_statements], ["a", "b", "c"])
+        self.assertEqual(data.condition_evaluations, 2)
+        self.assertEqual(data.saved_condition_evaluations, 2)
+
+class TestCompiledIfStatementCache(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_yellow_on_counter()
+
+    def test_cache_reuses_compiled_statement(self):
+        rap = RuleActionPair.objects.get(rule__name="turn-yellow")
+        self.assertIs(get_compiled_if_statement(rap), get_compiled_if_statement(rap))
+
+    def test_cache_dropped_on_save_and_delete(self):
+        rap = RuleActionPair.objects.get(rule__name="turn-yellow")
+        compiled = get_compiled_if_statement(rap)
+
+        Rule.objects.get(name="turn-yellow").save()
+        self.assertEqual(len(compiled_if_statement_cache), 0)
+        self.assertIsNot(get_compiled_if_statement(rap), compiled)
+
+        compiled = get_compiled_if_statement(rap)
+        Condition.objects.filter(rule__name="count-turn-yellow").first().save()
+        self.assertIsNot(get_compiled_if_statement(rap), compiled)
+
+        compiled = get_compiled_if_statement(rap)
+        RuleActionPair.objects.get(rule__name="count-turn-yellow").delete()
+        self.assertIsNot(get_compiled_if_statement(rap), compiled)
+
+    def test_cache_picks_up_edited_statement(self):
+        rap = RuleActionPair.objects.get(rule__name="turn-yellow")
+        self.assertEqual(get_compiled_if_statement(rap)({"get_trafficlight_color": "green"}), "set_color_to_yellow")
+
+        rap.jsonlogic_if_statement = { "if": [ { "==": [{"var": "get_trafficlight_color"}, "red"] }, "set_color_to_yellow", "do_nothing"] }
+        rap.save()
+        self.assertEqual(get_compiled_if_statement(rap)({"get_trafficlight_color": "green"}), "do_nothing")
+
+class TestCompiledStatementCost(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+
+    def test_compiled_statement_does_less_work_than_jsonlogic(self):
+        # timings are left to the benchmarkrules command; the calls made are counted instead
+        rap = RuleActionPair.objects.get(rule__name="count-turn-yellow")
+        statement = rap.jsonlogic_if_statement
+        compiled = get_compiled_if_statement(rap)
+        data = {"get_trafficlight_color": "green", "get_trafficlight_counter": 5}
+        self.assertEqual(compiled(data), jsonLogic(statement, data))
+
+        with mock.patch('rules.compiler.jsonLogic', side_effect=AssertionError('statement was interpreted')):
+            self.assertEqual(compiled(data), "set_color_to_yellow")
+        self.assertLess(count_function_calls(compiled, data) * 5, count_function_calls(jsonLogic, statement, data))
+
+def count_function_calls(function, *args):
+    # number of Python function calls made by function(*args), itself included
+    calls = []
+    def profile(frame, event, arg):
+        if event == 'call':
+            calls.append(frame.f_code)
+    sys.setprofile(profile)
+    try:
+        function(*args)
+    finally:
+        sys.setprofile(None)
+    return len(calls)
@@ -0,0 +1,109 @@
+import random
+
+from django.test import TestCase
+
+from ..compiler import compile_jsonlogic
+from ..decision_tree import DecisionTree
+
+def get_random_test(rand):
+    return rand.choice([
+        { "==": [{"var": "color"}, rand.choice(["green", "yellow", "red"])] },
+        { rand.choice([">", "<", "=="]): [{"var": "counter"}, str(rand.randint(0, 4))] },
+        { "==": [{"var": "size"}, rand.choice(["big", "small"])] },
+        { "<": [{"var": "counter"}, {"var": "limit"}] },
+    ])
+
+def get_random_condition(rand, depth=0):
+    shape = rand.randint(0, 5) if depth < 2 else 0
+    if shape <= 1:
+        return get_random_test(rand)
+    if shape == 2:
+        return { "!": [get_random_condition(rand, depth + 1)] }
+    if shape == 3:
+        return { "or": [get_random_condition(rand, depth + 1) for _ in range(rand.randint(1, 3))] }
+    return { "and": [get_random_condition(rand, depth + 1) for _ in range(rand.randint(1, 3))] }
+
+def get_random_data(rand):
+    return {
+        "color": rand.choice(["green", "yellow", "red", None]),
+        "counter": rand.randint(-1, 5),
+        "size": rand.choice(["big", "small"]),
+        "limit": rand.choice([0, 2, "3"]),
+    }
+
+def get_if_statements(conditions):
+    return [{ "if": [condition, "action_" + str(position), "do_nothing"] } for position, condition in enumerate(conditions)]
+
+def eval_sequentially(if_statements, data):
+    for position, if_statement in enumerate(if_statements):
+        if compile_jsonlogic(if_statement)(data) != "do_nothing":
+            return position
+    return -1
+
+def get_paths(node, path=()):
+    if type(node) is not tuple:
+        return [path]
+    return get_paths(node[1], path + (node[0],)) + get_paths(node[2], path + (node[0],))
+
+class TestDecisionTree(TestCase):
+
+    def test_matches_sequential_evaluation(self):
+        rand = random.Random(14)
+        for trial in range(40):
+            if_statements = get_if_statements([get_random_condition(rand) for _ in range(rand.randint(1, 12))])
+            decision_tree = DecisionTree(if_statements)
+            self.assertIsNotNone(decision_tree.root)
+            for _ in range(40):
+                data = get_random_data(rand)
+                position = decision_tree.get_first_true_position(data)
+                self.assertEqual(position, eval_sequentially(if_statements, data), (if_statements, data))
+                if position >= 0:
+                    self.assertEqual(decision_tree.actions[position], "action_" + str(position))
+
+    def test_each_test_at_most_once_per_path(self):
+        rand = random.Random(41)
+        for trial in range(20):
+            decision_tree = DecisionTree(get_if_statements([get_random_condition(rand) for _ in range(8)]))
+            for path in get_paths(decision_tree.root):
+                self.assertEqual(len(path), len(set(path)))
+
+    def test_common_subtrees_are_shared(self):
+        red = { "==": [{"var": "color"}, "red"] }
+        big = { "==": [{"var": "size"}, "big"] }
+        high = { ">": [{"var": "counter"}, "3"] }
+        decision_tree = DecisionTree(get_if_statements([
+            { "and": [red, big, high] },
+            { "and": [{ "!": [red] }, big, high] },
+            high,
+        ]))
+        # both color branches lead to the same big/high subtree
+        self.assertEqual(len(decision_tree.tests), 3)
+        self.assertEqual(decision_tree.num_nodes, 4)
+        self.assertLess(decision_tree.num_nodes, len(get_paths(decision_tree.root)))
+        for data, position in [
+            ({"color": "red", "size": "big", "counter": 4}, 0),
+            ({"color": "blue", "size": "big", "counter": 4}, 1),
+            ({"color": "blue", "size": "small", "counter": 4}, 2),
+            ({"color": "red", "size": "big", "counter": 3}, -1),
+        ]:
+            self.assertEqual(decision_tree.get_first_true_position(data), position)
+
+    def test_unsupported_rule_sets_have_no_tree(self):
+        test = { "==": [{"var": "color"}, "red"] }
+        self.assertIsNone(DecisionTree([{ "if": [test, "do_nothing", "action"] }]).root)
+        self.assertIsNone(DecisionTree([{ "==": [1, 1] }]).root)
+
+        rand = random.Random(5)
+        if_statements = get_if_statements([get_random_condition(rand) for _ in range(12)])
+        decision_tree = DecisionTree(if_statements, max_nodes=2)
+        self.assertIsNone(decision_tree.root)
+        self.assertIsNone(decision_tree.get_first_true_position(get_random_data(rand)))
+
+    def test_raising_tests_are_left_to_sequential_evaluation(self):
+        if_statements = get_if_statements([
+            { "==": [{"var": "color"}, "red"] },
+            { "<": [{"var": "counter"}, "abc"] },
+        ])
+        decision_tree = DecisionTree(if_statements)
+        self.assertEqual(decision_tree.get_first_true_position({"color": "red", "counter": 1}), 0)
+        self.assertIsNone(decision_tree.get_first_true_position({"color": "green", "counter": 1}))
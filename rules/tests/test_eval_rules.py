@@ -1,8 +1,15 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management import call_command
 from django.test import TestCase, override_settings
 
 from ..models import Rule, RuleActionPair, Condition, BoolOperator, Property, Action
-from ._trafficlightrules import TrafficLightRuleManager, Trafficlight
+from ..rule_manager import PropertyFunctionError, vectorized
+from ..ruleset import RuleSet
+from . import _trafficlightrules
+from ._trafficlightrules import TrafficLightRuleManager, Trafficlight, make_trafficlight_rule_manager
 
 class TestEvalRules(TestCase):
     
@@ -120,6 +127,625 @@ class TestEvalRules(TestCase):
             )
 
 
+class TestPropertyEvaluation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        self.calls = []
+
+        def get_trafficlight_color(color):
+            self.calls.append("get_trafficlight_color")
+            return color
+
+        def get_trafficlight_counter(counter):
+            self.calls.append("get_trafficlight_counter")
+            return counter
+
+        self.rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={
+                "trafficlight_color": [get_trafficlight_color],
+                "trafficlight_counter": [get_trafficlight_counter],
+            },
+        )
+
+    def test_unreferenced_properties_are_not_computed(self):
+        tl = Trafficlight()
+        self.rule_manager.eval_all_rules(
+            "turn-yellow", "turn-red",
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual(self.calls, ["get_trafficlight_color"])
+
+    def test_properties_computed_on_first_read(self):
+        tl = Trafficlight()
+        # 'turn-yellow' fires first, so the counter referenced by 'count-turn-yellow' is never read
+        rule_results = self.rule_manager.eval_first_true_rule(
+            "turn-yellow", "count-turn-yellow",
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual(self.calls, ["get_trafficlight_color"])
+        self.assertEqual(rule_results["trafficlight"].color, 'yellow')
+
+        self.calls.clear()
+        self.rule_manager.eval_first_true_rule(
+            "count-turn-red", "turn-red",
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual(self.calls, ["get_trafficlight_color", "get_trafficlight_counter"])
+
+    def test_property_function_errors_propagate(self):
+        def get_trafficlight_color(color):
+            raise TypeError("no color")
+
+        rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={"trafficlight_color": [get_trafficlight_color]},
+        )
+        tl = Trafficlight()
+        # turn-red fires on a None color if the TypeError is taken for a missing var
+        with self.assertRaises(PropertyFunctionError) as raised:
+            rule_manager.eval_all_rules("turn-yellow", "turn-red", trafficlight=tl, trafficlight_color=tl.color)
+        self.assertIsInstance(raised.exception.__cause__, TypeError)
+        self.assertEqual(tl.color, 'green')
+
+        with self.assertRaises(PropertyFunctionError) as raised:
+            self.rule_manager.eval_all_rules("turn-yellow", "turn-red", trafficlight=tl)
+        self.assertIsInstance(raised.exception.__cause__, KeyError)
+        self.assertEqual(tl.color, 'green')
+
+class TestRuleSetQueries(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+        self.rules = ["turn-yellow", "turn-green", "turn-red"]
+
+    def test_rule_set_loads_with_one_query(self):
+        with self.assertNumQueries(1):
+            rule_set = RuleSet.load(*self.rules)
+        self.assertEqual([entry.rule_name for entry in rule_set], self.rules)
+        self.assertEqual(
+            [entry.action_function_name for entry in rule_set],
+            ["set_color_to_yellow", "set_color_to_green", "set_color_to_red"]
+        )
+        self.assertEqual(rule_set.var_names, frozenset(["get_trafficlight_color"]))
+
+    def test_missing_rule_raises(self):
+        with self.assertRaises(RuleActionPair.DoesNotExist):
+            RuleSet.load("turn-yellow", "no-such-rule")
+
+    def test_eval_issues_no_queries_in_steady_state(self):
+        tl = Trafficlight()
+        TrafficLightRuleManager.eval_first_true_rule(
+            *self.rules,
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        with self.assertNumQueries(0):
+            rule_results = TrafficLightRuleManager.eval_first_true_rule(
+                *self.rules,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+            rule_results = TrafficLightRuleManager.eval_all_rules(
+                *self.rules,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+        self.assertEqual(rule_results["trafficlight"].color, 'green')
+
+    def test_eval_with_rule_set(self):
+        rule_set = RuleSet.load(*self.rules)
+        tl = Trafficlight()
+        with self.assertNumQueries(0):
+            rule_results = TrafficLightRuleManager.eval_first_true_rule(
+                rule_set,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+        self.assertEqual(rule_results["trafficlight"].color, 'yellow')
+
+    def test_rule_set_reloaded_after_edit(self):
+        rule_set = TrafficLightRuleManager.get_rule_set(*self.rules)
+        self.assertIs(TrafficLightRuleManager.get_rule_set(*self.rules), rule_set)
+
+        rap = RuleActionPair.objects.get(rule__name="turn-yellow")
+        rap.action = Action.objects.get(function_name="set_color_to_red")
+        rap.set_jsonlogic_if_statement()
+        rap.save()
+        self.assertFalse(rule_set.is_current())
+
+        tl = Trafficlight()
+        with self.assertNumQueries(1):
+            rule_results = TrafficLightRuleManager.eval_first_true_rule(
+                *self.rules,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+        self.assertEqual(rule_results["trafficlight"].color, 'red')
+
+
+class TestBatchEvaluation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        self.states = [(color, counter) for color in ['green', 'yellow', 'red'] for counter in range(7)]
+
+    def get_contexts(self):
+        contexts = []
+        for color, counter in self.states:
+            tl = Trafficlight()
+            tl.color = color
+            tl.counter = counter
+            contexts.append({"trafficlight": tl, "trafficlight_color": tl.color, "trafficlight_counter": tl.counter})
+        return contexts
+
+    def assert_same_results(self, batch_results, single_results):
+        self.assertEqual(len(batch_results), len(single_results))
+        for batch_result, single_result in zip(batch_results, single_results):
+            self.assertEqual(batch_result.keys(), single_result.keys())
+            for context_type in batch_result:
+                self.assertEqual(vars(batch_result[context_type]), vars(single_result[context_type]))
+
+    def test_eval_all_rules_batch(self):
+        single_results = [TrafficLightRuleManager.eval_all_rules(*self.rules, **context) for context in self.get_contexts()]
+        batch_results = TrafficLightRuleManager.eval_all_rules_batch(self.get_contexts(), *self.rules)
+        self.assert_same_results(batch_results, single_results)
+
+    def test_eval_first_true_rule_batch(self):
+        single_results = [TrafficLightRuleManager.eval_first_true_rule(*self.rules, **context) for context in self.get_contexts()]
+        with self.assertNumQueries(0):
+            batch_results = TrafficLightRuleManager.eval_first_true_rule_batch(self.get_contexts(), *self.rules)
+        self.assert_same_results(batch_results, single_results)
+
+    def test_vectorized_property_function(self):
+        columns = []
+
+        def get_counter_column(counters):
+            columns.append(list(counters))
+            return counters
+
+        @vectorized(get_counter_column)
+        def get_trafficlight_counter(counter):
+            raise AssertionError('row-wise property function called in a batch')
+
+        rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={
+                "trafficlight_color": [_trafficlightrules.get_trafficlight_color],
+                "trafficlight_counter": [get_trafficlight_counter],
+            },
+        )
+        batch_results = rule_manager.eval_first_true_rule_batch(self.get_contexts(), *self.rules)
+        single_results = [TrafficLightRuleManager.eval_first_true_rule(*self.rules, **context) for context in self.get_contexts()]
+        self.assert_same_results(batch_results, single_results)
+        self.assertEqual(columns, [[counter for _, counter in self.states]])
+
+
+class TestConcurrentEvaluation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+
+        def get_trafficlight_color(color):
+            time.sleep(0.0005) # widen the window in which threads interleave
+            return color
+
+        self.rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={
+                "trafficlight_color": [get_trafficlight_color],
+                "trafficlight_counter": [_trafficlightrules.get_trafficlight_counter],
+            },
+        )
+        # worker threads use their own database connections, which cannot see this test's transaction
+        self.rule_set = RuleSet.load("turn-yellow", "turn-green", "turn-red")
+
+    def eval_color(self, color):
+        tl = Trafficlight()
+        tl.color = color
+        rule_results = self.rule_manager.eval_first_true_rule(
+            self.rule_set,
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        return color, rule_results["trafficlight"] is tl, rule_results["trafficlight"].color
+
+    def test_parallel_evaluations_do_not_leak(self):
+        next_colors = {"green": "yellow", "yellow": "red", "red": "green"}
+        colors = ["green", "yellow", "red"] * 200
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(self.eval_color, colors))
+        for color, is_own_trafficlight, new_color in results:
+            self.assertTrue(is_own_trafficlight)
+            self.assertEqual(new_color, next_colors[color])
+
+
+class TestAsyncEvaluation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.running = 0
+        self.max_running = 0
+
+        async def get_trafficlight_color(color):
+            await self.track_concurrency()
+            return color
+
+        async def get_trafficlight_counter(counter):
+            await self.track_concurrency()
+            return counter
+
+        async def set_color_to_yellow(tl):
+            tl.color = 'yellow'
+            return tl
+
+        self.rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={
+                "trafficlight_color": [get_trafficlight_color],
+                "trafficlight_counter": [get_trafficlight_counter],
+            },
+            action_function_dict={
+                "trafficlight": [
+                    _trafficlightrules.set_color_to_green,
+                    set_color_to_yellow,
+                    _trafficlightrules.set_color_to_red,
+                    _trafficlightrules.increment_counter,
+                    _trafficlightrules.reset_counter,
+                ]
+            },
+        )
+
+    async def track_concurrency(self):
+        self.running = self.running + 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running = self.running - 1
+
+    async def test_aeval_first_true_rule(self):
+        tl = Trafficlight()
+        rules = ["turn-yellow", "turn-green", "turn-red"]
+        for color in ['yellow', 'red', 'green']:
+            rule_results = await self.rule_manager.aeval_first_true_rule(
+                *rules,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+            tl = rule_results["trafficlight"]
+            self.assertEqual(tl.color, color)
+
+    async def test_aeval_all_rules_gathers_properties(self):
+        tl = Trafficlight()
+        rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        for i in range(5):
+            rule_results = await self.rule_manager.aeval_all_rules(
+                *rules,
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+            tl = rule_results["trafficlight"]
+        self.assertEqual((tl.color, tl.counter), ('green', 5))
+        rule_results = await self.rule_manager.aeval_all_rules(
+            *rules,
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual((rule_results["trafficlight"].color, rule_results["trafficlight"].counter), ('yellow', 0))
+        self.assertEqual(self.max_running, 2)
+
+    async def test_aeval_with_sync_functions(self):
+        tl = Trafficlight()
+        rule_results = await TrafficLightRuleManager.aeval_first_true_rule(
+            "turn-yellow",
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual(rule_results["trafficlight"].color, 'yellow')
+
+
+class TestSharedConditions(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        self.rule_manager = make_trafficlight_rule_manager()
+
+    def test_shared_condition_table(self):
+        rule_set = self.rule_manager.get_rule_set(*self.rules)
+        # color == green/yellow/red, counter > 4 and counter < 5, referenced 8 times
+        self.assertEqual(len(rule_set.shared_conditions), 5)
+        self.assertEqual(rule_set.shared_conditions.num_references, 8)
+
+    def test_shared_conditions_evaluated_once_per_call(self):
+        tl = Trafficlight()
+        tl.counter = 5
+        rule_results = self.rule_manager.eval_all_rules(
+            *self.rules,
+            trafficlight=tl,
+            trafficlight_color=tl.color,
+            trafficlight_counter=tl.counter)
+        self.assertEqual((rule_results["trafficlight"].color, rule_results["trafficlight"].counter), ('yellow', 0))
+        # count-turn-red and count-turn-green are skipped by the equality index and inc_counter_rule by the
+        # threshold index; 'counter > 4' is reused by reset_counter_rule
+        self.assertEqual(self.rule_manager.condition_stats, {"evaluated": 2, "saved": 1})
+
+
+class TestEvaluationSession(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+
+    def test_session_matches_full_evaluation(self):
+        rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        session = TrafficLightRuleManager.start_session(*rules)
+        session_tl = Trafficlight()
+        full_tl = Trafficlight()
+        session.eval_all_rules(trafficlight=session_tl, trafficlight_color=session_tl.color, trafficlight_counter=session_tl.counter)
+        TrafficLightRuleManager.eval_all_rules(*rules, trafficlight=full_tl, trafficlight_color=full_tl.color, trafficlight_counter=full_tl.counter)
+
+        for tick in range(30):
+            changed = {"trafficlight_counter": session_tl.counter}
+            if tick % 6 == 5:
+                changed["trafficlight_color"] = session_tl.color
+            session.eval_all_rules(**changed)
+            TrafficLightRuleManager.eval_all_rules(*rules, trafficlight=full_tl, trafficlight_color=full_tl.color, trafficlight_counter=full_tl.counter)
+            self.assertEqual(vars(session_tl), vars(full_tl))
+
+    def test_only_dependent_rules_are_redecided(self):
+        rules = ['turn-yellow', 'turn-red', 'turn-green', 'inc_counter_rule', 'reset_counter_rule']
+        session = TrafficLightRuleManager.start_session(*rules)
+        tl = Trafficlight()
+        session.eval_all_rules(trafficlight=tl, trafficlight_color='blue', trafficlight_counter=tl.counter)
+        self.assertEqual(session.num_redecided_rules, 5)
+
+        rule_results = session.eval_all_rules(trafficlight_counter=tl.counter)
+        self.assertEqual(session.num_redecided_rules, 2)
+        self.assertEqual(rule_results["trafficlight"].counter, 2)
+
+        rule_results = session.eval_all_rules(trafficlight_color='red')
+        self.assertEqual(session.num_redecided_rules, 3)
+        self.assertEqual((rule_results["trafficlight"].color, rule_results["trafficlight"].counter), ('green', 3))
+
+    def test_session_first_true_rule(self):
+        rules = ["turn-yellow", "turn-green", "turn-red"]
+        session = TrafficLightRuleManager.start_session(*rules)
+        tl = Trafficlight()
+        session.eval_first_true_rule(trafficlight=tl, trafficlight_color=tl.color, trafficlight_counter=tl.counter)
+        self.assertEqual(tl.color, 'yellow')
+        session.eval_first_true_rule(trafficlight_counter=1)
+        self.assertEqual(session.num_redecided_rules, 0)
+        self.assertEqual(tl.color, 'yellow')
+        for color in ['red', 'green', 'yellow']:
+            session.eval_first_true_rule(trafficlight_color=tl.color)
+            self.assertEqual(tl.color, color)
+
+
+class TestDecisionCache(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        self.rule_manager = make_trafficlight_rule_manager(decision_cache_size=64)
+
+    def test_cached_decisions_match_full_evaluation(self):
+        for eval_method in ['eval_first_true_rule', 'eval_all_rules']:
+            cached_tl = Trafficlight()
+            full_tl = Trafficlight()
+            for _ in range(40):
+                getattr(self.rule_manager, eval_method)(*self.rules,
+                    trafficlight=cached_tl, trafficlight_color=cached_tl.color, trafficlight_counter=cached_tl.counter)
+                getattr(TrafficLightRuleManager, eval_method)(*self.rules,
+                    trafficlight=full_tl, trafficlight_color=full_tl.color, trafficlight_counter=full_tl.counter)
+                self.assertEqual(vars(cached_tl), vars(full_tl))
+
+    def test_repeated_values_skip_condition_evaluation(self):
+        tl = Trafficlight()
+        for _ in range(3):
+            results = self.rule_manager.eval_all_rules(*self.rules, trafficlight=tl, trafficlight_color='green', trafficlight_counter=5)
+        self.assertEqual(self.rule_manager.decision_cache.cache_info()[:2], (2, 1))
+        evaluated = self.rule_manager.condition_stats["evaluated"]
+        self.rule_manager.eval_all_rules(*self.rules, trafficlight=tl, trafficlight_color='green', trafficlight_counter=5)
+        self.assertEqual(self.rule_manager.condition_stats["evaluated"], evaluated)
+        # actions still run on every call
+        self.assertEqual((results["trafficlight"].color, tl.color, tl.counter), ('yellow', 'yellow', 0))
+
+    def test_value_types_are_part_of_the_key(self):
+        tl = Trafficlight()
+        self.rule_manager.eval_first_true_rule('count-turn-yellow', trafficlight=tl, trafficlight_color=1, trafficlight_counter=5)
+        self.rule_manager.eval_first_true_rule('count-turn-yellow', trafficlight=tl, trafficlight_color=True, trafficlight_counter=5)
+        self.assertEqual(self.rule_manager.decision_cache.cache_info()[:2], (0, 2))
+
+    def test_rule_changes_invalidate_decisions(self):
+        tl = Trafficlight()
+        self.rule_manager.eval_first_true_rule('inc_counter_rule', trafficlight=tl, trafficlight_color='green', trafficlight_counter=1)
+        self.assertEqual(tl.counter, 1)
+        condition = Condition.objects.get(rule__name='inc_counter_rule')
+        condition.operator = BoolOperator.objects.get(jsonlogic_operator=">", context_type="trafficlight_counter")
+        condition.save()
+        rap = RuleActionPair.objects.get(rule__name='inc_counter_rule')
+        rap.set_jsonlogic_if_statement()
+        rap.save()
+        self.rule_manager.eval_first_true_rule('inc_counter_rule', trafficlight=tl, trafficlight_color='green', trafficlight_counter=1)
+        self.assertEqual(tl.counter, 1)
+
+    async def test_async_evaluation_uses_the_cache(self):
+        tl = Trafficlight()
+        for _ in range(2):
+            await self.rule_manager.aeval_first_true_rule(*self.rules,
+                trafficlight=tl, trafficlight_color='red', trafficlight_counter=7)
+        self.assertEqual(self.rule_manager.decision_cache.cache_info()[:2], (1, 1))
+        self.assertEqual(tl.color, 'green')
+
+
+class TestDecisionTreeEvaluation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+        self.rule_manager = make_trafficlight_rule_manager(use_decision_trees=True)
+
+    def test_matches_sequential_evaluation(self):
+        for colors in [['green', 'yellow', 'red'], ['red', 'blue']]:
+            for color in colors:
+                for counter in range(-1, 7):
+                    tree_tl = Trafficlight()
+                    sequential_tl = Trafficlight()
+                    self.rule_manager.eval_first_true_rule(*self.rules,
+                        trafficlight=tree_tl, trafficlight_color=color, trafficlight_counter=counter)
+                    TrafficLightRuleManager.eval_first_true_rule(*self.rules,
+                        trafficlight=sequential_tl, trafficlight_color=color, trafficlight_counter=counter)
+                    self.assertEqual(vars(tree_tl), vars(sequential_tl), (color, counter))
+        self.assertIsNotNone(self.rule_manager.get_rule_set(*self.rules).get_decision_tree().root)
+
+    def test_tree_is_rebuilt_when_a_rule_changes(self):
+        decision_tree = self.rule_manager.get_rule_set(*self.rules).get_decision_tree()
+        self.assertIs(self.rule_manager.get_rule_set(*self.rules).get_decision_tree(), decision_tree)
+
+        tl = Trafficlight()
+        self.rule_manager.eval_first_true_rule('inc_counter_rule', trafficlight=tl, trafficlight_color='green', trafficlight_counter=1)
+        self.assertEqual(tl.counter, 1)
+        condition = Condition.objects.get(rule__name='inc_counter_rule')
+        condition.operator = BoolOperator.objects.get(jsonlogic_operator=">", context_type="trafficlight_counter")
+        condition.save()
+        rap = RuleActionPair.objects.get(rule__name='inc_counter_rule')
+        rap.set_jsonlogic_if_statement()
+        rap.save()
+        self.rule_manager.eval_first_true_rule('inc_counter_rule', trafficlight=tl, trafficlight_color='green', trafficlight_counter=1)
+        self.assertEqual(tl.counter, 1)
+        self.assertIsNot(self.rule_manager.get_rule_set(*self.rules).get_decision_tree(), decision_tree)
+
+    async def test_async_evaluation_uses_the_tree(self):
+        rule_set = await self.rule_manager.aget_rule_set(*self.rules)
+        tl = Trafficlight()
+        await self.rule_manager.aeval_first_true_rule(rule_set, trafficlight=tl, trafficlight_color='green', trafficlight_counter=5)
+        self.assertEqual(tl.color, 'yellow')
+        self.assertIsNotNone(rule_set.decision_tree)
+
+    def test_cannot_be_combined_with_a_decision_cache(self):
+        with self.assertRaises(ValueError):
+            make_trafficlight_rule_manager(use_decision_trees=True, decision_cache_size=16)
+
+
+def get_light_color(tl):
+    return tl.color
+
+def get_light_counter(tl):
+    return tl.counter
+
+class TestMutatingActions(TestCase):
+
+    def setUp(self):
+        self.rule_managers = [
+            make_trafficlight_rule_manager(
+                property_function_dict={"trafficlight": [get_light_color, get_light_counter]},
+                boolOperator_string_dict={"trafficlight": ["==", "!="]},
+                context_types=["trafficlight"],
+                **options,
+            )
+            for options in [{}, {"decision_cache_size": 16}, {"use_decision_trees": True}]
+        ]
+        self.rule_managers[0].build_models()
+        # both properties read the trafficlight that the first rule's action changes
+        build_light_rule("light-counter-is-zero", "get_light_counter", "==", 0, "set_color_to_yellow")
+        build_light_rule("light-is-not-green", "get_light_color", "!=", "green", "set_color_to_red")
+        self.rules = ("light-counter-is-zero", "light-is-not-green")
+
+    def test_rules_see_the_properties_from_before_any_action(self):
+        for rule_manager in self.rule_managers:
+            rule_results = rule_manager.eval_all_rules(*self.rules, trafficlight=Trafficlight())
+            self.assertEqual(rule_results["trafficlight"].color, 'yellow')
+            session_results = rule_manager.start_session(*self.rules).eval_all_rules(trafficlight=Trafficlight())
+            self.assertEqual(session_results["trafficlight"].color, 'yellow')
+            batch_results = rule_manager.eval_all_rules_batch([{"trafficlight": Trafficlight()}], *self.rules)
+            self.assertEqual(batch_results[0]["trafficlight"].color, 'yellow')
+
+    async def test_async_rules_see_the_properties_from_before_any_action(self):
+        rule_results = await self.rule_managers[0].aeval_all_rules(*self.rules, trafficlight=Trafficlight())
+        self.assertEqual(rule_results["trafficlight"].color, 'yellow')
+
+def build_light_rule(name, function_name, operator, literal, action_function_name):
+    rule = Rule(
+        name = name,
+        logic_string = "1",
+        num_conditions = 1,
+        jsonlogic_only_boolean_symbols = {},
+        jsonlogic_full_conditions = {},
+    )
+    rule.save()
+    cond = Condition(
+        rule = rule,
+        rule_index = 1,
+        operand_subject = Property.objects.get(function_name=function_name, context_type="trafficlight"),
+        operand_object = Property.objects.get(function_name="freetext", context_type="trafficlight"),
+        freetext_object = literal,
+        operator = BoolOperator.objects.get(jsonlogic_operator=operator, context_type="trafficlight"),
+        jsonlogic_condition = {},
+    )
+    cond.save()
+    rap = RuleActionPair(
+        jsonlogic_if_statement = {},
+        rule = rule,
+        action = Action.objects.get(function_name=action_function_name)
+    )
+    rap.set_jsonlogic_if_statement()
+    rap.save()
+
+
 def build_turn_yellow_rule():
     build_turn_color_rule(color="yellow", prev_color="green")
 
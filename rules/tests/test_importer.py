@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from ..importer import RuleImportError, import_rules, read_rules_csv, read_rules_jsonl
+from ..models import Rule, Condition, RuleActionPair, max_logic_depth
+from ._trafficlightrules import TrafficLightRuleManager, Trafficlight
+from .test_eval_rules import build_turn_yellow_on_counter, build_reset_counter_rule
+from .test_large_rules import get_nested_logic_string
+
+def get_counter_rule_record(name, color, prev_color):
+    return {
+        "name": name,
+        "logic_string": "1 AND 2",
+        "action": "set_color_to_" + color,
+        "conditions": [
+            {"context_type": "trafficlight_color", "subject": "get_trafficlight_color", "operator": "==", "freetext_object": prev_color},
+            {"context_type": "trafficlight_counter", "subject": "get_trafficlight_counter", "operator": ">", "freetext_object": 4},
+        ],
+    }
+
+csv_rules = """name,logic_string,action,context_type,subject,operator,freetext_object
+imported-reset,1,reset_counter,trafficlight_counter,get_trafficlight_counter,>,4
+imported-turn-yellow,1 AND 2,set_color_to_yellow,trafficlight_color,get_trafficlight_color,==,green
+imported-turn-yellow,1 AND 2,set_color_to_yellow,trafficlight_counter,get_trafficlight_counter,>,4
+"""
+
+class TestImportRules(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        # the test's transaction never commits, so the revision bumps scheduled for the commit are run here
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('createrulemodels')
+
+    def get_rule_jsonlogic(self, name):
+        rule = Rule.objects.get(name=name)
+        # the test helpers leave the Rule's own jsonlogic fields unsaved, so compare the pair and the conditions
+        return (rule.logic_string, rule.num_conditions,
+                RuleActionPair.objects.get(rule=rule).jsonlogic_if_statement,
+                sorted((condition.rule_index, json.dumps(condition.jsonlogic_condition)) for condition in rule.condition_set.all()))
+
+    def test_imported_rules_match_built_rules(self):
+        build_turn_yellow_on_counter()
+        build_reset_counter_rule()
+        lines = [json.dumps(get_counter_rule_record("imported-turn-yellow", "yellow", "green")) + "\n", "\n"]
+        self.assertEqual(import_rules(read_rules_jsonl(lines)), 1)
+        self.assertEqual(import_rules(read_rules_csv(io.StringIO(csv_rules[:csv_rules.index("imported-turn-yellow")]))), 1)
+
+        self.assertEqual(self.get_rule_jsonlogic("imported-turn-yellow"), self.get_rule_jsonlogic("count-turn-yellow"))
+        self.assertEqual(self.get_rule_jsonlogic("imported-reset"), self.get_rule_jsonlogic("reset_counter_rule"))
+        self.assertEqual(Rule.objects.get(name="imported-reset").jsonlogic_full_conditions,
+                         { ">": [{"var": "get_trafficlight_counter"}, "4"] })
+
+        tl = Trafficlight()
+        TrafficLightRuleManager.eval_all_rules("imported-turn-yellow", "imported-reset",
+            trafficlight=tl, trafficlight_color="green", trafficlight_counter=5)
+        self.assertEqual((tl.color, tl.counter), ("yellow", 0))
+
+    def test_csv_rows_are_grouped_per_rule(self):
+        records = list(read_rules_csv(io.StringIO(csv_rules)))
+        self.assertEqual([(record["name"], len(record["conditions"])) for record in records],
+                         [("imported-reset", 1), ("imported-turn-yellow", 2)])
+
+    def test_chunks(self):
+        records = (get_counter_rule_record("imported-" + str(index), "red", "yellow") for index in range(25))
+        # per chunk: the existing name check, a savepoint pair and three bulk inserts; plus the reference maps and one
+        # revision bump, as the chunks share the test's transaction
+        with self.assertNumQueries(3 + 3 * 6 + 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(import_rules(records, chunk_size=10), 25)
+        self.assertEqual(Condition.objects.filter(rule__name__startswith="imported-").count(), 50)
+
+    def test_databases_without_bulk_insert_primary_keys(self):
+        records = [get_counter_rule_record("imported-" + str(index), "red", "yellow") for index in range(3)]
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False):
+            with mock.patch.object(Rule.objects, 'bulk_create', side_effect=AssertionError('rules were bulk created')):
+                self.assertEqual(import_rules(records, chunk_size=2), 3)
+        for rule in Rule.objects.filter(name__startswith="imported-"):
+            self.assertEqual(rule.condition_set.count(), 2)
+            self.assertEqual(RuleActionPair.objects.get(rule=rule).action.function_name, "set_color_to_red")
+
+    def test_invalid_records(self):
+        invalid_records = [
+            dict(get_counter_rule_record("bad", "red", "yellow"), logic_string="1 AND"),
+            dict(get_counter_rule_record("bad", "red", "yellow"), logic_string="1"),
+            dict(get_counter_rule_record("bad", "red", "yellow"), action="set_color_to_blue"),
+            dict(get_counter_rule_record("bad", "red", "yellow"), conditions=[{"context_type": "trafficlight_color", "operator": "<"}]),
+            {"name": "bad"},
+        ]
+        for record in invalid_records:
+            with self.assertRaises(RuleImportError) as context:
+                import_rules([get_counter_rule_record("good", "red", "yellow"), record], chunk_size=1)
+            self.assertEqual(context.exception.record_number, 2)
+            Rule.objects.filter(name="good").delete()
+        self.assertFalse(Rule.objects.filter(name="bad").exists())
+
+        import_rules([get_counter_rule_record("good", "red", "yellow")])
+        with self.assertRaises(RuleImportError):
+            import_rules([get_counter_rule_record("good", "red", "yellow")])
+        with self.assertRaises(RuleImportError):
+            import_rules([get_counter_rule_record("twice", "red", "yellow")] * 2)
+        self.assertFalse(Rule.objects.filter(name="twice").exists())
+
+    def test_nesting_limit(self):
+        def get_nested_record(name, num_conditions):
+            condition = {"context_type": "trafficlight_counter", "subject": "get_trafficlight_counter", "operator": ">", "freetext_object": 4}
+            return dict(get_counter_rule_record(name, "red", "yellow"), logic_string=get_nested_logic_string(num_conditions),
+                        conditions=[condition] * num_conditions)
+
+        # n nested conditions nest n - 1 levels deep
+        import_rules([get_nested_record("deepest", max_logic_depth + 1)])
+        self.assertEqual(Rule.objects.get(name="deepest").condition_set.count(), max_logic_depth + 1)
+        with self.assertRaises(RuleImportError) as context:
+            import_rules([get_counter_rule_record("good", "red", "yellow"), get_nested_record("too-deep", max_logic_depth + 2)])
+        self.assertEqual(context.exception.record_number, 2)
+        self.assertFalse(Rule.objects.filter(name__in=["good", "too-deep"]).exists())
+
+    def test_importrules_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.csv")
+            with open(path, "w") as rules_file:
+                rules_file.write(csv_rules)
+            output = io.StringIO()
+            call_command('importrules', path, stdout=output)
+            self.assertEqual(output.getvalue().strip(), "Imported 2 rules")
+            with self.assertRaises(CommandError):
+                call_command('importrules', path, stdout=output)
@@ -0,0 +1,139 @@
+import collections.abc
+import random
+
+from django.test import TestCase
+
+from ..compiler import compile_jsonlogic
+from ..indexes import RuleIndex, get_conjuncts
+
+def get_random_condition(rand):
+    color_test = { "==": [{"var": "color"}, rand.choice(["green", "yellow", "red", "4", "True", "None"])] }
+    if rand.random() < 0.3:
+        color_test = { "==": [color_test["=="][1], {"var": "color"}] }
+    counter_test = { rand.choice([">", "<", ">=", "<=", "==", "!="]): [{"var": "counter"}, str(rand.randint(0, 8))] }
+    shape = rand.randint(0, 5)
+    if shape == 0:
+        return color_test
+    if shape == 1:
+        return { "and": [counter_test, color_test] }
+    if shape == 2:
+        return { "and": [counter_test, { "and": [{ "!": [{ "==": [{"var": "size"}, "big"] }] }, color_test] }] }
+    if shape == 3:
+        return { "or": [color_test, counter_test] }
+    if shape == 4:
+        return { "and": [counter_test, { "==": [{"var": "size"}, rand.choice(["big", "small"])] }, color_test] }
+    return counter_test
+
+def get_random_data(rand):
+    return {
+        "color": rand.choice(["green", "yellow", "red", 4, True, None, "blue"]),
+        "counter": rand.randint(-1, 9),
+        "size": rand.choice(["big", "small"]),
+    }
+
+class TestRuleIndex(TestCase):
+
+    def test_candidates_match_full_scan(self):
+        rand = random.Random(9)
+        for trial in range(20):
+            conditions = [get_random_condition(rand) for _ in range(rand.randint(1, 60))]
+            compiled_conditions = [compile_jsonlogic(condition) for condition in conditions]
+            index = RuleIndex(conditions)
+            for _ in range(30):
+                data = get_random_data(rand)
+                fired = [position for position, compiled in enumerate(compiled_conditions) if compiled(data)]
+                candidates = list(index.get_candidate_positions(data))
+                self.assertEqual(candidates, sorted(candidates))
+                self.assertTrue(set(fired) <= set(candidates), (conditions, data))
+                self.assertEqual(
+                    [position for position in candidates if compiled_conditions[position](data)],
+                    fired)
+
+    def test_non_matching_rules_are_skipped(self):
+        conditions = [
+            { "==": [{"var": "color"}, "green"] },
+            { "and": [{ ">": [{"var": "counter"}, "4"] }, { "==": [{"var": "color"}, "red"] }] },
+            { "or": [{ "==": [{"var": "color"}, "red"] }, { ">": [{"var": "counter"}, "4"] }] },
+            { "==": ["red", {"var": "color"}] },
+            None,
+        ]
+        index = RuleIndex(conditions)
+        self.assertEqual(list(index.get_candidate_positions({"color": "red"})), [1, 2, 3, 4])
+        self.assertEqual(list(index.get_candidate_positions({"color": "green"})), [0, 2, 4])
+        self.assertEqual(list(index.get_candidate_positions({})), [2, 4])
+
+    def test_lookup_errors_are_not_hidden(self):
+        class FailingData(collections.abc.Mapping):
+            def __getitem__(self, var_name):
+                raise TypeError("property failed")
+            def __iter__(self):
+                return iter([])
+            def __len__(self):
+                return 0
+
+        index = RuleIndex([{ "==": [{"var": "color"}, "green"] }, { ">": [{"var": "counter"}, "4"] }])
+        with self.assertRaises(TypeError):
+            list(index.get_candidate_positions(FailingData()))
+
+    def test_threshold_gates(self):
+        conditions = [
+            { ">": [{"var": "counter"}, "4"] },
+            { "and": [{ "<=": [{"var": "counter"}, "2.5"] }, { "!=": [{"var": "color"}, "red"] }] },
+            { ">=": [7, {"var": "counter"}] },
+            { "<": [{"var": "counter"}, "abc"] },
+        ]
+        index = RuleIndex(conditions)
+        self.assertEqual(index.ungated_positions, [3])
+        self.assertEqual(list(index.get_candidate_positions({"counter": 5})), [0, 2, 3])
+        self.assertEqual(list(index.get_candidate_positions({"counter": 2})), [1, 2, 3])
+        self.assertEqual(list(index.get_candidate_positions({"counter": 8})), [0, 3])
+        # non-numeric values are compared differently by json_logic, so every threshold rule stays a candidate
+        self.assertEqual(list(index.get_candidate_positions({"counter": "5"})), [0, 1, 2, 3])
+
+    def test_threshold_gates_match_full_scan(self):
+        rand = random.Random(3)
+        operators = [">", ">=", "<", "<="]
+        thresholds = ["3", "3.5", "-1", 2, 4.0, "0.25", "10"]
+        conditions = []
+        for _ in range(300):
+            test = { rand.choice(operators): [{"var": "counter"}, rand.choice(thresholds)] }
+            if rand.random() < 0.3:
+                test = { rand.choice(operators): [rand.choice(thresholds), {"var": "counter"}] }
+            conditions.append(test if rand.random() < 0.5 else { "and": [{ "!=": [{"var": "color"}, "red"] }, test] })
+        compiled_conditions = [compile_jsonlogic(condition) for condition in conditions]
+        index = RuleIndex(conditions)
+
+        for counter in [-2, -1, 0, 0.25, 1, 2, 2.0, 3, 3.5, 4, 4.0, 5, float('nan'), None, "3"]:
+            for color in ["red", "green"]:
+                data = {"counter": counter, "color": color}
+                fired = [position for position, compiled in enumerate(compiled_conditions) if compiled(data)]
+                candidates = list(index.get_candidate_positions(data))
+                self.assertEqual(
+                    [position for position in candidates if compiled_conditions[position](data)],
+                    fired,
+                    data)
+
+    def test_threshold_index_skips_most_conditions(self):
+        rand = random.Random(10)
+        num_rules = 10000
+        conditions = [
+            { rand.choice([">", ">="]): [{"var": "counter"}, str(rand.randint(0, num_rules))] }
+            for _ in range(num_rules)
+        ]
+        compiled_conditions = [compile_jsonlogic(condition) for condition in conditions]
+        index = RuleIndex(conditions)
+        values = [{"counter": rand.randint(0, 200)} for _ in range(20)]
+
+        scanned = [[position for position, compiled in enumerate(compiled_conditions) if compiled(data)] for data in values]
+        candidates = [list(index.get_candidate_positions(data)) for data in values]
+        self.assertEqual([[position for position in positions if compiled_conditions[position](data)]
+                          for positions, data in zip(candidates, values)], scanned)
+        # counting the conditions evaluated rather than timing them: a full scan evaluates every rule for every value
+        self.assertLess(sum(len(positions) for positions in candidates), num_rules * len(values) // 20)
+
+    def test_get_conjuncts(self):
+        a = { "==": [{"var": "a"}, "1"] }
+        b = { "==": [{"var": "b"}, "1"] }
+        c = { "or": [a, b] }
+        self.assertEqual(get_conjuncts({ "and": [a, { "and": [b, c] }] }), [a, b, c])
+        self.assertEqual(get_conjuncts(c), [c])
@@ -0,0 +1,68 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..instrumentation import CallbackInstrumentation, InMemoryInstrumentation, MetricEvent, null_instrumentation
+from ..models import Rule
+from . import _trafficlightrules
+from ._trafficlightrules import Trafficlight, make_trafficlight_rule_manager
+from .test_eval_rules import build_turn_yellow_rule, build_turn_red_rule, build_turn_green_rule
+
+
+class TestInstrumentation(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+        self.rules = ["turn-yellow", "turn-green", "turn-red"]
+
+    def eval_rules(self, rule_manager, num_evals):
+        tl = Trafficlight()
+        for _ in range(num_evals):
+            rule_manager.eval_first_true_rule(*self.rules, trafficlight=tl, trafficlight_color=tl.color, trafficlight_counter=tl.counter)
+
+    def test_uninstrumented_manager_calls_plain_functions(self):
+        rule_manager = make_trafficlight_rule_manager()
+        self.assertIs(rule_manager.instrumentation, null_instrumentation)
+        self.assertIs(rule_manager.property_functions["get_trafficlight_color"][0], _trafficlightrules.get_trafficlight_color)
+        self.assertIs(rule_manager.action_functions["set_color_to_red"], _trafficlightrules.set_color_to_red)
+
+    def test_in_memory_metrics(self):
+        instrumentation = InMemoryInstrumentation()
+        self.eval_rules(make_trafficlight_rule_manager(instrumentation=instrumentation), 6)
+        summary = instrumentation.get_summary()
+
+        # the index only evaluates the rule gated on the current color, and it always fires
+        self.assertEqual({name: (metrics["calls"], metrics["fires"]) for name, metrics in summary["rule"].items()},
+                         {"turn-yellow": (2, 2), "turn-red": (2, 2), "turn-green": (2, 2)})
+        self.assertEqual(summary["property"]["get_trafficlight_color"]["calls"], 6)
+        self.assertEqual(summary["action"]["set_color_to_yellow"]["calls"], 2)
+        for metrics in summary["rule"].values():
+            self.assertLessEqual(metrics["p50_ms"], metrics["p99_ms"])
+            self.assertGreater(metrics["total_ms"], 0)
+
+        instrumentation.reset()
+        self.assertEqual(instrumentation.get_summary(), {})
+
+    def test_callback_and_query_counts(self):
+        events = []
+
+        def count_rules(tl):
+            Rule.objects.count()
+            return _trafficlightrules.set_color_to_yellow(tl)
+        count_rules.__name__ = "set_color_to_yellow"
+
+        rule_manager = make_trafficlight_rule_manager()
+        rule_manager.action_function_dict = {"trafficlight": [count_rules]}
+        rule_manager.set_instrumentation(CallbackInstrumentation(events.append, count_queries=True))
+        self.eval_rules(rule_manager, 1)
+
+        self.assertEqual([event[:2] for event in events], [
+            ("property", "get_trafficlight_color"),
+            ("rule", "turn-yellow"),
+            ("action", "set_color_to_yellow"),
+        ])
+        self.assertTrue(all(isinstance(event, MetricEvent) for event in events))
+        self.assertEqual([(event.fired, event.num_queries) for event in events], [(None, 0), (True, 0), (None, 1)])
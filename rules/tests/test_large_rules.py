@@ -0,0 +1,109 @@
+import random
+
+from django.test import TestCase
+
+from ..compiler import compile_jsonlogic, max_closure_depth
+from ..logic import get_jsonlogic, is_valid_logic_string, optimize_jsonlogic
+from ..logic import LogicStringError
+from ..models import Rule, RuleActionPair, max_logic_depth
+from ._syntheticrules import SyntheticRuleManager, create_synthetic_rules
+
+def get_nested_logic_string(num_conditions):
+    # 1 AND (2 OR (3 AND (4 OR ...))): one level of nesting per condition, which no optimization removes
+    logic_string = str(num_conditions)
+    for number in range(num_conditions - 1, 0, -1):
+        logic_string = str(number) + (" AND (" if number % 2 else " OR (") + logic_string + ")"
+    return logic_string
+
+def get_nested_result(num_conditions, value):
+    # condition n is value > n
+    result = value > num_conditions
+    for number in range(num_conditions - 1, 0, -1):
+        result = (value > number and result) if number % 2 else (value > number or result)
+    return result
+
+def get_hits_after(rule_action_pair, fired):
+    # eval calls start from 5 hits; the rule either increments or resets them
+    if not fired:
+        return 5
+    return 6 if rule_action_pair.action.function_name == "increment_synthetic_hits" else 0
+
+def compile_nested_rule(num_conditions):
+    logic_string = get_nested_logic_string(num_conditions)
+    if not is_valid_logic_string(logic_string, num_conditions):
+        raise ValueError('invalid nested logic string')
+    rule = Rule(name="nested", logic_string=logic_string, num_conditions=num_conditions)
+    rule.jsonlogic_only_boolean_symbols = optimize_jsonlogic(get_jsonlogic(logic_string))
+    conditions_by_index = {number: {">": [{"var": "value"}, number]} for number in range(1, num_conditions + 1)}
+    condition = rule.replace_jsonlogic_symbols_recur(rule.jsonlogic_only_boolean_symbols, conditions_by_index)
+    return compile_jsonlogic({"if": [condition, "fire", "do_nothing"]})
+
+class TestLargeRules(TestCase):
+
+    def test_deeply_nested_rules(self):
+        for num_conditions in [1000, 10000]:
+            compiled = compile_nested_rule(num_conditions)
+            for value in [0, 1, 2, 3, num_conditions // 2, num_conditions + 1]:
+                expected = "fire" if get_nested_result(num_conditions, value) else "do_nothing"
+                self.assertEqual(compiled({"value": value}), expected)
+
+    def test_program_grows_linearly_with_nesting(self):
+        lengths = {}
+        for num_conditions in [1000, 2000, 10000]:
+            compiled = compile_nested_rule(num_conditions)
+            # runs in a loop, so no RecursionError however deep the rule
+            self.assertEqual(compiled({"value": num_conditions + 1}), "fire")
+            lengths[num_conditions] = len(compiled.function.args[0])
+        # every condition adds the same few instructions (a load and a jump) to the flat program
+        per_condition = lengths[2000] - lengths[1000]
+        self.assertEqual(lengths[10000] - lengths[1000], 9 * per_condition)
+        self.assertLessEqual(per_condition, 2 * 1000)
+
+    def test_stored_rules_with_many_conditions(self):
+        SyntheticRuleManager.build_models()
+        rand = random.Random(4)
+        for num_conditions in [1000, 10000]:
+            rule_action_pair = create_synthetic_rules(1, num_conditions, rand, "large-" + str(num_conditions))[0]
+            rule = Rule.objects.get(pk=rule_action_pair.rule.pk)
+            self.assertEqual(rule.logic_string, rule_action_pair.rule.logic_string)
+            self.assertGreater(len(rule.logic_string), 200)
+
+            stored = RuleActionPair.objects.get(pk=rule_action_pair.pk).jsonlogic_if_statement
+            expected = compile_jsonlogic(stored)
+            for value in [0, 50, 101]:
+                target = {"hits": 5}
+                SyntheticRuleManager.eval_first_true_rule(rule.name, synthetic_value=value, synthetic_target=target)
+                self.assertEqual(target["hits"], get_hits_after(rule_action_pair, expected({"get_synthetic_value": value}) != "do_nothing"))
+
+    def test_stored_deeply_nested_rule(self):
+        # as deep as a stored rule may nest, and deeper than nested closures could be called
+        SyntheticRuleManager.build_models()
+        num_conditions = max_logic_depth + 1
+        self.assertGreater(num_conditions, max_closure_depth)
+        rule_action_pair = create_synthetic_rules(1, num_conditions, random.Random(5), "nested")[0]
+        rule = rule_action_pair.rule
+        rule.logic_string = get_nested_logic_string(num_conditions)
+        rule.save()
+        rule_action_pair.set_jsonlogic_if_statement()
+        rule_action_pair.save()
+
+        comparisons = {"==": lambda value, number: value == number, ">": lambda value, number: value > number,
+                       "<": lambda value, number: value < number}
+        conditions = sorted(rule.condition_set.select_related('operator'), key=lambda condition: condition.rule_index)
+        for value in range(0, 101, 5):
+            truth = [comparisons[condition.operator.jsonlogic_operator](value, int(condition.freetext_object)) for condition in conditions]
+            result = truth[-1]
+            for number in range(num_conditions - 1, 0, -1):
+                result = (truth[number - 1] and result) if number % 2 else (truth[number - 1] or result)
+            target = {"hits": 5}
+            SyntheticRuleManager.eval_first_true_rule(rule.name, synthetic_value=value, synthetic_target=target)
+            self.assertEqual(target["hits"], get_hits_after(rule_action_pair, result))
+
+    def test_stored_rule_nested_too_deeply(self):
+        SyntheticRuleManager.build_models()
+        num_conditions = max_logic_depth + 2
+        rule_action_pair = create_synthetic_rules(1, num_conditions, random.Random(5), "too-deep")[0]
+        rule = rule_action_pair.rule
+        rule.logic_string = get_nested_logic_string(num_conditions)
+        with self.assertRaises(LogicStringError):
+            rule_action_pair.set_jsonlogic_if_statement()
@@ -1,6 +1,11 @@
+import copy
+import itertools
+import random
+import threading
+
 from django.test import TestCase
 
-from ..logic import get_jsonlogic, has_valid_tokens, has_valid_left_parens, has_valid_right_parens, has_balanced_parens
+from ..logic import LogicStringError, LogicStringCache, parse_logic_string, optimize_jsonlogic, get_jsonlogic, has_valid_tokens, has_valid_left_parens, has_valid_right_parens, has_balanced_parens
 from ..logic import has_valid_and_or, has_valid_not, has_valid_number_args, is_valid_logic_string
 
 class TestGetJSONLogicDict(TestCase):
@@ -359,4 +364,207 @@ class TestLogicStringValidation(TestCase):
          test_string = group[0]
          num_args = group[1]
          result = group[2]
-         self.assertEqual(is_valid_logic_string(test_string, num_args), result)
\ No newline at end of file
+         self.assertEqual(is_valid_logic_string(test_string, num_args), result)
+
+class TestParseLogicString(TestCase):
+
+   def test_error_positions(self):
+      test_strings = [
+         ["1 AND x", 2, 6],
+         ["AND 1", 1, 0],
+         ["1 AND", 1, 5],
+         ["1 2 AND 3", 3, 2],
+         ["1 AND NOT NOT 2", 2, 10],
+         ["(1 AND 2", 2, 0],
+         ["1 AND 2)", 2, 7],
+         ["1 AND (2 OR 5)", 4, 12],
+         ["1 AND (2 OR 4)", 4, None],
+         ["1 AND 2", 3, None],
+         ["", 1, None],
+      ]
+      for test_string, num_args, position in test_strings:
+         with self.assertRaises(LogicStringError) as context:
+            parse_logic_string(test_string, num_args)
+         self.assertEqual(context.exception.position, position, test_string)
+
+   def test_dangling_and_or_are_invalid(self):
+      # the has_valid_* checks only look at neighbouring tokens and let these through
+      for test_string in ["1 AND", "AND 1", "1 AND 2 OR"]:
+         self.assertFalse(is_valid_logic_string(test_string, 2 if "2" in test_string else 1))
+
+   def test_parenthesized_single_condition(self):
+      self.assertEqual(get_jsonlogic("((1))"), "@1")
+      self.assertEqual(get_jsonlogic("NOT (1)"), {"NOT": ["@1"]})
+
+   def test_random_expressions(self):
+      rand = random.Random(0)
+      for _ in range(2000):
+         num_args = rand.randint(1, 8)
+         logic_string, jsonlogic = get_random_expression(rand, num_args, 0)
+         if not all(str(number) in logic_string for number in range(1, num_args + 1)):
+            continue
+         self.assertEqual(get_jsonlogic(logic_string), jsonlogic, logic_string)
+         self.assertTrue(is_valid_logic_string(logic_string, num_args), logic_string)
+         for check in [has_valid_tokens, has_valid_left_parens, has_valid_right_parens, has_valid_and_or, has_valid_not, has_balanced_parens]:
+            self.assertTrue(check(logic_string), logic_string)
+
+class TestLogicStringCache(TestCase):
+
+   def test_equivalent_spacing_shares_an_entry(self):
+      cache = LogicStringCache()
+      self.assertEqual(cache.get_jsonlogic("(1  AND 2) OR NOT 3"), get_jsonlogic("(1 AND 2) OR NOT 3"))
+      self.assertEqual(cache.get_jsonlogic(" (1 AND 2)   OR NOT 3 "), get_jsonlogic("(1 AND 2) OR NOT 3"))
+      self.assertTrue(cache.is_valid("(1 AND 2) OR NOT 3", 3))
+      self.assertEqual(cache.cache_info(), (2, 1, 4096, 1))
+
+   def test_spaces_between_numbers_are_kept(self):
+      cache = LogicStringCache()
+      self.assertEqual(cache.get_jsonlogic("12"), "@12")
+      with self.assertRaises(LogicStringError):
+         cache.get_jsonlogic("1 2")
+
+   def test_results_are_copies(self):
+      cache = LogicStringCache()
+      jsonlogic = cache.get_jsonlogic("1 AND NOT 2")
+      jsonlogic["AND"][0]["NOT"].append("@3")
+      jsonlogic["OR"] = jsonlogic.pop("AND")
+      self.assertEqual(cache.get_jsonlogic("1 AND NOT 2"), {"AND": [{"NOT": ["@2"]}, "@1"]})
+
+   def test_validity_for_any_num_args(self):
+      cache = LogicStringCache()
+      test_strings = [
+         ["((1 AND NOT 2) OR (3 AND (4 OR 5)))", 5, True],
+         ["1 AND (2 OR 3)", 2, False],
+         ["1 AND (2 OR 3)", 3, True],
+         ["1 AND (2 OR 3)", 4, False],
+         ["0 AND 1", 1, False],
+         ["1 AND NOT 1", 1, True],
+         ["NOT NOT 1", 1, False],
+      ]
+      for test_string, num_args, result in test_strings + test_strings:
+         self.assertEqual(cache.is_valid(test_string, num_args), result, test_string)
+      self.assertEqual(cache.cache_info().currsize, 5)
+      self.assertFalse(cache.is_valid("1 AND 2", 1))
+      self.assertFalse(cache.is_valid("1 AND 2", 3))
+
+   def test_invalid_strings_raise_with_their_own_positions(self):
+      cache = LogicStringCache()
+      self.assertFalse(cache.is_valid("1 AND  x", 1))
+      with self.assertRaises(LogicStringError) as context:
+         cache.get_jsonlogic("1  AND  x")
+      self.assertEqual(context.exception.position, 8)
+      self.assertEqual(cache.cache_info().currsize, 1)
+
+   def test_least_recently_used_entry_is_evicted(self):
+      cache = LogicStringCache(maxsize=2)
+      cache.get_jsonlogic("1 AND 2")
+      cache.get_jsonlogic("1 OR 2")
+      cache.get_jsonlogic("1 AND 2")
+      cache.get_jsonlogic("NOT 1")
+      cache.get_jsonlogic("1 AND 2")
+      self.assertEqual(cache.cache_info(), (2, 3, 2, 2))
+      cache.cache_clear()
+      self.assertEqual(cache.cache_info(), (0, 0, 2, 0))
+
+   def test_concurrent_use(self):
+      cache = LogicStringCache(maxsize=8)
+      logic_strings = [str(number) + " AND (" + str(number + 1) + " OR NOT 1)" for number in range(1, 20)]
+      errors = []
+
+      def parse():
+         for _ in range(50):
+            for logic_string in logic_strings:
+               if cache.get_jsonlogic(logic_string) != parse_logic_string(logic_string):
+                  errors.append(logic_string)
+
+      threads = [threading.Thread(target=parse) for _ in range(4)]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      self.assertEqual(errors, [])
+      self.assertLessEqual(cache.cache_info().currsize, 8)
+
+class TestOptimizeJsonlogic(TestCase):
+
+   def test_examples(self):
+      test_strings = [
+         ["1 AND 2 AND 3 AND 4", {"AND": ["@4", "@3", "@2", "@1"]}],
+         ["1 OR (2 OR (3 AND (4 AND 5)))", {"OR": [{"AND": ["@5", "@4", "@3"]}, "@2", "@1"]}],
+         ["NOT (NOT 1)", "@1"],
+         ["NOT (NOT 1 OR NOT 2)", {"AND": ["@2", "@1"]}],
+         ["NOT (NOT 1 AND NOT 2 AND 3)", {"OR": [{"NOT": ["@3"]}, "@2", "@1"]}],
+         ["1 AND 1", "@1"],
+         ["(1 OR 2) AND 3 AND (1 OR 2)", {"AND": [{"OR": ["@2", "@1"]}, "@3"]}],
+         # De Morgan would not remove a NOT here
+         ["NOT (1 OR 2)", {"NOT": [{"OR": ["@2", "@1"]}]}],
+         ["NOT (2 OR (1 AND NOT 2))", {"NOT": [{"OR": [{"AND": [{"NOT": ["@2"]}, "@1"]}, "@2"]}]}],
+      ]
+      for test_string, jsonlogic in test_strings:
+         self.assertEqual(optimize_jsonlogic(get_jsonlogic(test_string)), jsonlogic, test_string)
+
+   def test_input_is_not_changed(self):
+      jsonlogic = get_jsonlogic("NOT (NOT 1 OR NOT (2 AND 3 AND 2))")
+      unchanged = copy.deepcopy(jsonlogic)
+      optimize_jsonlogic(jsonlogic)
+      self.assertEqual(jsonlogic, unchanged)
+
+   def test_truth_tables_are_kept(self):
+      rand = random.Random(1)
+      for _ in range(1000):
+         num_args = rand.randint(1, 6)
+         jsonlogic = get_random_expression(rand, num_args, 0)[1]
+         optimized = optimize_jsonlogic(jsonlogic)
+         for values in itertools.product([False, True], repeat=num_args):
+            self.assertEqual(evaluate(optimized, values), evaluate(jsonlogic, values), jsonlogic)
+         self.assertLessEqual(count_nodes(optimized), count_nodes(jsonlogic))
+         self.assertFalse(has_redundant_nesting(optimized), optimized)
+
+   def test_long_chain(self):
+      logic_string = " AND ".join(str(number) for number in range(1, 5001))
+      self.assertEqual(optimize_jsonlogic(get_jsonlogic(logic_string)), {"AND": ["@" + str(number) for number in range(5000, 0, -1)]})
+
+def evaluate(jsonlogic, values):
+   if type(jsonlogic) == str:
+      return values[int(jsonlogic[1:]) - 1]
+   operator, operands = next(iter(jsonlogic.items()))
+   if operator == "NOT":
+      return not evaluate(operands[0], values)
+   results = [evaluate(operand, values) for operand in operands]
+   return all(results) if operator == "AND" else any(results)
+
+def count_nodes(jsonlogic):
+   if type(jsonlogic) == str:
+      return 1
+   return 1 + sum(count_nodes(operand) for operand in next(iter(jsonlogic.values())))
+
+def has_redundant_nesting(jsonlogic):
+   # an operand of the same kind as its AND/OR, a NOT of a NOT, a repeated operand or a single-operand AND/OR
+   if type(jsonlogic) == str:
+      return False
+   operator, operands = next(iter(jsonlogic.items()))
+   for operand in operands:
+      if type(operand) == dict and operator in operand:
+         return True
+   if operator != "NOT" and (len(operands) < 2 or any(operand in operands[:index] for index, operand in enumerate(operands))):
+      return True
+   return any(has_redundant_nesting(operand) for operand in operands)
+
+def get_random_expression(rand, num_args, depth):
+   # returns a logic string and the jsonlogic it stands for; AND/OR operands are listed right to left
+   choice = rand.random()
+   if depth > 4 or choice < 0.3:
+      number = str(rand.randint(1, num_args))
+      logic_string, jsonlogic = number, "@" + number
+   elif choice < 0.4:
+      logic_string, jsonlogic = get_random_expression(rand, num_args, depth + 1)
+      logic_string = "(" + logic_string + ")"
+   else:
+      operator = rand.choice(["AND", "OR"])
+      left_string, left_jsonlogic = get_random_expression(rand, num_args, depth + 1)
+      right_string, right_jsonlogic = get_random_expression(rand, num_args, depth + 1)
+      logic_string = "(" + left_string + rand.choice([" ", "", "  "]) + operator + " " + right_string + ")"
+      jsonlogic = {operator: [right_jsonlogic, left_jsonlogic]}
+   if rand.random() < 0.2:
+      logic_string, jsonlogic = "NOT (" + logic_string + ")", {"NOT": [jsonlogic]}
+   return logic_string, jsonlogic
@@ -97,6 +97,21 @@ class TestRule(TestCase):
             ]}
         )
 
+    def test_condition_placeholders_with_several_digits(self):
+        rule = Rule(name="test_rule_12", logic_string="10 OR (12 AND 1)", num_conditions=12)
+        rule.set_jsonlogic_only_boolean_symbols()
+        conditions_by_index = {rule_index: {"==": [{"var": "spoon_type"}, str(rule_index)]} for rule_index in range(1, 13)}
+        self.assertEqual(
+            rule.replace_jsonlogic_symbols_recur(rule.jsonlogic_only_boolean_symbols, conditions_by_index),
+            { "or" : [
+                { "and" : [
+                    {"==" : [{"var" : "spoon_type"}, "1"]},
+                    {"==" : [{"var" : "spoon_type"}, "12"]}
+                ]},
+                {"==" : [{"var" : "spoon_type"}, "10"]}
+            ]}
+        )
+
 class TestRuleActionPair(TestCase):
     
     def setUp(self):
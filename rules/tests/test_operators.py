@@ -0,0 +1,118 @@
+import itertools
+import random
+from unittest import mock
+
+from django.test import TestCase
+from json_logic import jsonLogic, operations as jsonlogic_operations
+
+from ..compiler import compile_jsonlogic
+from ..operators import get_literal_comparison, native_operations
+from .test_compiler import count_function_calls
+
+values = [None, True, False, 0, 1, -1, 4, 5, 2.5, 4.0, -0.0, 10 ** 20, 1e300, float('nan'), float('inf'), float('-inf'),
+          "", "0", "4", "4.0", "4.5", "-1", "abc", "green", "green yellow", "1e3", " 4", "nan", "True",
+          [], [1, 4], ["4"], {"4": 1}]
+literals = [value for value in values if type(value) not in (list, dict)]
+var_names = ["a", "b", "missing"]
+
+def get_outcome(function, *args):
+    # the result and its type, or the type of the error raised
+    try:
+        result = function(*args)
+    except Exception as error:
+        return ("error", type(error))
+    return ("result", type(result), result)
+
+def get_random_condition(rand):
+    operator = rand.choice(list(native_operations))
+    var = {"var": rand.choice(var_names)}
+    if rand.random() < 0.2:
+        var = {"var": [var["var"], rand.choice(literals)]}
+    kind = rand.random()
+    if kind < 0.6:
+        args = [var, rand.choice(literals)]
+    elif kind < 0.8:
+        args = [rand.choice(literals), var]
+    elif kind < 0.9:
+        args = [var, {"var": rand.choice(var_names)}]
+    else:
+        args = [var, rand.choice(values)]
+    if operator in ('<', '<=') and rand.random() < 0.1:
+        args.append(rand.choice(literals))
+    return {operator: args}
+
+def get_random_statement(rand, depth=0):
+    if depth > 3 or rand.random() < 0.3:
+        return get_random_condition(rand)
+    kind = rand.choice(["and", "or", "!", "if"])
+    if kind == "!":
+        return {"!": [get_random_statement(rand, depth + 1)]}
+    num_args = rand.randint(1, 4)
+    return {kind: [get_random_statement(rand, depth + 1) for _ in range(num_args)]}
+
+class TestNativeOperators(TestCase):
+
+    def test_operators_match_json_logic(self):
+        for operator, operation in native_operations.items():
+            for a, b in itertools.product(values, repeat=2):
+                self.assertEqual(get_outcome(operation, a, b), get_outcome(jsonlogic_operations[operator], a, b), (operator, a, b))
+        for operator in ('<', '<='):
+            for a, b, c in itertools.product(literals, repeat=3):
+                self.assertEqual(get_outcome(native_operations[operator], a, b, c),
+                                 get_outcome(jsonlogic_operations[operator], a, b, c), (operator, a, b, c))
+
+    def test_literal_comparisons_match_json_logic(self):
+        for operator, operation in jsonlogic_operations.items():
+            if operator not in native_operations:
+                continue
+            for literal in literals:
+                right = get_literal_comparison(operator, literal, literal_is_right=True)
+                left = get_literal_comparison(operator, literal, literal_is_right=False)
+                for value in values:
+                    self.assertEqual(get_outcome(right, value), get_outcome(operation, value, literal), (operator, value, literal))
+                    self.assertEqual(get_outcome(left, value), get_outcome(operation, literal, value), (operator, literal, value))
+
+    def test_compiled_statements_match_jsonlogic(self):
+        rand = random.Random(25)
+        for _ in range(2000):
+            statement = get_random_statement(rand)
+            compiled = compile_jsonlogic(statement)
+            for _ in range(5):
+                data = {var_name: rand.choice(values) for var_name in var_names[:2] if rand.random() < 0.9}
+                self.assertEqual(get_outcome(compiled, data), get_outcome(jsonLogic, statement, data), (statement, data))
+
+    def test_native_conditions_do_less_work_than_json_logic_operators(self):
+        conditions = [
+            {">": [{"var": "counter"}, "4"]},
+            {"<=": [{"var": "counter"}, 4.5]},
+            {"==": [{"var": "color"}, "green"]},
+            {"!=": [{"var": "color"}, "red"]},
+        ]
+        data = {"color": "green", "counter": 5}
+
+        def compile_with_json_logic_operator(condition):
+            # how conditions were compiled before: a var closure, a literal closure and json_logic's operator
+            operator = list(condition.keys())[0]
+            var, literal = condition[operator]
+            var_name = var["var"]
+            operation = jsonlogic_operations[operator]
+
+            def get_var(data):
+                try:
+                    return data[var_name]
+                except (KeyError, TypeError):
+                    return None
+            get_literal = lambda data: literal
+            return lambda data: operation(get_var(data), get_literal(data))
+
+        failing_operations = {operator: mock.Mock(side_effect=AssertionError(operator + ' went through json_logic'))
+                              for operator in native_operations}
+        with mock.patch.dict(jsonlogic_operations, failing_operations):
+            native = [compile_jsonlogic(condition).function for condition in conditions]
+            native_results = [function(data) for function in native]
+        json_logic = [compile_with_json_logic_operator(condition) for condition in conditions]
+        self.assertEqual(native_results, [function(data) for function in json_logic])
+        # the calls made are counted rather than timed; the lookup and the comparison take at most three
+        for native_function, json_logic_function in zip(native, json_logic):
+            self.assertLessEqual(count_function_calls(native_function, data), 3)
+            self.assertLess(count_function_calls(native_function, data), count_function_calls(json_logic_function, data))
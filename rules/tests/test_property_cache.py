@@ -0,0 +1,116 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..property_cache import memoize
+from . import _trafficlightrules
+from ._trafficlightrules import Trafficlight, make_trafficlight_rule_manager
+from .test_eval_rules import build_turn_yellow_rule, build_turn_red_rule, build_turn_green_rule
+
+class FakeTimer():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestMemoize(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def get_square(self, **memoize_options):
+        @memoize(**memoize_options)
+        def square(number):
+            self.calls.append(number)
+            return number * number
+        return square
+
+    def test_hits_and_misses(self):
+        square = self.get_square()
+        self.assertEqual([square(n) for n in [2, 3, 2, 2, 3]], [4, 9, 4, 4, 9])
+        self.assertEqual(self.calls, [2, 3])
+        self.assertEqual(square.cache_info(), (3, 2, 128, 2))
+        self.assertEqual(square.__name__, "square")
+
+    def test_lru_eviction(self):
+        square = self.get_square(maxsize=2)
+        for number in [1, 2, 1, 3, 1, 2]:
+            square(number)
+        # 2 is the least recently used entry when 3 arrives
+        self.assertEqual(self.calls, [1, 2, 3, 2])
+
+    def test_fifo_eviction(self):
+        square = self.get_square(maxsize=2, eviction="fifo")
+        for number in [1, 2, 1, 3, 1]:
+            square(number)
+        # 1 is the oldest entry when 3 arrives, even though it was just read
+        self.assertEqual(self.calls, [1, 2, 3, 1])
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        square = self.get_square(ttl=10, timer=timer)
+        square(2)
+        timer.now = 9.5
+        square(2)
+        timer.now = 10.0
+        square(2)
+        self.assertEqual(self.calls, [2, 2])
+        self.assertEqual(square.cache_info().hits, 1)
+
+    def test_key_projection_and_unhashable_context_vars(self):
+        @memoize(key=lambda tl: tl.color)
+        def get_color(tl):
+            self.calls.append(tl.color)
+            return tl.color
+
+        tl = Trafficlight()
+        other_tl = Trafficlight()
+        self.assertEqual(get_color(tl), 'green')
+        self.assertEqual(get_color(other_tl), 'green')
+        self.assertEqual(self.calls, ['green'])
+
+        square_all = self.get_square()
+        with self.assertRaises(TypeError):
+            square_all([1, 2])
+        self.assertEqual(square_all.cache_info().misses, 1)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            self.get_square(eviction="random")
+        with self.assertRaises(ValueError):
+            self.get_square(maxsize=0)
+
+class TestMemoizedRuleManager(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_rule()
+        build_turn_red_rule()
+        build_turn_green_rule()
+        self.calls = []
+
+        @memoize(maxsize=16)
+        def get_trafficlight_color(color):
+            self.calls.append(color)
+            return color
+
+        self.get_trafficlight_color = get_trafficlight_color
+        self.rule_manager = make_trafficlight_rule_manager(
+            property_function_dict={
+                "trafficlight_color": [get_trafficlight_color],
+                "trafficlight_counter": [_trafficlightrules.get_trafficlight_counter],
+            },
+        )
+
+    def test_property_computed_once_per_distinct_input(self):
+        tl = Trafficlight()
+        for _ in range(9):
+            self.rule_manager.eval_first_true_rule(
+                "turn-yellow", "turn-green", "turn-red",
+                trafficlight=tl,
+                trafficlight_color=tl.color,
+                trafficlight_counter=tl.counter)
+        self.assertEqual(tl.color, 'green')
+        self.assertEqual(self.calls, ['green', 'yellow', 'red'])
+        self.assertEqual(self.get_trafficlight_color.cache_info(), (6, 3, 16, 3))
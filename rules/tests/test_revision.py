@@ -0,0 +1,165 @@
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+
+from ..compiler import compiled_if_statement_cache
+from ..models import Action, Property, BoolOperator, Rule, RuleActionPair, RuleSetRevision
+from ..revision import RevisionMonitor, get_database_revision
+from ._trafficlightrules import Trafficlight, make_trafficlight_rule_manager
+from .test_eval_rules import build_turn_yellow_rule, build_turn_red_rule, build_turn_green_rule
+
+class FakeTimer():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def change_rules_in_another_process(rule_name, action_function_name):
+    # queryset updates send no signals, so this process only learns about the change from the database revision
+    action = Action.objects.get(function_name=action_function_name)
+    rule_action_pair = RuleActionPair.objects.get(rule__name=rule_name)
+    if_statement = rule_action_pair.jsonlogic_if_statement
+    if_statement["if"][1] = action_function_name
+    RuleActionPair.objects.filter(pk=rule_action_pair.pk).update(action=action, jsonlogic_if_statement=if_statement)
+    RuleSetRevision.objects.filter(pk=1).update(revision=F('revision') + 1)
+
+class TestRevision(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        # the test's transaction never commits, so the revision bumps scheduled for the commit are run here
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('createrulemodels')
+            build_turn_yellow_rule()
+            build_turn_red_rule()
+            build_turn_green_rule()
+        self.rules = ("turn-yellow", "turn-green", "turn-red")
+
+    def assertBumpsRevision(self, function):
+        revision = get_database_revision()
+        with self.captureOnCommitCallbacks(execute=True):
+            function()
+        self.assertEqual(get_database_revision(), revision + 1)
+
+    def test_saving_and_deleting_any_rule_model_bumps_the_revision(self):
+        action = Action.objects.get(function_name="set_color_to_red")
+        prop = Property.objects.get(function_name="get_trafficlight_counter")
+        operator = BoolOperator.objects.get(jsonlogic_operator=">")
+        for model_object in [action, prop, operator]:
+            self.assertBumpsRevision(model_object.save)
+        with self.captureOnCommitCallbacks(execute=True):
+            unused_property = Property.objects.create(function_name="unused", context_type="trafficlight_counter")
+        self.assertBumpsRevision(unused_property.delete)
+
+    def test_one_bump_per_transaction_after_the_commit(self):
+        revision = get_database_revision()
+        rule = Rule.objects.get(name="turn-yellow")
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(3):
+                for _ in range(3):
+                    rule.save()
+        self.assertEqual(get_database_revision(), revision)
+        # a single UPDATE, however many models the transaction saved
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(get_database_revision(), revision + 1)
+        self.assertBumpsRevision(rule.save)
+
+    def test_commit_drops_rules_compiled_during_the_transaction(self):
+        # another thread may compile the rows of before the commit after the save invalidated the cache
+        with self.captureOnCommitCallbacks(execute=True):
+            Rule.objects.get(name="turn-yellow").save()
+            cache_revision = compiled_if_statement_cache.revision
+        self.assertGreater(compiled_if_statement_cache.revision, cache_revision)
+
+    def test_rolled_back_changes_do_not_bump(self):
+        revision = get_database_revision()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Rule.objects.get(name="turn-yellow").save()
+                    raise ValueError('roll back')
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_database_revision(), revision)
+        self.assertBumpsRevision(Rule.objects.get(name="turn-yellow").save)
+
+    def test_rolled_back_savepoint_keeps_the_bump_pending(self):
+        revision = get_database_revision()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Rule.objects.get(name="turn-yellow").save()
+                    raise ValueError('roll back')
+            except ValueError:
+                pass
+            Rule.objects.get(name="turn-red").save()
+        self.assertEqual(get_database_revision(), revision + 1)
+
+    def test_bump_runs_on_the_database_of_the_change(self):
+        rule = Rule.objects.get(name="turn-yellow")
+        with mock.patch('rules.revision.transaction.on_commit') as on_commit:
+            rule.save(using="default")
+        self.assertEqual(on_commit.call_args.kwargs["using"], "default")
+        self.assertEqual(on_commit.call_args.args[0].using, "default")
+
+    def test_monitor_checks_at_most_once_per_interval(self):
+        timer = FakeTimer()
+        monitor = RevisionMonitor(check_interval=5, timer=timer)
+        with self.assertNumQueries(1):
+            monitor.check()
+            timer.now = 4.9
+            monitor.check()
+        timer.now = 5.0
+        with self.assertNumQueries(1):
+            monitor.check()
+        self.assertEqual(monitor.revision, get_database_revision())
+
+    def test_monitor_without_interval_never_checks(self):
+        monitor = RevisionMonitor(check_interval=None)
+        with self.assertNumQueries(0):
+            monitor.check()
+        self.assertIsNone(monitor.revision)
+
+    def test_rule_set_swapped_after_change_in_another_process(self):
+        rule_manager = make_trafficlight_rule_manager(revision_check_interval=10)
+        timer = FakeTimer()
+        rule_manager.revision_monitor.timer = timer
+        old_rule_set = rule_manager.get_rule_set(*self.rules)
+
+        change_rules_in_another_process("turn-yellow", "set_color_to_red")
+        timer.now = 9
+        self.assertIs(rule_manager.get_rule_set(*self.rules), old_rule_set)
+
+        timer.now = 10
+        new_rule_set = rule_manager.get_rule_set(*self.rules)
+        self.assertIsNot(new_rule_set, old_rule_set)
+        self.assertFalse(old_rule_set.is_current())
+        self.assertEqual(new_rule_set.entries[0].action_function_name, "set_color_to_red")
+
+        # an evaluation that already holds the old rule set finishes on it
+        old_results = rule_manager.eval_first_true_rule(old_rule_set, trafficlight=Trafficlight(), trafficlight_color='green',
+                                                        trafficlight_counter=0)
+        self.assertEqual(old_results["trafficlight"].color, 'yellow')
+        new_results = rule_manager.eval_first_true_rule(*self.rules, trafficlight=Trafficlight(), trafficlight_color='green',
+                                                        trafficlight_counter=0)
+        self.assertEqual(new_results["trafficlight"].color, 'red')
+
+    async def test_async_rule_set_swapped_after_change_in_another_process(self):
+        rule_manager = make_trafficlight_rule_manager(revision_check_interval=0)
+        old_rule_set = await rule_manager.aget_rule_set(*self.rules)
+        self.assertIs(await rule_manager.aget_rule_set(*self.rules), old_rule_set)
+
+        await sync_to_async(change_rules_in_another_process)("turn-yellow", "set_color_to_red")
+        new_rule_set = await rule_manager.aget_rule_set(*self.rules)
+        self.assertIsNot(new_rule_set, old_rule_set)
+        self.assertEqual(new_rule_set.entries[0].action_function_name, "set_color_to_red")
@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..models import Condition, BoolOperator, RuleActionPair
+from ..snapshot import SnapshotError, read_snapshot
+from ._trafficlightrules import TrafficLightRuleManager, Trafficlight, make_trafficlight_rule_manager
+from .test_eval_rules import (build_turn_yellow_on_counter, build_turn_red_on_counter, build_turn_green_on_counter,
+                              build_reset_counter_rule, build_inc_counter_rule)
+
+
+class TestSnapshot(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        # the test's transaction never commits, so the revision bumps scheduled for the commit are run here
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('createrulemodels')
+            build_turn_yellow_on_counter()
+            build_turn_red_on_counter()
+            build_turn_green_on_counter()
+            build_reset_counter_rule()
+            build_inc_counter_rule()
+        self.rules = ('count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "rules.snapshot")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_evaluates_without_the_database(self):
+        call_command('snapshotrules', self.path, *self.rules, stdout=io.StringIO())
+        rule_manager = make_trafficlight_rule_manager()
+        snapshot_tl = Trafficlight()
+        database_tl = Trafficlight()
+        database_rule_set = TrafficLightRuleManager.get_rule_set(*self.rules)
+        with self.assertNumQueries(0):
+            rule_set = rule_manager.load_snapshot(self.path, check_revision=False)
+            for _ in range(20):
+                rule_manager.eval_all_rules(*self.rules,
+                    trafficlight=snapshot_tl, trafficlight_color=snapshot_tl.color, trafficlight_counter=snapshot_tl.counter)
+                TrafficLightRuleManager.eval_all_rules(*self.rules,
+                    trafficlight=database_tl, trafficlight_color=database_tl.color, trafficlight_counter=database_tl.counter)
+                self.assertEqual(vars(snapshot_tl), vars(database_tl))
+
+        self.assertEqual(rule_set.rule_names, self.rules)
+        self.assertEqual(rule_set.var_names, database_rule_set.var_names)
+        self.assertEqual([(entry.rule_action_pair_id, entry.action_function_name, entry.compiled_if_statement.logic) for entry in rule_set],
+                         [(entry.rule_action_pair_id, entry.action_function_name, entry.compiled_if_statement.logic) for entry in database_rule_set])
+
+    def test_loading_uses_the_precomputed_section(self):
+        database_rule_set = make_trafficlight_rule_manager().export_snapshot(self.path, *self.rules)
+        with mock.patch('rules.indexes._get_equality_gate', side_effect=AssertionError('gates were recomputed')):
+            with mock.patch('rules.indexes._get_range_gate', side_effect=AssertionError('gates were recomputed')):
+                rule_set, _ = read_snapshot(self.path)
+        # the restored table hands out the stored slots without keying any condition
+        self.assertEqual(rule_set.shared_conditions.slots, {})
+        self.assertEqual(rule_set.shared_conditions.reference_slots, database_rule_set.shared_conditions.reference_slots)
+        self.assertEqual(len(rule_set.shared_conditions), len(database_rule_set.shared_conditions))
+        self.assertEqual(rule_set.sorted_var_names, database_rule_set.sorted_var_names)
+        self.assertEqual(rule_set.index.get_gates(), database_rule_set.index.get_gates())
+        for color, counter in [("green", 5), ("red", 2), ("yellow", 7)]:
+            data = {"get_trafficlight_color": color, "get_trafficlight_counter": counter}
+            self.assertEqual(list(rule_set.index.get_candidate_positions(data)),
+                             list(database_rule_set.index.get_candidate_positions(data)))
+
+    def test_stale_snapshot_falls_back_to_the_database(self):
+        rule_manager = make_trafficlight_rule_manager()
+        rule_manager.export_snapshot(self.path, 'inc_counter_rule')
+        with self.assertNumQueries(1):
+            rule_manager.load_snapshot(self.path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            condition = Condition.objects.get(rule__name='inc_counter_rule')
+            condition.operator = BoolOperator.objects.get(jsonlogic_operator=">", context_type="trafficlight_counter")
+            condition.save()
+            rap = RuleActionPair.objects.get(rule__name='inc_counter_rule')
+            rap.set_jsonlogic_if_statement()
+            rap.save()
+
+        rule_set = rule_manager.load_snapshot(self.path)
+        self.assertEqual(rule_set.entries[0].compiled_if_statement.logic, rap.jsonlogic_if_statement)
+        self.assertIs(rule_manager.get_rule_set('inc_counter_rule'), rule_set)
+
+    def test_invalid_snapshots(self):
+        make_trafficlight_rule_manager().export_snapshot(self.path, *self.rules)
+        with open(self.path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+        for corrupt_data in [data[:10], b'NOTRULES' + data[8:], data[:-1] + b'x', data[:-5]]:
+            with open(self.path, 'wb') as snapshot_file:
+                snapshot_file.write(corrupt_data)
+            with self.assertRaises(SnapshotError):
+                read_snapshot(self.path)
@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from json_logic import jsonLogic
+
+from ..vectorized import np, compile_vectorized_condition
+from ._trafficlightrules import TrafficLightRuleManager
+from .test_eval_rules import build_turn_yellow_on_counter, build_turn_red_on_counter, build_turn_green_on_counter
+from .test_eval_rules import build_reset_counter_rule, build_inc_counter_rule
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestVectorizedCondition(TestCase):
+
+    conditions = [
+        { "==": [{"var": "color"}, "green"] },
+        { "!=": [{"var": "color"}, "red"] },
+        { ">": [{"var": "counter"}, "4"] },
+        { "<=": [{"var": "counter"}, "4"] },
+        { ">=": ["3", {"var": "counter"}] },
+        { "<": [{"var": "ratio"}, "0.5"] },
+        { "==": [{"var": "counter"}, 4] },
+        { "==": [{"var": "counter"}, "4.0"] },
+        { "<=": [{"var": "ratio"}, 0.25] },
+        { "<": [{"var": "color"}, "red"] },
+        { "in": [{"var": "color"}, "green yellow"] },
+        { "in": [{"var": "counter"}, [1, 2, 3]] },
+        { ">": [{"var": "counter"}, {"var": "other_counter"}] },
+        { "and": [ { "==": [{"var": "color"}, "red"] }, { ">": [{"var": "counter"}, "4"] }, {"var": "counter"} ] },
+        { "or": [ { "==": [{"var": "color"}, "yellow"] }, { "!": [{ "<": [{"var": "counter"}, "2"] }] } ] },
+        { "!": [ { "and": [ { "==": [{"var": "maybe"}, "x"] }, { "==": ["a", "a"] } ] } ] },
+    ]
+
+    def get_columns(self, num_rows):
+        rand = random.Random(5)
+        return {
+            "color": [rand.choice(["green", "yellow", "red", ""]) for _ in range(num_rows)],
+            "counter": [rand.randint(-2, 8) for _ in range(num_rows)],
+            "other_counter": [rand.randint(-2, 8) for _ in range(num_rows)],
+            "ratio": [rand.choice([0.25, 0.5, 0.75, float(rand.randint(0, 2))]) for _ in range(num_rows)],
+            "maybe": [rand.choice(["x", None, 3]) for _ in range(num_rows)],
+        }
+
+    def test_masks_match_jsonlogic(self):
+        num_rows = 300
+        columns = self.get_columns(num_rows)
+        rows = [{name: column[row] for name, column in columns.items()} for row in range(num_rows)]
+        np_columns = {name: np.array(column) if name != "maybe" else np.array(column, dtype=object) for name, column in columns.items()}
+        for condition in self.conditions:
+            mask = compile_vectorized_condition(condition)(np_columns, num_rows)
+            expected = [bool(jsonLogic(condition, row)) for row in rows]
+            self.assertEqual(mask.tolist(), expected, condition)
+
+    def test_and_or_skip_decided_rows(self):
+        # jsonLogic never compares "abc" with 4: the first operand already decides that row
+        rows = [{"kind": "num", "v": "5"}, {"kind": "txt", "v": "abc"}]
+        columns = {"kind": np.array(["num", "txt"]), "v": np.array(["5", "abc"])}
+        for condition in [
+            { "and": [ { "==": [{"var": "kind"}, "num"] }, { ">": [{"var": "v"}, 4] } ] },
+            { "or": [ { "!=": [{"var": "kind"}, "num"] }, { ">": [{"var": "v"}, 4] } ] },
+        ]:
+            expected = [bool(jsonLogic(condition, row)) for row in rows]
+            self.assertEqual(compile_vectorized_condition(condition)(columns, 2).tolist(), expected, condition)
+
+    def test_unsupported_operator(self):
+        with self.assertRaises(ValueError):
+            compile_vectorized_condition({ "+": [{"var": "counter"}, 1] })
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestVectorizedRuleManager(TestCase):
+
+    @override_settings(RULES_MODELS_SETUP_MODULES=["rules.tests._trafficlightrules"])
+    def setUp(self):
+        call_command('createrulemodels')
+        build_turn_yellow_on_counter()
+        build_turn_red_on_counter()
+        build_turn_green_on_counter()
+        build_reset_counter_rule()
+        build_inc_counter_rule()
+        self.rules = ['count-turn-yellow', 'count-turn-red', 'count-turn-green', 'reset_counter_rule', 'inc_counter_rule']
+
+    def test_masks_and_first_true_indices(self):
+        colors = np.array(['green', 'yellow', 'red'] * 7)
+        counters = np.repeat(np.arange(7), 3)
+        context_columns = {"trafficlight_color": colors, "trafficlight_counter": counters}
+
+        masks = TrafficLightRuleManager.eval_rule_masks(context_columns, *self.rules)
+        indices = TrafficLightRuleManager.eval_first_true_rule_indices(context_columns, *self.rules)
+
+        rule_set = TrafficLightRuleManager.get_rule_set(*self.rules)
+        for row in range(len(colors)):
+            data = {"get_trafficlight_color": str(colors[row]), "get_trafficlight_counter": int(counters[row])}
+            fired = [entry.compiled_if_statement(data) != "do_nothing" for entry in rule_set]
+            self.assertEqual(masks[:, row].tolist(), fired)
+            self.assertEqual(indices[row], fired.index(True) if True in fired else -1)
@@ -0,0 +1,244 @@
+'''
+Evaluates rule conditions over whole columns of property values with NumPy instead of once per row.
+
+A condition tree built from the BoolOperator.jsonlogic_op_list operators combined with and/or/! is compiled into a
+function from {property function name: array of property values} to a boolean mask. Comparisons follow the
+json_logic coercion rules (e.g. {">": [{"var": "get_trafficlight_counter"}, "4"]} compares numerically, "==" against
+a string compares string forms); columns and literals that have no NumPy fast path are compared element-wise with
+the json_logic operator itself. Like jsonLogic, and/or stop at the first operand that decides a row: each operand is
+evaluated only on the rows the operands before it left undecided, so a comparison that would raise on a row jsonLogic
+never reaches it on does not fail the batch. The masks agree with jsonLogic wherever jsonLogic returns a result.
+
+NumPy is an optional dependency and is only needed for this module.
+'''
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from json_logic import operations as jsonlogic_operations
+
+from .compiler import _is_logic, get_jsonlogic_depth, max_closure_depth
+from .indexes import get_if_statement_condition
+
+_comparison_operators = ('==', '!=', '>', '>=', '<', '<=', 'in')
+_numeric_kinds = 'iuf'
+
+class VectorizedRuleSet():
+    '''
+    Vectorized form of a RuleSet. The RuleSet's if-statements must have the form {"if": [condition, action, "do_nothing"]}.
+    '''
+
+    def __init__(self, rule_set):
+        _require_numpy()
+        self.rule_set = rule_set
+        self.conditions = [compile_vectorized_condition(_get_condition(entry.compiled_if_statement.logic)) for entry in rule_set]
+
+    def eval_masks(self, property_columns):
+        # one row per rule, one column per context
+        property_columns = _as_columns(property_columns)
+        num_rows = _get_num_rows(property_columns)
+        masks = np.zeros((len(self.conditions), num_rows), dtype=bool)
+        for index, condition in enumerate(self.conditions):
+            masks[index] = condition(property_columns, num_rows)
+        return masks
+
+    def eval_first_true_indices(self, property_columns):
+        # index of the first rule that fires for every context, -1 where no rule fires
+        masks = self.eval_masks(property_columns)
+        if not len(masks):
+            return np.full(_get_num_rows(_as_columns(property_columns)), -1)
+        indices = masks.argmax(axis=0)
+        indices[~masks.any(axis=0)] = -1
+        return indices
+
+def compile_vectorized_condition(logic):
+    _require_numpy()
+    if get_jsonlogic_depth(logic) > max_closure_depth:
+        raise ValueError('condition nested too deeply for vectorized evaluation')
+    function = _compile_node(logic)
+    return lambda property_columns, num_rows: _to_mask(function(property_columns), num_rows)
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('vectorized rule evaluation requires numpy')
+
+def _get_condition(if_statement):
+    condition = get_if_statement_condition(if_statement)
+    if condition is None:
+        raise ValueError('unsupported if-statement for vectorized evaluation: ' + str(if_statement))
+    return condition
+
+def _as_columns(property_columns):
+    return {name: np.asarray(column) for name, column in property_columns.items()}
+
+def _get_num_rows(property_columns):
+    lengths = set(len(column) for column in property_columns.values())
+    if len(lengths) > 1:
+        raise ValueError('property columns have different lengths')
+    return lengths.pop() if lengths else 0
+
+def _take_rows(property_columns, rows):
+    return {name: column[rows] for name, column in property_columns.items()}
+
+def _to_mask(value, num_rows):
+    if isinstance(value, _Column):
+        return _truthy(value.array)
+    return np.full(num_rows, bool(value))
+
+class _Column():
+    # wraps arrays so they can be told apart from list literals
+    def __init__(self, array):
+        self.array = array
+
+def _compile_node(logic):
+
+    if not _is_logic(logic):
+        return lambda property_columns: logic
+
+    operator = list(logic.keys())[0]
+    values = logic[operator]
+    if type(values) not in (list, tuple):
+        values = [values]
+
+    if operator == "var":
+        if len(values) != 1 or type(values[0]) != str:
+            raise ValueError('unsupported var for vectorized evaluation: ' + str(logic))
+        var_name = values[0]
+
+        def get_column(property_columns):
+            try:
+                return _Column(property_columns[var_name])
+            except KeyError:
+                raise ValueError('no column for property ' + var_name)
+        return get_column
+
+    arg_functions = [_compile_node(value) for value in values]
+
+    if operator in ("and", "or"):
+
+        def and_or_function(property_columns):
+            num_rows = _get_num_rows(property_columns)
+            mask = _to_mask(arg_functions[0](property_columns), num_rows).copy()
+            for arg_function in arg_functions[1:]:
+                # rows where an 'and' operand is true or an 'or' operand false are still undecided
+                rows = np.flatnonzero(mask if operator == "and" else ~mask)
+                if not len(rows):
+                    break
+                if len(rows) == num_rows:
+                    mask = _to_mask(arg_function(property_columns), num_rows).copy()
+                else:
+                    mask[rows] = _to_mask(arg_function(_take_rows(property_columns, rows)), len(rows))
+            return _Column(mask)
+        return and_or_function
+
+    if operator == "!":
+        first = arg_functions[0]
+
+        def not_function(property_columns):
+            result = _as_mask_or_bool(first(property_columns))
+            return not result if isinstance(result, bool) else _Column(~result)
+        return not_function
+
+    if operator in _comparison_operators and len(arg_functions) == 2:
+        left, right = arg_functions
+        return lambda property_columns: _compare(operator, left(property_columns), right(property_columns))
+
+    raise ValueError('unsupported operator for vectorized evaluation: ' + operator)
+
+def _as_mask_or_bool(value):
+    if isinstance(value, _Column):
+        return _truthy(value.array)
+    return bool(value)
+
+def _truthy(array):
+    if array.dtype.kind == 'b':
+        return array
+    if array.dtype.kind in _numeric_kinds:
+        return array != 0
+    if array.dtype.kind == 'U':
+        return array != ''
+    return _elementwise(bool, array)
+
+def _compare(operator, left, right):
+    if not isinstance(left, _Column) and not isinstance(right, _Column):
+        return jsonlogic_operations[operator](left, right)
+
+    if operator == '!=':
+        return _Column(~_compare('==', left, right).array)
+    if operator == '>':
+        return _compare('<', right, left)
+    if operator == '>=':
+        return _compare('<=', right, left)
+    if operator == '<=':
+        return _Column(_compare('<', left, right).array | _compare('==', left, right).array)
+
+    mask = None
+    if operator == '==':
+        mask = _fast_equal(left, right)
+    elif operator == '<':
+        mask = _fast_less_than(left, right)
+    if mask is None:
+        mask = _elementwise(jsonlogic_operations[operator], _get_operand(left), _get_operand(right))
+    return _Column(mask)
+
+def _get_operand(value):
+    return value.array if isinstance(value, _Column) else value
+
+def _elementwise(function, *operands):
+    arrays = []
+    for operand in operands:
+        if isinstance(operand, np.ndarray):
+            arrays.append(operand)
+        else:
+            # keep literals (including lists) as a single scalar object
+            scalar = np.empty((), dtype=object)
+            scalar[()] = operand
+            arrays.append(scalar)
+    return np.frompyfunc(function, len(arrays), 1)(*arrays).astype(bool)
+
+def _fast_equal(left, right):
+    if isinstance(left, _Column) and isinstance(right, _Column):
+        if left.array.dtype.kind in _numeric_kinds and right.array.dtype.kind in _numeric_kinds:
+            return left.array == right.array
+        return None
+    column, literal = (left.array, right) if isinstance(left, _Column) else (right.array, left)
+
+    if type(literal) == str:
+        # at least one string operand: json_logic compares the string forms
+        if column.dtype.kind in 'iub' or column.dtype.kind == 'U':
+            return column.astype(str) == literal
+        return None
+    if type(literal) in (int, float) and column.dtype.kind in _numeric_kinds:
+        return column == literal
+    return None
+
+def _fast_less_than(left, right):
+    if isinstance(left, _Column) and isinstance(right, _Column):
+        if left.array.dtype.kind in _numeric_kinds and right.array.dtype.kind in _numeric_kinds:
+            return left.array < right.array
+        return None
+
+    column = left.array if isinstance(left, _Column) else right.array
+    literal = right if isinstance(left, _Column) else left
+
+    if column.dtype.kind in _numeric_kinds and type(literal) in (int, float, str):
+        try:
+            literal = _to_numeric(literal)
+        except ValueError:
+            return None
+    elif not (column.dtype.kind == 'U' and type(literal) == str):
+        return None
+
+    if isinstance(left, _Column):
+        return column < literal
+    return literal < column
+
+def _to_numeric(value):
+    # json_logic's numeric coercion: "4" -> 4, "4.5" -> 4.5, 4.0 -> 4
+    if type(value) == str and '.' in value:
+        value = float(value)
+    if type(value) == float:
+        return int(value) if value.is_integer() else value
+    return int(value)